@@ -0,0 +1,275 @@
+"""Nearest-neighbour search backends for the face gallery.
+
+The exact backend is the plain brute-force scan ``recognize_face`` always
+did. For large galleries an inverted-file (IVF) index is built from the
+128-d encodings: a k-means coarse quantizer splits the gallery into lists
+and a query only scans the ``nprobe`` lists closest to it. An HNSW backend
+is available when the optional ``hnswlib`` package is installed.
+
+Every backend works in row positions of the gallery matrix, returns true
+euclidean distances (the metric ``face_recognition.face_distance`` uses) and
+can be persisted next to the SQLite database.
+"""
+import logging
+import os
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+try:
+    import hnswlib
+except ImportError:  # optional dependency
+    hnswlib = None
+
+logger = logging.getLogger(__name__)
+
+# Galleries smaller than this are always searched exactly
+ANN_MIN_GALLERY_SIZE = 10000
+
+# Recall-versus-latency presets: IVF lists probed / HNSW ef per query
+RECALL_PRESETS = {
+    'fast': {'nprobe': 2, 'ef': 32},
+    'balanced': {'nprobe': 8, 'ef': 96},
+    'accurate': {'nprobe': 32, 'ef': 256},
+}
+
+
+def pairwise_distances(queries: np.ndarray, encodings: np.ndarray) -> np.ndarray:
+    """Euclidean distances between every query row and every encoding row"""
+    # Compute in the gallery's dtype so a float32 gallery is never upcast (copied)
+    queries = np.atleast_2d(queries).astype(encodings.dtype, copy=False)
+    if len(encodings) == 0:
+        return np.empty((len(queries), 0), dtype=encodings.dtype)
+    sq = (np.einsum('ij,ij->i', queries, queries)[:, None]
+          + np.einsum('ij,ij->i', encodings, encodings)[None, :]
+          - 2.0 * queries @ encodings.T)
+    np.maximum(sq, 0.0, out=sq)
+    return np.sqrt(sq)
+
+
+def top_k(distances: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Indices and distances of the k smallest entries of each row, nearest first"""
+    distances = np.atleast_2d(distances)
+    k = min(k, distances.shape[1])
+    if k == 0:
+        return (np.empty((len(distances), 0), dtype=np.int64),
+                np.empty((len(distances), 0)))
+    if k < distances.shape[1]:
+        part = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    else:
+        part = np.tile(np.arange(k), (len(distances), 1))
+    part_distances = np.take_along_axis(distances, part, axis=1)
+    order = np.argsort(part_distances, axis=1)
+    return np.take_along_axis(part, order, axis=1), np.take_along_axis(part_distances, order, axis=1)
+
+
+class ExactIndex:
+    """Brute-force scan over the whole gallery"""
+
+    name = 'exact'
+
+    def __init__(self, recall: str = 'balanced'):
+        self.recall = recall
+        self.size = 0
+        self._encodings = np.empty((0, 0))
+
+    def build(self, encodings: np.ndarray):
+        self._encodings = encodings
+        self.size = len(encodings)
+
+    def search(self, queries: np.ndarray, k: int = 1):
+        return top_k(pairwise_distances(queries, self._encodings), k)
+
+    def describe(self) -> Dict:
+        return {'backend': self.name, 'size': self.size, 'recall': 'exact'}
+
+
+class IVFIndex:
+    """Inverted-file index with a k-means coarse quantizer"""
+
+    name = 'ivf'
+
+    def __init__(self, recall: str = 'balanced', n_lists: Optional[int] = None,
+                 kmeans_iterations: int = 10, seed: int = 0):
+        self.recall = recall
+        self.nprobe = RECALL_PRESETS.get(recall, RECALL_PRESETS['balanced'])['nprobe']
+        self.n_lists = n_lists
+        self.kmeans_iterations = kmeans_iterations
+        self.seed = seed
+        self.size = 0
+        self.centroids = np.empty((0, 0))
+        self.order = np.empty(0, dtype=np.int64)
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self._encodings = np.empty((0, 0))
+
+    def _assign(self, encodings: np.ndarray, chunk: int = 16384) -> np.ndarray:
+        labels = np.empty(len(encodings), dtype=np.int64)
+        for start in range(0, len(encodings), chunk):
+            block = pairwise_distances(encodings[start:start + chunk], self.centroids)
+            labels[start:start + chunk] = np.argmin(block, axis=1)
+        return labels
+
+    def build(self, encodings: np.ndarray):
+        n = len(encodings)
+        self._encodings = encodings
+        self.size = n
+        if n == 0:
+            self.centroids = np.empty((0, encodings.shape[1]))
+            self.order = np.empty(0, dtype=np.int64)
+            self.offsets = np.zeros(1, dtype=np.int64)
+            return
+
+        n_lists = self.n_lists or max(1, int(np.sqrt(n)))
+        n_lists = min(n_lists, n)
+        rng = np.random.default_rng(self.seed)
+
+        # Train the coarse quantizer on a sample, then assign every row
+        sample_size = min(n, 64 * n_lists)
+        sample = encodings[rng.choice(n, sample_size, replace=False)]
+        self.centroids = sample[rng.choice(sample_size, n_lists, replace=False)].copy()
+        for _ in range(self.kmeans_iterations):
+            labels = np.argmin(pairwise_distances(sample, self.centroids), axis=1)
+            sums = np.zeros_like(self.centroids)
+            np.add.at(sums, labels, sample)
+            counts = np.bincount(labels, minlength=n_lists)
+            filled = counts > 0
+            self.centroids[filled] = sums[filled] / counts[filled, None]
+
+        labels = self._assign(encodings)
+        self.order = np.argsort(labels, kind='stable')
+        self.offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(labels, minlength=n_lists), out=self.offsets[1:])
+
+    def search(self, queries: np.ndarray, k: int = 1):
+        queries = np.atleast_2d(queries)
+        k = min(k, self.size)
+        indices = np.full((len(queries), k), -1, dtype=np.int64)
+        distances = np.full((len(queries), k), np.inf)
+        if self.size == 0:
+            return indices, distances
+
+        nprobe = min(self.nprobe, len(self.centroids))
+        probes, _ = top_k(pairwise_distances(queries, self.centroids), nprobe)
+        for q, lists in enumerate(probes):
+            candidates = np.concatenate([self.order[self.offsets[l]:self.offsets[l + 1]] for l in lists])
+            if len(candidates) == 0:
+                continue
+            found, found_distances = top_k(pairwise_distances(queries[q], self._encodings[candidates]), k)
+            indices[q, :found.shape[1]] = candidates[found[0]]
+            distances[q, :found.shape[1]] = found_distances[0]
+        return indices, distances
+
+    def save(self, path: str, face_ids: np.ndarray):
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path, centroids=self.centroids, order=self.order,
+                 offsets=self.offsets, face_ids=face_ids[:self.size])
+        os.replace(tmp_path, path)
+
+    def load(self, path: str, encodings: np.ndarray, face_ids: np.ndarray) -> bool:
+        """Load a saved index if it still covers a prefix of the current gallery"""
+        if not os.path.exists(path):
+            return False
+        try:
+            with np.load(path) as data:
+                saved_ids = data['face_ids']
+                if len(saved_ids) > len(face_ids) or not np.array_equal(saved_ids, face_ids[:len(saved_ids)]):
+                    return False
+                self.centroids = data['centroids']
+                self.order = data['order']
+                self.offsets = data['offsets']
+        except (OSError, KeyError, ValueError):
+            return False
+        self.size = len(saved_ids)
+        self._encodings = encodings
+        return True
+
+    def describe(self) -> Dict:
+        return {'backend': self.name, 'size': self.size, 'recall': self.recall,
+                'lists': len(self.centroids), 'nprobe': self.nprobe}
+
+
+class HNSWIndex:
+    """Hierarchical navigable small-world graph (requires hnswlib)"""
+
+    name = 'hnsw'
+
+    def __init__(self, recall: str = 'balanced', m: int = 16, ef_construction: int = 200):
+        if hnswlib is None:
+            raise ImportError("The 'hnsw' backend requires the hnswlib package")
+        self.recall = recall
+        self.ef = RECALL_PRESETS.get(recall, RECALL_PRESETS['balanced'])['ef']
+        self.m = m
+        self.ef_construction = ef_construction
+        self.size = 0
+        self._index = None
+
+    def build(self, encodings: np.ndarray):
+        self._index = hnswlib.Index(space='l2', dim=encodings.shape[1])
+        self._index.init_index(max_elements=max(len(encodings), 1), M=self.m,
+                               ef_construction=self.ef_construction)
+        if len(encodings):
+            self._index.add_items(encodings, np.arange(len(encodings)))
+        self._index.set_ef(self.ef)
+        self.size = len(encodings)
+
+    def search(self, queries: np.ndarray, k: int = 1):
+        queries = np.atleast_2d(queries)
+        k = min(k, self.size)
+        if k == 0:
+            return np.empty((len(queries), 0), dtype=np.int64), np.empty((len(queries), 0))
+        self._index.set_ef(max(self.ef, k))
+        labels, squared = self._index.knn_query(queries, k=k)
+        return labels.astype(np.int64), np.sqrt(np.maximum(squared, 0.0))
+
+    def save(self, path: str, face_ids: np.ndarray):
+        self._index.save_index(path)
+        np.save(path + '.ids.npy', face_ids[:self.size])
+
+    def load(self, path: str, encodings: np.ndarray, face_ids: np.ndarray) -> bool:
+        """Load a saved index if it still covers a prefix of the current gallery"""
+        ids_path = path + '.ids.npy'
+        if not (os.path.exists(path) and os.path.exists(ids_path)):
+            return False
+        try:
+            saved_ids = np.load(ids_path)
+            if len(saved_ids) > len(face_ids) or not np.array_equal(saved_ids, face_ids[:len(saved_ids)]):
+                return False
+            index = hnswlib.Index(space='l2', dim=encodings.shape[1])
+            index.load_index(path, max_elements=max(len(saved_ids), 1))
+        except (OSError, RuntimeError, ValueError):
+            # Truncated, corrupt or not an hnswlib file: rebuild instead
+            return False
+        self._index = index
+        self._index.set_ef(self.ef)
+        self.size = len(saved_ids)
+        return True
+
+    def describe(self) -> Dict:
+        return {'backend': self.name, 'size': self.size, 'recall': self.recall, 'ef': self.ef}
+
+
+ANN_BACKENDS = {'exact': ExactIndex, 'ivf': IVFIndex}
+if hnswlib is not None:
+    ANN_BACKENDS['hnsw'] = HNSWIndex
+
+
+def make_index(backend: str = 'ivf', recall: str = 'balanced'):
+    """Create an index for ``backend``, falling back to IVF if it is unavailable"""
+    index_cls = ANN_BACKENDS.get(backend)
+    if index_cls is None:
+        logger.warning("ANN backend '%s' is not available (hnswlib missing or unknown name); using 'ivf'", backend)
+        index_cls = IVFIndex
+    return index_cls(recall=recall)
+
+
+def index_path(db_path: str, backend: str, rows: str = 'nearest') -> str:
+    """Location of the persisted index file beside the SQLite database.
+
+    ``backend`` should be the ``name`` of the index actually created, so a
+    fallback index is never saved under another backend's file name.
+    ``rows`` is the gallery match mode: per-sample ('nearest') and per-person
+    ('centroid') galleries are indexed in separate files.
+    """
+    extension = '.bin' if backend == 'hnsw' else '.npz'
+    suffix = '' if rows == 'nearest' else f'.{rows}'
+    return f"{os.path.splitext(db_path)[0]}.{backend}{suffix}{extension}"
@@ -0,0 +1,82 @@
+"""Recall and latency of the ANN backends against exact face_distance.
+
+Usage:
+    python benchmarks/ann_recall.py --size 100000 --queries 500
+
+Encodings are synthetic (identities drawn around random centres, queries are
+noisy re-captures of enrolled identities) unless --db points at a database
+whose faces table should be used instead.
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ann_index import ANN_BACKENDS, RECALL_PRESETS, make_index  # noqa: E402
+from encoding_format import decode_encoding  # noqa: E402
+
+try:
+    from face_recognition import face_distance
+except ImportError:
+    def face_distance(face_encodings, face_to_compare):
+        return np.linalg.norm(face_encodings - face_to_compare, axis=1)
+
+
+def synthetic_gallery(size: int, dim: int = 128, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(scale=0.1, size=(max(size // 50, 1), dim))
+    gallery = centres[rng.integers(len(centres), size=size)] + rng.normal(scale=0.05, size=(size, dim))
+    return gallery
+
+
+def database_gallery(db_path: str):
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute('SELECT encoding FROM faces').fetchall()
+    conn.close()
+    return np.array([decode_encoding(row[0]) for row in rows])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=100000, help='synthetic gallery size')
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--db', help='use encodings from this SQLite database instead')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    gallery = database_gallery(args.db) if args.db else synthetic_gallery(args.size, seed=args.seed)
+    rng = np.random.default_rng(args.seed + 1)
+    queries = gallery[rng.integers(len(gallery), size=args.queries)] + rng.normal(scale=0.03, size=(args.queries, gallery.shape[1]))
+
+    # Ground truth: the argmin recognize_face used to compute
+    start = time.perf_counter()
+    truth = np.array([np.argmin(face_distance(gallery, q)) for q in queries])
+    exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    print(f"gallery={len(gallery)} queries={len(queries)}")
+    print(f"{'backend':<8} {'recall':<9} {'build s':>8} {'ms/query':>9} {'recall@1':>9}")
+    print(f"{'exact':<8} {'-':<9} {0.0:>8.2f} {exact_ms:>9.3f} {1.0:>9.4f}")
+
+    for backend in ANN_BACKENDS:
+        if backend == 'exact':
+            continue
+        for recall in RECALL_PRESETS:
+            index = make_index(backend, recall)
+            start = time.perf_counter()
+            index.build(gallery)
+            build_s = time.perf_counter() - start
+
+            start = time.perf_counter()
+            found = np.array([index.search(q, k=1)[0][0, 0] for q in queries])
+            query_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+            print(f"{backend:<8} {recall:<9} {build_s:>8.2f} {query_ms:>9.3f} {np.mean(found == truth):>9.4f}")
+
+
+if __name__ == '__main__':
+    main()
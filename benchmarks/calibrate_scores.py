@@ -0,0 +1,91 @@
+"""Fit the logistic distance-to-probability calibration on enrolled samples.
+
+Usage:
+    python benchmarks/calibrate_scores.py [path/to/database.db] [--impostors 20000]
+
+Same-person distances come from people enrolled with several samples
+(face_encodings), different-person distances from random pairs of samples
+of different people. Prints the fitted KHOYA_SCORE_* settings, the
+probability they give at a few distances and how well the current setting
+separates the two kinds of pairs at the default 0.6 tolerance.
+"""
+import argparse
+import os
+import sqlite3
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from encoding_format import EncodingFormatError, decode_encoding  # noqa: E402
+from schema import migrate  # noqa: E402
+from scoring import ScoreCalibration, fit_logistic  # noqa: E402
+
+TOLERANCE = 0.6
+
+
+def load_samples(db_path: str):
+    """(encodings, face_ids) of every readable sample"""
+    conn = sqlite3.connect(db_path)
+    migrate(conn.cursor())
+    conn.commit()
+    encodings, face_ids = [], []
+    for face_id, blob in conn.execute("SELECT face_id, encoding FROM face_encodings ORDER BY face_id, id"):
+        try:
+            encodings.append(decode_encoding(blob))
+        except EncodingFormatError:
+            continue
+        face_ids.append(face_id)
+    conn.close()
+    return np.array(encodings), np.array(face_ids)
+
+
+def pair_distances(encodings: np.ndarray, face_ids: np.ndarray, impostors: int, seed: int = 0):
+    """(same-person distances, different-person distances)"""
+    genuine = []
+    for face_id in np.unique(face_ids):
+        rows = encodings[face_ids == face_id]
+        for i in range(len(rows)):
+            genuine.extend(np.linalg.norm(rows[i + 1:] - rows[i], axis=1))
+
+    rng = np.random.default_rng(seed)
+    a = rng.integers(len(encodings), size=impostors)
+    b = rng.integers(len(encodings), size=impostors)
+    different = face_ids[a] != face_ids[b]
+    impostor = np.linalg.norm(encodings[a[different]] - encodings[b[different]], axis=1)
+    return np.array(genuine), impostor
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('db', nargs='?', default=os.environ.get('KHOYA_DB_PATH', 'database/advanced_faces.db'))
+    parser.add_argument('--impostors', type=int, default=20000, help='random different-person pairs')
+    args = parser.parse_args()
+
+    encodings, face_ids = load_samples(args.db)
+    genuine, impostor = pair_distances(encodings, face_ids, args.impostors)
+    if len(genuine) == 0 or len(impostor) == 0:
+        print("Need at least one person with several samples and two different people")
+        return 1
+
+    fitted = fit_logistic(genuine, impostor)
+    current = ScoreCalibration()
+    print(f"{len(genuine)} same-person pairs, {len(impostor)} different-person pairs")
+    print(f"same-person distance   median {np.median(genuine):.3f}  p95 {np.percentile(genuine, 95):.3f}")
+    print(f"different-person dist  median {np.median(impostor):.3f}  p5  {np.percentile(impostor, 5):.3f}")
+    print(f"false rejects at {TOLERANCE}: {np.mean(genuine > TOLERANCE):.2%}  "
+          f"false accepts: {np.mean(impostor <= TOLERANCE):.2%}")
+    print()
+    print(f"{'distance':>8} {'current':>8} {'fitted':>8}")
+    for distance in (0.3, 0.4, 0.45, 0.5, 0.55, 0.6, 0.7):
+        print(f"{distance:>8.2f} {current.probability(distance):>8.3f} {fitted.probability(distance):>8.3f}")
+    print()
+    print("KHOYA_SCORE_CALIBRATION=logistic")
+    print(f"KHOYA_SCORE_MIDPOINT={fitted.midpoint:.4f}")
+    print(f"KHOYA_SCORE_SLOPE={fitted.slope:.2f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
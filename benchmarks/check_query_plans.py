@@ -0,0 +1,104 @@
+"""EXPLAIN QUERY PLAN regression check for the hot log and history queries.
+
+Usage:
+    python benchmarks/check_query_plans.py [path/to/database.db]
+
+Builds a fresh in-memory database at the latest schema version (or opens
+the given database, which is migrated first), runs EXPLAIN QUERY PLAN on
+each query the app issues against the log and history tables, and exits
+non-zero if any of them scans one of those tables instead of using an index.
+The queries are the SQL constants and page-query builders in recognition.py,
+so this checks what the app runs; tests/test_query_plans.py runs the same
+check under pytest.
+"""
+import os
+import re
+import sqlite3
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from recognition import (FACE_RECENT_SCANS_SQL, FACE_SAMPLES_SQL, FACE_SCAN_HISTORY_SQL,  # noqa: E402
+                         LOG_METHODS_SQL, RECENT_ACTIVITY_SQL, USER_PROFILE_SUMMARY_SQL,
+                         USER_RECOGNITION_HISTORY_SQL, USER_RECOGNITION_SUMMARIES_SQL, DatabaseManager,
+                         FaceRecognitionManager, LogFilters)
+from schema import connect_memory, explain_query_plan, migrate  # noqa: E402
+
+# Tables that grow without bound and must never be scanned
+LOG_TABLES = ('recognition_logs', 'face_scan_history', 'user_profiles', 'user_face_counts', 'faces',
+              'face_encodings')
+
+SQL_KEYWORDS = {'WHERE', 'ORDER', 'GROUP', 'LEFT', 'JOIN', 'INNER', 'ON', 'LIMIT', 'SET', 'VALUES'}
+
+# The app's hot queries, built from the SQL recognition.py executes
+HOT_QUERIES = {
+    'user_recognition_history': (USER_RECOGNITION_HISTORY_SQL, (1, 50)),
+    'get_face_scan_history': (FACE_SCAN_HISTORY_SQL, (1, 50)),
+    'get_face_profile_recent_scans': (FACE_RECENT_SCANS_SQL, (1,)),
+    'recent_activity': (RECENT_ACTIVITY_SQL, (20,)),
+    'log_methods': (LOG_METHODS_SQL, ()),
+    'recognition_logs_page': DatabaseManager.recognition_logs_page_query(
+        LogFilters(), ('2024-01-01 00:00:00', 100), 50),
+    'recognition_logs_page_by_user': DatabaseManager.recognition_logs_page_query(
+        LogFilters(user_id=1, start='2024-01-01 00:00:00', end='2024-02-01 00:00:00'), None, 50),
+    'recognition_logs_page_by_person': DatabaseManager.recognition_logs_page_query(
+        LogFilters(person='Alice', method='live_camera'), None, 50),
+    'user_recognition_summaries': (USER_RECOGNITION_SUMMARIES_SQL, ()),
+    'user_profile_summary': (USER_PROFILE_SUMMARY_SQL, (1, 1)),
+    'user_face_counts_page': DatabaseManager.user_face_counts_page_query(1, ('2024-01-01 00:00:00', 10), 50),
+    'faces_page': FaceRecognitionManager.faces_page_query('', ('2024-01-01 00:00:00', 10), 24),
+    'faces_page_search': FaceRecognitionManager.faces_page_query('eng', None, 24),
+    'face_samples': (FACE_SAMPLES_SQL, (1,)),
+}
+
+
+def log_table_names(sql):
+    """The log tables a query reads, under their own names and any aliases"""
+    names = set(LOG_TABLES)
+    for table, alias in re.findall(r'\b(%s)\s+(?:AS\s+)?(\w+)' % '|'.join(LOG_TABLES), sql, re.IGNORECASE):
+        if alias.upper() not in SQL_KEYWORDS:
+            names.add(alias)
+    return names
+
+
+def full_scans(sql, plan):
+    """Plan lines that read a whole log table.
+
+    A SCAN without an index reads every row. A SCAN through an index is
+    only cheap when the index also supplies the ORDER BY, so LIMIT can stop
+    early; if SQLite still sorts in a temp b-tree, every row was read first.
+    """
+    names = log_table_names(sql)
+    sorted_after = any(detail.startswith('USE TEMP B-TREE FOR ORDER BY') for detail in plan)
+    return [detail for detail in plan
+            if detail.startswith('SCAN ') and detail.split()[1] in names
+            and ('INDEX' not in detail or sorted_after)]
+
+
+def main():
+    if len(sys.argv) > 1:
+        conn = sqlite3.connect(sys.argv[1])
+        migrate(conn.cursor())
+    else:
+        conn = connect_memory()
+    cursor = conn.cursor()
+
+    failures = 0
+    for name, (sql, params) in HOT_QUERIES.items():
+        plan = explain_query_plan(cursor, sql, params)
+        bad = full_scans(sql, plan)
+        status = 'FAIL' if bad else 'ok'
+        failures += bool(bad)
+        print(f"[{status}] {name}")
+        for detail in plan:
+            print(f"        {detail}")
+
+    conn.rollback()
+    conn.close()
+    if failures:
+        print(f"{failures} hot queries scan a log table")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""Detection latency and accuracy across detection resolutions.
+
+Usage:
+    python benchmarks/detection_scaling.py [--sides 0 1600 1200 800 480 320] [--repeat 3]
+
+Runs the detect-on-downscaled-copy pipeline over the sample images in
+photos/ and faces/ (plus any extra paths given) at each maximum detection
+side. 0 means full resolution and is the accuracy baseline: for every other
+setting the report shows how many baseline faces were still found, the mean
+box IoU and the largest encoding drift (euclidean distance between the
+encoding computed from the mapped box and the baseline encoding; the
+recognition tolerance is 0.6).
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from face_pipeline import detect_faces, encode_faces, to_rgb_array  # noqa: E402
+
+IMAGE_PATTERNS = ('*.jpg', '*.jpeg', '*.png', '*.webp', '*.bmp')
+
+
+def load_images(extra_paths):
+    paths = []
+    for folder in ('photos', 'faces'):
+        for pattern in IMAGE_PATTERNS:
+            paths.extend(glob.glob(os.path.join(ROOT, folder, pattern)))
+    paths.extend(extra_paths)
+    images = []
+    for path in sorted(paths):
+        rgb_image, error = to_rgb_array(Image.open(path))
+        if error:
+            print(f"skipping {path}: {error}")
+            continue
+        images.append((os.path.basename(path), rgb_image))
+    return images
+
+
+def iou(a, b):
+    top, right = max(a[0], b[0]), min(a[1], b[1])
+    bottom, left = min(a[2], b[2]), max(a[3], b[3])
+    inter = max(0, right - left) * max(0, bottom - top)
+    area = lambda box: (box[1] - box[3]) * (box[2] - box[0])
+    union = area(a) + area(b) - inter
+    return inter / union if union else 0.0
+
+
+def run(rgb_image, max_side, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        boxes = detect_faces(rgb_image, max_side)
+        encodings = encode_faces(rgb_image, boxes)
+        timings.append(time.perf_counter() - start)
+    return boxes, encodings, min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sides', type=int, nargs='+', default=[0, 1600, 1200, 800, 480, 320])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('images', nargs='*', help='extra images to include')
+    args = parser.parse_args()
+
+    images = load_images(args.images)
+    if not images:
+        print("No images found")
+        return
+
+    baseline = {name: run(rgb_image, 0, 1)[:2] for name, rgb_image in images}
+
+    print(f"{'image':<40} {'size':>11} {'max side':>8} {'ms':>8} {'found':>7} {'IoU':>6} {'drift':>6}")
+    for name, rgb_image in images:
+        base_boxes, base_encodings = baseline[name]
+        size = f"{rgb_image.shape[1]}x{rgb_image.shape[0]}"
+        for max_side in args.sides:
+            boxes, encodings, seconds = run(rgb_image, max_side, args.repeat)
+            ious, drifts = [], []
+            for base_box, base_encoding in zip(base_boxes, base_encodings):
+                if not boxes:
+                    break
+                best = int(np.argmax([iou(base_box, box) for box in boxes]))
+                ious.append(iou(base_box, boxes[best]))
+                drifts.append(float(np.linalg.norm(encodings[best] - base_encoding)))
+            found = f"{sum(v > 0.3 for v in ious)}/{len(base_boxes)}"
+            mean_iou = f"{np.mean(ious):.2f}" if ious else '-'
+            drift = f"{max(drifts):.3f}" if drifts else '-'
+            print(f"{name[:40]:<40} {size:>11} {max_side or 'full':>8} {seconds * 1000:>8.1f} {found:>7} {mean_iou:>6} {drift:>6}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""Memory, distance speed and accuracy of the stored encoding formats.
+
+Usage:
+    python benchmarks/encoding_formats.py --size 100000 --queries 200
+
+Compares the legacy raw float64 blobs against the versioned float32 and int8
+formats: bytes per stored encoding, in-memory gallery size, brute-force
+distance time per query, worst-case distance error and how often the nearest
+match differs from the float64 answer. Encodings are synthetic unless --db
+points at a database whose faces table should be used instead.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ann_index import pairwise_distances  # noqa: E402
+from encoding_format import decode_encoding, encode_encoding  # noqa: E402
+from benchmarks.ann_recall import database_gallery, synthetic_gallery  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=100000, help='synthetic gallery size')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--db', help='use encodings from this SQLite database instead')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    gallery = database_gallery(args.db) if args.db else synthetic_gallery(args.size, seed=args.seed)
+    gallery = gallery.astype(np.float64)
+    rng = np.random.default_rng(args.seed + 1)
+    queries = gallery[rng.integers(len(gallery), size=args.queries)] + rng.normal(scale=0.03, size=(args.queries, gallery.shape[1]))
+
+    reference = pairwise_distances(queries, gallery)
+    truth = np.argmin(reference, axis=1)
+
+    print(f"gallery={len(gallery)} queries={len(queries)}")
+    print(f"{'format':<8} {'bytes':>6} {'gallery MB':>11} {'ms/query':>9} {'max dist err':>13} {'top-1 agree':>12}")
+
+    for storage in ('float64', 'float32', 'int8'):
+        if storage == 'float64':
+            blobs = [row.tobytes() for row in gallery]
+            decoded = gallery
+        else:
+            blobs = [encode_encoding(row, storage) for row in gallery]
+            decoded = np.array([decode_encoding(blob) for blob in blobs])
+
+        start = time.perf_counter()
+        distances = np.vstack([pairwise_distances(q, decoded) for q in queries])
+        query_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+        error = float(np.max(np.abs(distances - reference)))
+        agree = float(np.mean(np.argmin(distances, axis=1) == truth))
+        print(f"{storage:<8} {len(blobs[0]):>6} {decoded.nbytes / 2 ** 20:>11.1f} "
+              f"{query_ms:>9.3f} {error:>13.2e} {agree:>12.4f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+"""Latency and throughput of the HTTP service under concurrent load.
+
+Usage:
+    python service.py &
+    python benchmarks/service_load.py --endpoint recognize --concurrency 8 --duration 20
+
+Each client thread holds one keep-alive connection and sends requests back
+to back for --duration seconds (after --warmup seconds that are not
+counted). Recognition requests upload a sample photo from photos/ (or
+--image). The report shows requests per second, p50/p99/max latency, the
+error count and how many TCP connections were opened, which stays equal
+to --concurrency while keep-alive works.
+"""
+import argparse
+import base64
+import glob
+import http.client
+import os
+import threading
+import time
+import uuid
+from urllib.parse import urlencode, urlsplit
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def multipart(fields: dict, files: list):
+    """(body, content type) for form fields plus [(field, filename, bytes)] files"""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, filename, data in files:
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                     f'Content-Type: application/octet-stream\r\n\r\n'.encode() + data + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+def build_request(args):
+    """(method, path, body, headers) sent by every client"""
+    token = base64.b64encode(f"{args.user}:{args.password}".encode()).decode()
+    headers = {'Authorization': f'Basic {token}'}
+    if args.endpoint in ('health', 'logs'):
+        path = '/health' if args.endpoint == 'health' else '/logs?' + urlencode({'limit': 50})
+        return 'GET', path, None, headers
+
+    image = args.image or sorted(glob.glob(os.path.join(ROOT, 'photos', '*.jpg')))[0]
+    with open(image, 'rb') as handle:
+        data = handle.read()
+    name = os.path.basename(image)
+    if args.endpoint == 'batch':
+        body, content_type = multipart({}, [('photos', name, data)] * args.batch)
+        path = '/recognize/batch'
+    else:
+        body, content_type = multipart({'all_faces': int(args.endpoint == 'recognize_all')}, [('photo', name, data)])
+        path = '/recognize'
+    headers['Content-Type'] = content_type
+    return 'POST', path, body, headers
+
+
+class Client(threading.Thread):
+    def __init__(self, address, request, warmup_until: float, stop_at: float):
+        super().__init__(daemon=True)
+        self.address = address
+        self.request = request
+        self.warmup_until = warmup_until
+        self.stop_at = stop_at
+        self.latencies = []
+        self.errors = 0
+        self.connections = 0
+
+    def run(self):
+        method, path, body, headers = self.request
+        connection = None
+        while time.perf_counter() < self.stop_at:
+            if connection is None:
+                connection = http.client.HTTPConnection(*self.address, timeout=60)
+                self.connections += 1
+            start = time.perf_counter()
+            try:
+                connection.request(method, path, body=body, headers=headers)
+                response = connection.getresponse()
+                response.read()
+                ok = response.status < 400
+                if response.getheader('connection', '').lower() == 'close':
+                    connection.close()
+                    connection = None
+            except (OSError, http.client.HTTPException):
+                ok = False
+                connection.close()
+                connection = None
+            elapsed = time.perf_counter() - start
+            if start >= self.warmup_until:
+                self.latencies.append(elapsed)
+                self.errors += not ok
+        if connection is not None:
+            connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--endpoint', default='recognize',
+                        choices=['health', 'recognize', 'recognize_all', 'batch', 'logs'])
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=20.0)
+    parser.add_argument('--warmup', type=float, default=2.0)
+    parser.add_argument('--batch', type=int, default=8, help='images per /recognize/batch request')
+    parser.add_argument('--image', help='photo to upload instead of the first one in photos/')
+    parser.add_argument('--user', default='admin')
+    parser.add_argument('--password', default='admin123')
+    args = parser.parse_args()
+
+    url = urlsplit(args.url)
+    address = (url.hostname, url.port or 80)
+    request = build_request(args)
+    now = time.perf_counter()
+    clients = [Client(address, request, now + args.warmup, now + args.warmup + args.duration)
+               for _ in range(args.concurrency)]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+
+    latencies = np.array([latency for client in clients for latency in client.latencies]) * 1000
+    errors = sum(client.errors for client in clients)
+    connections = sum(client.connections for client in clients)
+    if not len(latencies):
+        print("No requests completed")
+        return
+    images = len(latencies) * (args.batch if args.endpoint == 'batch' else 1)
+    print(f"endpoint={args.endpoint} concurrency={args.concurrency} duration={args.duration:.0f}s")
+    print(f"{'requests':>9} {'req/s':>8} {'images/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} "
+          f"{'errors':>7} {'conns':>6}")
+    print(f"{len(latencies):>9} {len(latencies) / args.duration:>8.1f} {images / args.duration:>9.1f} "
+          f"{np.percentile(latencies, 50):>8.1f} {np.percentile(latencies, 99):>8.1f} {latencies.max():>8.1f} "
+          f"{errors:>7} {connections:>6}")
+
+
+if __name__ == '__main__':
+    main()
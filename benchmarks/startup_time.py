@@ -0,0 +1,100 @@
+"""Startup time of a fresh app process, cold and warm.
+
+Usage:
+    python benchmarks/startup_time.py [--runs 5]
+
+Every run is a new Python process that imports main.py (what Streamlit does
+for each new server process), opens the database, loads the dlib models and
+recognizes a sample photo twice. The first run uses a new, empty database so
+every migration runs (cold start); the remaining runs reuse it (warm start,
+with the OS file cache already populated) and the median is reported. The
+"ML at login" column shows whether face_recognition, dlib, OpenCV or pandas
+were imported before the first recognition, i.e. while only the login page
+would have been shown.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ('face_recognition', 'dlib', 'cv2', 'pandas', 'pyarrow')
+PHASES = ('import', 'database', 'models', 'first', 'next')
+
+
+def child(db_path: str):
+    """Time each startup phase in this process and print them as JSON"""
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+    timings = {}
+
+    start = time.perf_counter()
+    import main  # noqa: F401
+    timings['import'] = time.perf_counter() - start
+
+    from recognition import DatabaseManager, FaceRecognitionManager
+    from encoding_service import EncodingService
+    start = time.perf_counter()
+    db_manager = DatabaseManager(db_path)
+    timings['database'] = time.perf_counter() - start
+    heavy = [name for name in HEAVY_MODULES if name in sys.modules]
+
+    from face_pipeline import load_models
+    start = time.perf_counter()
+    load_models()
+    timings['models'] = time.perf_counter() - start
+
+    from PIL import Image
+    manager = FaceRecognitionManager(db_manager, encoder=EncodingService(max_workers=0))
+    image = Image.open(os.path.join(ROOT, 'photos', 'netaji.jpg'))
+    for phase in ('first', 'next'):
+        start = time.perf_counter()
+        manager.recognize_face(image)
+        timings[phase] = time.perf_counter() - start
+
+    print(json.dumps({'timings': timings, 'heavy': heavy}))
+
+
+def run_once(db_path: str) -> dict:
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', db_path],
+                            capture_output=True, text=True, check=True).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    result['total'] = time.perf_counter() - start
+    return result
+
+
+def report(label: str, results: list):
+    timings = {phase: statistics.median(r['timings'][phase] for r in results) for phase in PHASES}
+    total = statistics.median(r['total'] for r in results)
+    heavy = ','.join(results[0]['heavy']) or 'none'
+    print(f"{label:<6} {timings['import']:>8.2f} {timings['database']:>9.3f} {timings['models']:>8.2f} "
+          f"{timings['first']:>8.2f} {timings['next']:>8.3f} {total:>8.2f}  {heavy}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help='warm runs after the cold one')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.child)
+        return
+
+    with tempfile.TemporaryDirectory() as workdir:
+        db_path = os.path.join(workdir, 'startup.db')
+        cold = run_once(db_path)
+        warm = [run_once(db_path) for _ in range(args.runs)]
+
+    print("seconds per phase (warm = median of runs)")
+    print(f"{'start':<6} {'import':>8} {'database':>9} {'models':>8} {'first':>8} {'next':>8} {'process':>8}  ML at login")
+    report('cold', [cold])
+    report('warm', warm)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""Sustained FPS of the video pipeline for different detection intervals.
+
+Usage:
+    python benchmarks/video_fps.py [--video clip.mp4] [--every 1 2 5 10] [--frames 150]
+
+Without --video a clip is synthesized by panning and zooming across the
+sample photos in photos/. Every frame is identified against an empty gallery
+(only the pipeline cost is measured). For each detection interval the report
+shows frames per second, per-stage timings, how many faces were encoded and
+the mean IoU between tracked boxes and the boxes a detection on that same
+frame finds (1.0 when detecting on every frame).
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from face_pipeline import detect_faces  # noqa: E402
+from video_pipeline import VIDEO_DETECTION_MAX_SIDE, VideoRecognizer, box_iou  # noqa: E402
+
+
+def synthetic_clip(frames: int, size=(640, 480)):
+    """Frames that slowly pan and zoom across each sample photo in turn"""
+    photos = [cv2.imread(path) for path in sorted(glob.glob(os.path.join(ROOT, 'photos', '*.jpg')))]
+    photos = [photo for photo in photos if photo is not None]
+    width, height = size
+    clip = []
+    for i in range(frames):
+        photo = photos[(i * len(photos)) // frames]
+        t = (i % max(1, frames // len(photos))) / max(1, frames // len(photos))
+        scale = 1.0 + 0.2 * t
+        canvas = cv2.resize(photo, (int(width * scale), int(height * scale)))
+        x, y = int((canvas.shape[1] - width) * t), int((canvas.shape[0] - height) * t)
+        clip.append(canvas[y:y + height, x:x + width])
+    return clip
+
+
+def read_clip(path: str, frames: int):
+    capture = cv2.VideoCapture(path)
+    clip = []
+    while len(clip) < frames:
+        ok, frame = capture.read()
+        if not ok:
+            break
+        clip.append(frame)
+    capture.release()
+    return clip
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--video', help='video file to use instead of the synthetic clip')
+    parser.add_argument('--every', type=int, nargs='+', default=[1, 2, 5, 10])
+    parser.add_argument('--frames', type=int, default=150)
+    args = parser.parse_args()
+
+    clip = read_clip(args.video, args.frames) if args.video else synthetic_clip(args.frames)
+    truth = [detect_faces(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB), VIDEO_DETECTION_MAX_SIDE) for frame in clip]
+    unknown = lambda encodings: [(None, None, 0.0)] * len(encodings)
+
+    print(f"frames={len(clip)} size={clip[0].shape[1]}x{clip[0].shape[0]}")
+    print(f"{'every':>5} {'fps':>7} {'detect ms':>10} {'track ms':>9} {'encodes':>8} {'track IoU':>10}")
+    for every in args.every:
+        recognizer = VideoRecognizer(unknown, detect_every=every)
+        overlaps = []
+        start = time.perf_counter()
+        for frame, boxes in zip(clip, truth):
+            result = recognizer.process(frame)
+            for box in boxes:
+                overlaps.append(max((box_iou(box, track.box) for track in result.tracks), default=0.0))
+        fps = len(clip) / (time.perf_counter() - start)
+        metrics = recognizer.metrics.snapshot()
+        print(f"{every:>5} {fps:>7.1f} {metrics['detect_ms']:>10.1f} {metrics['track_ms']:>9.2f} "
+              f"{metrics['encodes']:>8} {np.mean(overlaps) if overlaps else 0.0:>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,386 @@
+"""Bulk enrollment from a directory, a ZIP archive or a CSV manifest.
+
+Images are streamed from the source, decoded on the calling thread and
+detected/encoded in parallel on the shared ``EncodingService`` (submits
+block when every worker slot is taken, so memory stays bounded). Results
+are taken in source order and inserted ``batch_size`` at a time, each
+batch in one transaction together with the outcome of every file in it.
+That outcome table (``bulk_import_files``) is what makes an import
+resumable: running the same source again skips files already added, and
+files that failed unless ``retry_errors`` is set.
+
+A person's name is the file name without its extension, unless a
+``manifest.csv`` (in the directory or ZIP, or given directly) lists
+``file,name`` plus any of description, age, occupation, department,
+contact_info and tags.
+
+Command line:
+    python bulk_import.py photos/ --added-by admin --report errors.csv
+"""
+import argparse
+import csv
+import hashlib
+import io
+import os
+import sqlite3
+import sys
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Callable, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from ann_index import pairwise_distances
+from photo_store import prepare_photo
+from recognition import DUPLICATE_DISTANCE, FaceRecognitionManager, utc_timestamp
+
+# Faces inserted per transaction
+BULK_BATCH_SIZE = int(os.environ.get('KHOYA_BULK_BATCH_SIZE', '100'))
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp')
+MANIFEST_NAME = 'manifest.csv'
+PROFILE_FIELDS = ('description', 'age', 'occupation', 'department', 'contact_info', 'tags')
+
+
+class ImportItem(NamedTuple):
+    """One image to enroll"""
+    key: str                      # stable id within the source, used to resume
+    name: str
+    read: Callable[[], bytes]
+    profile: Optional[dict] = None
+
+
+class ImportReport:
+    """Running totals, per-file errors and throughput of an import"""
+
+    def __init__(self, source: str, total: int):
+        self.source = source
+        self.total = total
+        self.added = 0
+        self.failed = 0
+        self.skipped = 0
+        self.errors: List[Tuple[str, str, str]] = []  # (file, name, error)
+        self.started = time.perf_counter()
+        self.finished = None
+
+    @property
+    def processed(self) -> int:
+        return self.added + self.failed
+
+    @property
+    def remaining(self) -> int:
+        return self.total - self.skipped - self.processed
+
+    def rate(self) -> float:
+        """Files processed per second"""
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        return self.processed / elapsed if elapsed > 0 else 0.0
+
+    def eta(self) -> Optional[float]:
+        rate = self.rate()
+        return self.remaining / rate if rate > 0 else None
+
+    def summary(self) -> str:
+        eta = self.eta()
+        return (f"{self.processed + self.skipped}/{self.total} files | {self.added} added | "
+                f"{self.failed} failed | {self.skipped} skipped | {self.rate():.1f} files/s"
+                + (f" | ETA {eta:.0f}s" if eta is not None and self.remaining else ""))
+
+    def write_errors(self, handle):
+        """Write the per-file errors as CSV"""
+        writer = csv.writer(handle)
+        writer.writerow(['file', 'name', 'error'])
+        writer.writerows(self.errors)
+
+
+def _name_from_file(path: str) -> str:
+    return os.path.splitext(os.path.basename(path))[0].replace('_', ' ').strip()
+
+
+def _is_image(path: str) -> bool:
+    return path.lower().endswith(IMAGE_EXTENSIONS) and not os.path.basename(path).startswith('.')
+
+
+def _manifest_items(rows, opener: Callable[[str], Callable[[], bytes]]) -> List[ImportItem]:
+    items = []
+    for row in rows:
+        row = {key.strip().lower(): (value or '').strip() for key, value in row.items() if key}
+        path = row.get('file') or row.get('path')
+        if not path:
+            continue
+        profile = {field: row[field] for field in PROFILE_FIELDS if row.get(field)}
+        items.append(ImportItem(path, row.get('name') or _name_from_file(path), opener(path), profile))
+    return items
+
+
+def _file_reader(path: str) -> Callable[[], bytes]:
+    def read():
+        with open(path, 'rb') as handle:
+            return handle.read()
+    return read
+
+
+def directory_items(root: str) -> List[ImportItem]:
+    manifest = os.path.join(root, MANIFEST_NAME)
+    if os.path.exists(manifest):
+        return manifest_items(manifest)
+    items = []
+    for folder, dirs, files in os.walk(root):
+        dirs.sort()
+        for file in sorted(files):
+            path = os.path.join(folder, file)
+            if _is_image(path):
+                key = os.path.relpath(path, root).replace(os.sep, '/')
+                items.append(ImportItem(key, _name_from_file(file), _file_reader(path)))
+    return items
+
+
+def manifest_items(manifest: str) -> List[ImportItem]:
+    root = os.path.dirname(os.path.abspath(manifest))
+    with open(manifest, newline='', encoding='utf-8-sig') as handle:
+        return _manifest_items(csv.DictReader(handle), lambda path: _file_reader(os.path.join(root, path)))
+
+
+def zip_items(archive: zipfile.ZipFile) -> List[ImportItem]:
+    """Items of an open archive; members are only decompressed when read"""
+    opener = lambda member: (lambda: archive.read(member))
+    manifests = [info.filename for info in archive.infolist()
+                 if os.path.basename(info.filename) == MANIFEST_NAME]
+    if manifests:
+        prefix = os.path.dirname(manifests[0])
+        text = archive.read(manifests[0]).decode('utf-8-sig')
+        return _manifest_items(csv.DictReader(io.StringIO(text)),
+                               lambda path: opener(f"{prefix}/{path}" if prefix else path))
+    return [ImportItem(info.filename, _name_from_file(info.filename), opener(info.filename))
+            for info in archive.infolist() if not info.is_dir() and _is_image(info.filename)
+            and '__MACOSX/' not in info.filename]
+
+
+@contextmanager
+def open_source(path: str) -> Iterator[Tuple[str, List[ImportItem]]]:
+    """(source id, items) for a directory, ZIP archive or CSV manifest on disk; a ZIP stays open until exit"""
+    real = os.path.realpath(path)
+    if os.path.isdir(real):
+        yield f"dir:{real}", directory_items(real)
+    elif real.lower().endswith('.zip'):
+        with zipfile.ZipFile(real) as archive:
+            yield f"zip:{real}", zip_items(archive)
+    elif real.lower().endswith('.csv'):
+        yield f"csv:{real}", manifest_items(real)
+    else:
+        raise ValueError(f"Expected a directory, .zip or .csv manifest: {path}")
+
+
+@contextmanager
+def open_upload(data: bytes) -> Iterator[Tuple[str, List[ImportItem]]]:
+    """(source id, items) for an uploaded ZIP; the same archive resumes under the same id"""
+    digest = hashlib.sha256(data).hexdigest()
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        yield f"upload:{digest}", zip_items(archive)
+
+
+def _resolved(result) -> Future:
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+class BulkImporter:
+    """Stream items through the encoding service and insert them in batches"""
+
+    def __init__(self, face_manager: FaceRecognitionManager, added_by: str = "",
+                 batch_size: int = BULK_BATCH_SIZE, allow_duplicates: bool = False,
+                 retry_errors: bool = False):
+        self.face_manager = face_manager
+        self.db_manager = face_manager.db_manager
+        self.added_by = added_by
+        self.batch_size = max(1, batch_size)
+        self.allow_duplicates = allow_duplicates
+        self.retry_errors = retry_errors
+
+    def finished_items(self, source: str) -> set:
+        """Keys of the items a previous run already settled"""
+        statuses = ('added', 'error') if not self.retry_errors else ('added',)
+        with self.db_manager.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT item FROM bulk_import_files
+                WHERE source = ? AND status IN ({', '.join('?' * len(statuses))})
+            ''', (source, *statuses))
+            return {row[0] for row in cursor.fetchall()}
+
+    def _submit(self, item: ImportItem):
+        """(image, photo bytes, future of (encoding, error)) for one item"""
+        try:
+            data = item.read()
+        except (OSError, KeyError):
+            return None, None, _resolved((None, "File not found or unreadable"))
+        try:
+            image = Image.open(io.BytesIO(data))
+            image.load()
+        except Exception:
+            return None, None, _resolved((None, "Could not read the file as an image"))
+        try:
+            return image, data, self.face_manager.submit_encode(image, timeout=None)
+        except Exception as e:
+            return image, data, _resolved((None, f"Error processing image: {e}"))
+
+    def run(self, source: str, items: List[ImportItem],
+            progress: Optional[Callable[[ImportReport], None]] = None) -> ImportReport:
+        """Import every item not settled by an earlier run of ``source``"""
+        report = ImportReport(source, len(items))
+        done = self.finished_items(source)
+        window = deque()
+        batch = []
+        window_limit = self.batch_size + self.face_manager.encoder.max_pending
+
+        def settle_head():
+            item, image, data, future = window.popleft()
+            try:
+                encoding, error = future.result()
+            except Exception as e:
+                encoding, error = None, f"Error processing image: {e}"
+            batch.append((item, image, data, encoding, error))
+            if len(batch) >= self.batch_size:
+                self._write_batch(source, batch, report)
+                batch.clear()
+                if progress:
+                    progress(report)
+
+        for item in items:
+            if item.key in done:
+                report.skipped += 1
+                continue
+            window.append((item, *self._submit(item)))
+            while window and (len(window) > window_limit or window[0][3].done()):
+                settle_head()
+        while window:
+            settle_head()
+        if batch:
+            self._write_batch(source, batch, report)
+        report.finished = time.perf_counter()
+        if progress:
+            progress(report)
+        return report
+
+    def _duplicate_errors(self, encodings: List[Optional[np.ndarray]]) -> List[Optional[str]]:
+        """Near-duplicate error per encoding, against the gallery and earlier faces in the batch"""
+        errors = [None] * len(encodings)
+        rows = [i for i, encoding in enumerate(encodings) if encoding is not None]
+        if self.allow_duplicates or DUPLICATE_DISTANCE <= 0 or not rows:
+            return errors
+        queries = np.vstack([encodings[i] for i in rows])
+        for i, duplicate in zip(rows, self.face_manager.find_near_duplicates(queries)):
+            if duplicate:
+                errors[i] = f"Near-duplicate of '{duplicate[0]}' (distance {duplicate[1]:.2f})"
+        within = pairwise_distances(queries, queries)
+        for a, i in enumerate(rows):
+            if errors[i] is None:
+                earlier = [b for b in range(a) if errors[rows[b]] is None and within[a, b] <= DUPLICATE_DISTANCE]
+                if earlier:
+                    errors[i] = f"Near-duplicate of another file in this import (distance {within[a, earlier[0]]:.2f})"
+        return errors
+
+    def _write_batch(self, source: str, batch: list, report: ImportReport):
+        """Insert one batch and record every file's outcome in a single transaction
+
+        Each face is written under its own savepoint, so a file that fails
+        halfway (say on the unique name, after its photo was stored) leaves
+        nothing behind while the rest of the batch still commits.
+        """
+        duplicates = self._duplicate_errors([entry[3] if entry[4] is None else None for entry in batch])
+        appended = []
+        now = utc_timestamp()
+        with self.db_manager.connection() as conn:
+            cursor = conn.cursor()
+            if not conn.in_transaction:
+                # Outside a transaction, releasing the savepoint would commit each file on its own
+                cursor.execute("BEGIN")
+            for (item, image, data, encoding, error), duplicate in zip(batch, duplicates):
+                error = error or duplicate
+                face_id = None
+                if error is None:
+                    cursor.execute("SAVEPOINT bulk_item")
+                    try:
+                        photo = prepare_photo(image, data)
+                        face_id, sample_id, generation = self.face_manager.insert_face(
+                            cursor, item.name, encoding, photo, self.added_by, self._profile(item))
+                        appended.append((face_id, sample_id, item.name, encoding, generation))
+                    except sqlite3.IntegrityError:
+                        error = "A person with this name already exists"
+                    except Exception as e:
+                        error = f"Error adding face: {e}"
+                    if error:
+                        face_id = None
+                        cursor.execute("ROLLBACK TO bulk_item")
+                    cursor.execute("RELEASE bulk_item")
+                cursor.execute('''
+                    INSERT INTO bulk_import_files (source, item, name, status, face_id, error, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (source, item) DO UPDATE SET
+                        name = excluded.name, status = excluded.status, face_id = excluded.face_id,
+                        error = excluded.error, updated_at = excluded.updated_at
+                ''', (source, item.key, item.name, 'error' if error else 'added', face_id, error, now))
+                if error:
+                    report.failed += 1
+                    report.errors.append((item.key, item.name, error))
+                else:
+                    report.added += 1
+
+        for face_id, sample_id, name, encoding, generation in appended:
+            self.face_manager.gallery.append(face_id, sample_id, name, encoding, generation)
+
+    @staticmethod
+    def _profile(item: ImportItem) -> dict:
+        profile = dict(item.profile or {})
+        if profile.get('age'):
+            try:
+                profile['age'] = int(profile['age'])
+            except ValueError:
+                profile.pop('age')
+        return profile
+
+
+def main():
+    from encoding_cache import EncodingCache
+    from encoding_service import EncodingService
+    from recognition import DatabaseManager, FaceGallery
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('source', help='directory, .zip archive or .csv manifest')
+    parser.add_argument('--added-by', default='bulk_import')
+    parser.add_argument('--batch-size', type=int, default=BULK_BATCH_SIZE)
+    parser.add_argument('--allow-duplicates', action='store_true', help='enroll near-duplicate faces too')
+    parser.add_argument('--retry-errors', action='store_true', help='retry files that failed in an earlier run')
+    parser.add_argument('--report', help='write the per-file errors to this CSV file')
+    args = parser.parse_args()
+
+    db_manager = DatabaseManager()
+    encoder = EncodingService()
+    face_manager = FaceRecognitionManager(db_manager, FaceGallery(db_manager), encoder, cache=EncodingCache())
+    importer = BulkImporter(face_manager, args.added_by, args.batch_size, args.allow_duplicates, args.retry_errors)
+
+    with open_source(args.source) as (source, items):
+        print(f"Importing {len(items)} files from {source} with {encoder.max_workers} encoding workers")
+        report = importer.run(source, items, progress=lambda r: print(f"\r{r.summary()}", end='', flush=True))
+    print()
+    encoder.shutdown()
+
+    if args.report:
+        with open(args.report, 'w', newline='', encoding='utf-8') as handle:
+            report.write_errors(handle)
+        print(f"Wrote {len(report.errors)} errors to {args.report}")
+    else:
+        for file, name, error in report.errors[:20]:
+            print(f"  {file}: {error}")
+        if len(report.errors) > 20:
+            print(f"  ... {len(report.errors) - 20} more (use --report)")
+    return 1 if report.failed and not report.added else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,186 @@
+"""Cache of face detection/encoding results keyed by image content.
+
+Streamlit re-runs the whole script after every widget change, and users
+re-upload the same photo, so the same pixels are often detected and encoded
+again. Results are cached under a BLAKE2 hash of the decoded RGB pixels plus
+the job type and detection resolution: an in-memory LRU bounded by bytes,
+optionally backed by a size-bounded directory of ``.npz`` files that
+survives restarts and is shared by every process on the machine.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+# In-memory cache size in MB (0 disables caching)
+ENCODING_CACHE_MB = float(os.environ.get('KHOYA_ENCODING_CACHE_MB', '64'))
+# Directory for the on-disk cache ('' keeps the cache in memory only)
+ENCODING_CACHE_DIR = os.environ.get('KHOYA_ENCODING_CACHE_DIR', '')
+# On-disk cache size in MB
+ENCODING_CACHE_DISK_MB = float(os.environ.get('KHOYA_ENCODING_CACHE_DISK_MB', '512'))
+
+ENTRY_OVERHEAD = 256  # rough per-entry bookkeeping cost in bytes
+
+
+def image_key(rgb_image: np.ndarray, kind: str, max_side: int) -> str:
+    """Cache key for a decoded image and the job run on it"""
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(f"{kind}:{max_side}:{rgb_image.shape}:{rgb_image.dtype}".encode())
+    digest.update(np.ascontiguousarray(rgb_image).data)
+    return digest.hexdigest()
+
+
+def _to_arrays(kind: str, result) -> dict:
+    if kind == 'single':
+        encoding, error = result
+        encodings = np.empty((0, 128)) if encoding is None else np.asarray(encoding)[None, :]
+        locations = np.empty((0, 4), dtype=np.int64)
+    else:
+        face_locations, encodings, error = result
+        encodings = np.empty((0, 128)) if encodings is None else np.asarray(encodings)
+        locations = np.asarray(face_locations, dtype=np.int64).reshape(-1, 4)
+    return {'locations': locations, 'encodings': encodings, 'error': np.array(error or '')}
+
+
+def _from_arrays(kind: str, arrays: dict):
+    error = str(arrays['error']) or None
+    encodings = arrays['encodings']
+    if kind == 'single':
+        return (encodings[0] if len(encodings) else None), error
+    locations = [tuple(int(v) for v in box) for box in arrays['locations']]
+    return locations, (encodings if len(encodings) else None), error
+
+
+class EncodingCache:
+    """Thread-safe byte-bounded LRU with an optional on-disk second level"""
+
+    def __init__(self, max_mb: float = ENCODING_CACHE_MB, disk_dir: str = ENCODING_CACHE_DIR,
+                 disk_max_mb: float = ENCODING_CACHE_DISK_MB):
+        self.max_bytes = int(max_mb * 2 ** 20)
+        self.disk_dir = disk_dir or None
+        self.disk_max_bytes = int(disk_max_mb * 2 ** 20)
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_size = None
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def get(self, key: str, kind: str):
+        """Cached result for ``key`` or None"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+
+        arrays = self._disk_get(key)
+        if arrays is None:
+            with self._lock:
+                self.misses += 1
+            return None
+        result = _from_arrays(kind, arrays)
+        self._memory_put(key, result, arrays)
+        with self._lock:
+            self.hits += 1
+            self.disk_hits += 1
+        return result
+
+    def put(self, key: str, kind: str, result):
+        if not self.enabled:
+            return
+        arrays = _to_arrays(kind, result)
+        self._memory_put(key, result, arrays)
+        self._disk_put(key, arrays)
+
+    def _memory_put(self, key: str, result, arrays: dict):
+        nbytes = ENTRY_OVERHEAD + sum(array.nbytes for array in arrays.values())
+        with self._lock:
+            if key in self._entries:
+                self.size -= self._entries.pop(key)[1]
+            self._entries[key] = (result, nbytes)
+            self.size += nbytes
+            while self.size > self.max_bytes and self._entries:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.size -= evicted
+                self.evictions += 1
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], key + '.npz')
+
+    def _disk_get(self, key: str) -> Optional[dict]:
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                arrays = {name: data[name] for name in ('locations', 'encodings', 'error')}
+            os.utime(path)  # recently used files are evicted last
+            return arrays
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def _disk_put(self, key: str, arrays: dict):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp.npz"
+            np.savez(tmp_path, **arrays)
+            os.replace(tmp_path, path)
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        with self._lock:
+            if self._disk_size is None:
+                self._disk_size = sum(size for _, size, _ in self._disk_files())
+            else:
+                self._disk_size += size
+            if self._disk_size > self.disk_max_bytes:
+                self._disk_evict()
+
+    def _disk_files(self):
+        for root, _, files in os.walk(self.disk_dir):
+            for name in files:
+                if name.endswith('.npz') and '.tmp' not in name:
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    yield path, stat.st_size, stat.st_mtime
+
+    def _disk_evict(self):
+        """Delete least recently used files until the directory is back under 90% of its limit"""
+        files = sorted(self._disk_files(), key=lambda item: item[2])
+        self._disk_size = sum(size for _, size, _ in files)
+        for path, size, _ in files:
+            if self._disk_size <= 0.9 * self.disk_max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self._disk_size -= size
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {'entries': len(self._entries), 'size_mb': self.size / 2 ** 20, 'hits': self.hits,
+                'disk_hits': self.disk_hits, 'misses': self.misses, 'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0}
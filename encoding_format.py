@@ -0,0 +1,84 @@
+"""Versioned, compact storage format for face encodings.
+
+Every stored encoding starts with a small header (magic, format version,
+element type, dimension, model id and quantization scale) followed by the
+vector itself, stored either as float32 or as int8 with a per-vector scale.
+Decoding checks the header, so a truncated blob or an encoding from a
+different model is rejected instead of being silently misread.
+
+Blobs written before this format existed (raw 128 x float64, no header) are
+still decoded so old databases keep working until they are migrated.
+"""
+import os
+import struct
+
+import numpy as np
+
+MAGIC = b'KPEN'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<4sBBHBf')  # magic, version, dtype code, dim, model id, scale
+
+DTYPE_FLOAT32 = 1
+DTYPE_INT8 = 2
+STORAGE_DTYPES = {'float32': DTYPE_FLOAT32, 'int8': DTYPE_INT8}
+
+# Encoders a stored vector may come from; distances across models are meaningless
+MODEL_DLIB_RESNET_V1 = 1
+MODELS = {MODEL_DLIB_RESNET_V1: 'dlib_face_recognition_resnet_model_v1'}
+
+ENCODING_DIM = 128
+
+# Format used for new rows: 'float32' (default) or 'int8'
+ENCODING_STORAGE = os.environ.get('KHOYA_ENCODING_STORAGE', 'float32')
+
+LEGACY_SIZE = ENCODING_DIM * 8
+
+
+class EncodingFormatError(ValueError):
+    """Raised when a stored encoding cannot be decoded"""
+
+
+def encode_encoding(encoding: np.ndarray, storage: str = ENCODING_STORAGE,
+                    model_id: int = MODEL_DLIB_RESNET_V1) -> bytes:
+    """Serialize an encoding with its header"""
+    vector = np.asarray(encoding, dtype=np.float32).ravel()
+    if storage == 'int8':
+        peak = float(np.max(np.abs(vector))) if vector.size else 0.0
+        scale = peak / 127.0 if peak > 0 else 1.0
+        payload = np.clip(np.rint(vector / scale), -127, 127).astype(np.int8).tobytes()
+        return HEADER.pack(MAGIC, FORMAT_VERSION, DTYPE_INT8, vector.size, model_id, scale) + payload
+    return HEADER.pack(MAGIC, FORMAT_VERSION, DTYPE_FLOAT32, vector.size, model_id, 0.0) + vector.tobytes()
+
+
+def decode_encoding(blob: bytes, dim: int = ENCODING_DIM,
+                    model_id: int = MODEL_DLIB_RESNET_V1) -> np.ndarray:
+    """Validate and decode a stored encoding into a float32 vector"""
+    if not blob.startswith(MAGIC):
+        if len(blob) == LEGACY_SIZE and dim == ENCODING_DIM:
+            return np.frombuffer(blob, dtype=np.float64).astype(np.float32)
+        raise EncodingFormatError(f"Unrecognized encoding blob of {len(blob)} bytes")
+    if len(blob) < HEADER.size:
+        raise EncodingFormatError("Truncated encoding header")
+
+    _, version, dtype_code, stored_dim, stored_model, scale = HEADER.unpack_from(blob)
+    if version != FORMAT_VERSION:
+        raise EncodingFormatError(f"Unsupported encoding format version {version}")
+    if stored_dim != dim:
+        raise EncodingFormatError(f"Encoding has {stored_dim} dimensions, expected {dim}")
+    if stored_model != model_id:
+        raise EncodingFormatError(f"Encoding is from model {MODELS.get(stored_model, stored_model)}")
+
+    payload = blob[HEADER.size:]
+    if dtype_code == DTYPE_FLOAT32 and len(payload) == dim * 4:
+        return np.frombuffer(payload, dtype=np.float32)
+    if dtype_code == DTYPE_INT8 and len(payload) == dim:
+        return np.frombuffer(payload, dtype=np.int8).astype(np.float32) * np.float32(scale)
+    raise EncodingFormatError("Encoding payload does not match its header")
+
+
+def is_current_format(blob: bytes, storage: str = ENCODING_STORAGE) -> bool:
+    """Whether a blob is already in the versioned format with the given storage type"""
+    if not blob.startswith(MAGIC) or len(blob) < HEADER.size:
+        return False
+    _, version, dtype_code, _, _, _ = HEADER.unpack_from(blob)
+    return version == FORMAT_VERSION and dtype_code == STORAGE_DTYPES.get(storage)
@@ -0,0 +1,214 @@
+"""Process pool for the CPU-bound dlib detection and encoding work.
+
+Face detection and encoding hold the interpreter for seconds on large
+images, so they run in worker processes instead of on the Streamlit script
+thread. Workers are started with the ``spawn`` method (safe from a threaded
+server), import the dlib models once in their initializer and then serve
+jobs for the life of the pool.
+
+The number of jobs queued or running is bounded. When every slot is taken a
+submit waits up to ``submit_timeout`` seconds and then raises
+``EncodingServiceBusy`` so callers can shed load instead of piling up work.
+"""
+import atexit
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List
+
+import numpy as np
+
+from face_pipeline import DETECTION_MAX_SIDE, detect_faces, encode_faces
+from metrics import capture, record, record_all
+
+# Worker processes (0 runs every job inline on the calling thread)
+ENCODING_WORKERS = int(os.environ.get('KHOYA_ENCODING_WORKERS', str(min(4, os.cpu_count() or 1))))
+# Jobs allowed in flight per worker before submit applies back-pressure
+ENCODING_QUEUE_PER_WORKER = int(os.environ.get('KHOYA_ENCODING_QUEUE_PER_WORKER', '4'))
+# Seconds a submit waits for a free slot before raising EncodingServiceBusy
+ENCODING_SUBMIT_TIMEOUT = float(os.environ.get('KHOYA_ENCODING_SUBMIT_TIMEOUT', '10'))
+# Start the workers and load the models at startup instead of on the first recognition
+MODEL_WARMUP = os.environ.get('KHOYA_MODEL_WARMUP', '0') == '1'
+
+
+# Error text of EncodingServiceBusy, which recognition results pass on as their error string
+BUSY_MESSAGE = "All encoding workers are busy, please retry shortly"
+
+
+class EncodingServiceBusy(RuntimeError):
+    """Raised when every worker slot is taken for longer than the submit timeout"""
+
+
+def _init_worker():
+    """Load the dlib detector, landmark and encoder models once per worker"""
+    blank = np.zeros((64, 64, 3), dtype=np.uint8)
+    # Model loading is not a pipeline stage; drop the spans of the warm-up job
+    with capture():
+        detect_faces(blank, 0)
+        encode_faces(blank, [(8, 56, 56, 8)])
+
+
+def _worker_ready() -> int:
+    return os.getpid()
+
+
+def _timed_job(fn, submitted: float, *args):
+    """Worker side of submit: run ``fn`` and return its result with the spans it recorded"""
+    with capture() as observations:
+        record('encoding_queue', max(0.0, time.time() - submitted))
+        result = fn(*args)
+    return result, observations
+
+
+def encode_single_face(rgb_image: np.ndarray, max_side: int = DETECTION_MAX_SIDE):
+    """Worker job: (encoding, error) for an image that must contain exactly one face"""
+    face_locations = detect_faces(rgb_image, max_side)
+
+    if len(face_locations) == 0:
+        return None, "No face detected in the image"
+
+    if len(face_locations) > 1:
+        return None, "Multiple faces detected. Please use an image with only one face"
+
+    face_encodings = encode_faces(rgb_image, face_locations)
+
+    if len(face_encodings) > 0:
+        return face_encodings[0], None
+    else:
+        return None, "Could not encode the face"
+
+
+def encode_all_faces(rgb_image: np.ndarray, max_side: int = DETECTION_MAX_SIDE):
+    """Worker job: (face_locations, encodings, error) for every face in the image"""
+    face_locations = detect_faces(rgb_image, max_side)
+
+    if len(face_locations) == 0:
+        return [], None, "No face detected in the image"
+
+    face_encodings = encode_faces(rgb_image, face_locations)
+
+    if len(face_encodings) == 0:
+        return [], None, "Could not encode the faces"
+
+    return face_locations, np.vstack(face_encodings), None
+
+
+class EncodingService:
+    """Bounded process pool that runs encoding jobs and hands back futures"""
+
+    def __init__(self, max_workers: int = ENCODING_WORKERS,
+                 queue_per_worker: int = ENCODING_QUEUE_PER_WORKER,
+                 submit_timeout: float = ENCODING_SUBMIT_TIMEOUT):
+        self.max_workers = max_workers
+        self.max_pending = max(1, max_workers * queue_per_worker)
+        self.submit_timeout = submit_timeout
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._executor = None
+        atexit.register(self.shutdown)
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker,
+                )
+            return self._executor
+
+    def _reset_executor(self, broken: ProcessPoolExecutor):
+        with self._lock:
+            if self._executor is broken:
+                self._executor = None
+        broken.shutdown(wait=False)
+
+    def submit(self, fn, *args, timeout: float = -1, spans: bool = True) -> Future:
+        """Queue ``fn(*args)`` on the pool.
+
+        ``timeout`` is how long to wait for a free slot: -1 uses the service
+        default and None waits indefinitely (bulk callers that should simply
+        be throttled). Spans recorded by the job in the worker are added to
+        this process's metrics when it completes, unless ``spans`` is False.
+        """
+        if self.max_workers <= 0:
+            future = Future()
+            try:
+                future.set_result(fn(*args))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+
+        wait = self.submit_timeout if timeout == -1 else timeout
+        if not self._slots.acquire(timeout=wait):
+            raise EncodingServiceBusy(BUSY_MESSAGE)
+
+        try:
+            executor = self._get_executor()
+            try:
+                job = executor.submit(_timed_job, fn, time.time(), *args)
+            except BrokenProcessPool:
+                # A worker died (e.g. out of memory); start a fresh pool once
+                self._reset_executor(executor)
+                job = self._get_executor().submit(_timed_job, fn, time.time(), *args)
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._in_flight += 1
+
+        future = Future()
+
+        def done(job: Future):
+            with self._lock:
+                self._in_flight -= 1
+            self._slots.release()
+            if job.cancelled():
+                future.cancel()
+            elif job.exception() is not None:
+                future.set_exception(job.exception())
+            else:
+                result, observations = job.result()
+                if spans:
+                    record_all(observations)
+                future.set_result(result)
+
+        job.add_done_callback(done)
+        return future
+
+    def warm_up(self) -> List[Future]:
+        """Start every worker (or load the models inline) in the background.
+
+        Each worker loads the models in its initializer, so the returned
+        futures resolve as workers become ready; nothing waits on them
+        unless the caller does.
+        """
+        if self.max_workers <= 0:
+            future = Future()
+
+            def load():
+                try:
+                    _init_worker()
+                    future.set_result(os.getpid())
+                except Exception as e:
+                    future.set_exception(e)
+
+            threading.Thread(target=load, name="model-warm-up", daemon=True).start()
+            return [future]
+        # Jobs submitted while no worker is idle each start a new worker
+        return [self.submit(_worker_ready, timeout=None, spans=False) for _ in range(self.max_workers)]
+
+    def pending(self) -> int:
+        """Jobs currently queued or running"""
+        with self._lock:
+            return self._in_flight
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
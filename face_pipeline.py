@@ -0,0 +1,140 @@
+"""Image preprocessing and face detection/encoding stages.
+
+These functions have no Streamlit or database dependencies so they can be
+shared by the app, worker processes and the benchmarks.
+
+HOG detection cost grows with the pixel count, so faces are located on a
+downscaled copy of large uploads and the boxes are mapped back to full
+resolution. Encoding still runs on the full-resolution image, but dlib only
+reads the face regions given by those boxes.
+
+``face_recognition`` loads every dlib model when it is imported, which takes
+longer than the rest of the app's startup combined, so it (and OpenCV) is
+imported on first use. Call ``load_models`` to pay that cost up front.
+"""
+import os
+import threading
+from typing import List, Tuple
+
+import numpy as np
+from PIL import Image
+
+from metrics import span
+
+# Longest side (in pixels) of the copy used for face detection; 0 disables downscaling
+DETECTION_MAX_SIDE = int(os.environ.get('KHOYA_DETECTION_MAX_SIDE', '800'))
+
+Box = Tuple[int, int, int, int]
+
+_face_recognition = None
+_models_lock = threading.Lock()
+
+
+def load_models():
+    """Import face_recognition, loading the dlib detector, landmark and encoder models once"""
+    global _face_recognition
+    if _face_recognition is None:
+        with _models_lock:
+            if _face_recognition is None:
+                import face_recognition
+                _face_recognition = face_recognition
+    return _face_recognition
+
+
+def models_loaded() -> bool:
+    return _face_recognition is not None
+
+
+def to_rgb_array(image):
+    """Convert a PIL image or array into the 8-bit RGB array dlib expects"""
+    import cv2
+
+    try:
+        if isinstance(image, Image.Image):
+            with span('decode'):
+                # Convert PIL image to RGB if it's not already
+                if image.mode == 'RGBA':
+                    # Convert RGBA to RGB by creating a white background
+                    background = Image.new('RGB', image.size, (255, 255, 255))
+                    background.paste(image, mask=image.split()[-1])  # Use alpha channel as mask
+                    image = background
+                elif image.mode not in ['RGB', 'L']:
+                    # Convert any other mode to RGB
+                    image = image.convert('RGB')
+
+                image_array = np.array(image)
+        else:
+            image_array = image
+
+        with span('color_convert'):
+            # Ensure the image is in the correct data type
+            if image_array.dtype != np.uint8:
+                if image_array.dtype in [np.float32, np.float64]:
+                    # If it's floating point, assume it's normalized to 0-1
+                    image_array = (image_array * 255).astype(np.uint8)
+                else:
+                    # For other types, just convert to uint8
+                    image_array = image_array.astype(np.uint8)
+
+            # Handle different image shapes
+            if len(image_array.shape) == 3:
+                if image_array.shape[2] == 4:  # RGBA
+                    # Convert RGBA to RGB
+                    rgb_image = cv2.cvtColor(image_array, cv2.COLOR_RGBA2RGB)
+                elif image_array.shape[2] == 3:  # RGB or BGR
+                    # Check if it's BGR and convert to RGB
+                    rgb_image = cv2.cvtColor(image_array, cv2.COLOR_BGR2RGB)
+                else:
+                    return None, f"Unsupported number of channels: {image_array.shape[2]}"
+            elif len(image_array.shape) == 2:  # Grayscale
+                # Convert grayscale to RGB
+                rgb_image = cv2.cvtColor(image_array, cv2.COLOR_GRAY2RGB)
+            else:
+                return None, f"Unsupported image shape: {image_array.shape}"
+
+            # Ensure the image is 8-bit
+            if rgb_image.dtype != np.uint8:
+                rgb_image = rgb_image.astype(np.uint8)
+
+        return rgb_image, None
+
+    except Exception as e:
+        return None, f"Error processing image: {str(e)}"
+
+
+def detection_scale(shape, max_side: int = DETECTION_MAX_SIDE) -> float:
+    """Scale factor for the detection copy of an image of the given shape"""
+    longest = max(shape[0], shape[1])
+    if max_side <= 0 or longest <= max_side:
+        return 1.0
+    return max_side / longest
+
+
+def detect_faces(rgb_image: np.ndarray, max_side: int = DETECTION_MAX_SIDE) -> List[Box]:
+    """Locate faces on a downscaled copy and return boxes in full-resolution coordinates"""
+    face_recognition = load_models()
+    with span('detect'):
+        scale = detection_scale(rgb_image.shape, max_side)
+        if scale == 1.0:
+            return face_recognition.face_locations(rgb_image)
+
+        import cv2
+
+        small = cv2.resize(rgb_image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        height, width = rgb_image.shape[:2]
+        boxes = []
+        for top, right, bottom, left in face_recognition.face_locations(small):
+            boxes.append((
+                max(0, int(round(top / scale))),
+                min(width, int(round(right / scale))),
+                min(height, int(round(bottom / scale))),
+                max(0, int(round(left / scale))),
+            ))
+        return boxes
+
+
+def encode_faces(rgb_image: np.ndarray, face_locations: List[Box]) -> List[np.ndarray]:
+    """Encode the given face regions of the full-resolution image"""
+    face_recognition = load_models()
+    with span('encode'):
+        return face_recognition.face_encodings(rgb_image, face_locations)
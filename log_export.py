@@ -0,0 +1,114 @@
+"""Streaming export of log and history queries to CSV, gzip CSV, Parquet or Arrow.
+
+Rows are pulled from a SQLite cursor ``EXPORT_CHUNK_ROWS`` at a time and
+appended to a temporary file, so memory use stays flat however many rows a
+date range covers. Parquet and Arrow output need the optional ``pyarrow``
+package; each chunk becomes one record batch written against a fixed schema.
+pyarrow is only imported when such an export runs, since importing it
+would add most of the cost of starting the app.
+"""
+import csv
+import gzip
+import importlib.util
+import io
+import os
+import tempfile
+from typing import List, Sequence, Tuple
+
+# Optional dependency, found without importing it
+HAVE_PYARROW = importlib.util.find_spec('pyarrow') is not None
+
+# Rows fetched from SQLite and written per chunk
+EXPORT_CHUNK_ROWS = int(os.environ.get('KHOYA_EXPORT_CHUNK_ROWS', '10000'))
+
+# format -> (label, file extension, MIME type)
+EXPORT_FORMATS = {
+    'csv': ('CSV', '.csv', 'text/csv'),
+    'csv.gz': ('CSV (gzip)', '.csv.gz', 'application/gzip'),
+    'parquet': ('Parquet', '.parquet', 'application/vnd.apache.parquet'),
+    'arrow': ('Arrow IPC', '.arrow', 'application/vnd.apache.arrow.file'),
+}
+COLUMNAR_FORMATS = ('parquet', 'arrow')
+
+# (column name, 'int' | 'float' | 'text')
+Columns = Sequence[Tuple[str, str]]
+
+
+def available_formats() -> List[str]:
+    """Export formats usable in this environment"""
+    return [fmt for fmt in EXPORT_FORMATS if HAVE_PYARROW or fmt not in COLUMNAR_FORMATS]
+
+
+def _arrow_schema(pa, columns: Columns):
+    types = {'int': pa.int64(), 'float': pa.float64(), 'text': pa.string()}
+    return pa.schema([(name, types[kind]) for name, kind in columns])
+
+
+def _write_csv(cursor, columns: Columns, handle, chunk_rows: int) -> int:
+    writer = csv.writer(handle)
+    writer.writerow([name for name, _ in columns])
+    total = 0
+    while True:
+        rows = cursor.fetchmany(chunk_rows)
+        if not rows:
+            return total
+        writer.writerows(rows)
+        total += len(rows)
+
+
+def _write_columnar(cursor, columns: Columns, fmt: str, path: str, chunk_rows: int) -> int:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = _arrow_schema(pa, columns)
+    if fmt == 'parquet':
+        writer = pq.ParquetWriter(path, schema)
+    else:
+        writer = pa.ipc.new_file(path, schema)
+    total = 0
+    try:
+        while True:
+            rows = cursor.fetchmany(chunk_rows)
+            if not rows:
+                return total
+            arrays = [pa.array([row[i] for row in rows], type=field.type)
+                      for i, field in enumerate(schema)]
+            batch = pa.record_batch(arrays, schema=schema)
+            if fmt == 'parquet':
+                writer.write_batch(batch)
+            else:
+                writer.write(batch)
+            total += len(rows)
+    finally:
+        writer.close()
+
+
+def write_export(cursor, columns: Columns, fmt: str, path: str,
+                 chunk_rows: int = EXPORT_CHUNK_ROWS) -> int:
+    """Write the rows of an executed cursor to ``path`` and return the row count"""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    if fmt in COLUMNAR_FORMATS:
+        if not HAVE_PYARROW:
+            raise ImportError(f"The '{fmt}' export format requires the pyarrow package")
+        return _write_columnar(cursor, columns, fmt, path, chunk_rows)
+    if fmt == 'csv.gz':
+        with gzip.open(path, 'wt', newline='', encoding='utf-8') as handle:
+            return _write_csv(cursor, columns, handle, chunk_rows)
+    with io.open(path, 'w', newline='', encoding='utf-8') as handle:
+        return _write_csv(cursor, columns, handle, chunk_rows)
+
+
+def export_to_tempfile(cursor, columns: Columns, fmt: str,
+                       chunk_rows: int = EXPORT_CHUNK_ROWS) -> Tuple[str, int]:
+    """Stream an executed cursor into a new temporary file; returns (path, rows).
+
+    The caller owns the file and should delete it once it has been served.
+    """
+    fd, path = tempfile.mkstemp(prefix='khoya_export_', suffix=EXPORT_FORMATS[fmt][1])
+    os.close(fd)
+    try:
+        return path, write_export(cursor, columns, fmt, path, chunk_rows)
+    except Exception:
+        os.remove(path)
+        raise
@@ -1,580 +1,85 @@
 # filepath: c:\Users\Asus\Documents\Projects\khoya_paya\advanced_face_app_enhanced_fixed.py
 import streamlit as st
-import cv2
-import numpy as np
-from PIL import Image
-import os
-import sqlite3
+from PIL import Image, ImageDraw
 import io
-import hashlib
-import json
-import pandas as pd
+import os
 from datetime import datetime
-import face_recognition
-import time
+from contextlib import ExitStack
 import tempfile
-from typing import Dict, List, Optional
+from typing import Optional
+from urllib.parse import urlencode
+from encoding_service import MODEL_WARMUP, EncodingService
+from encoding_cache import EncodingCache
+from log_export import EXPORT_FORMATS, available_formats
+from metrics import REGISTRY, STAGES, MetricsFileWriter, start_file_export
+from recognition import (WRITE_BEHIND, DatabaseManager, FaceGallery, FaceRecognitionManager, LogFilters,
+                         RecognitionDeduplicator, RecognitionEvent, RecognitionWriter, date_range_bounds)
 
-# Page configuration
-st.set_page_config(
-    page_title="Advanced Face Recognition System",
-    page_icon="🔐",
-    layout="wide",
-    initial_sidebar_state="expanded"
-)
+@st.cache_resource
+def get_db_manager() -> DatabaseManager:
+    """Database manager (and its connection pool) shared by every Streamlit session"""
+    return DatabaseManager()
 
-# Initialize session state
-if 'logged_in' not in st.session_state:
-    st.session_state.logged_in = False
-if 'user_type' not in st.session_state:
-    st.session_state.user_type = None
-if 'current_user' not in st.session_state:
-    st.session_state.current_user = None
-if 'camera_active' not in st.session_state:
-    st.session_state.camera_active = False
-if 'show_profile_id' not in st.session_state:
-    st.session_state.show_profile_id = None
-if 'show_profile_name' not in st.session_state:
-    st.session_state.show_profile_name = None
+@st.cache_resource
+def get_face_gallery() -> FaceGallery:
+    """Single gallery shared by every Streamlit session in this process"""
+    return FaceGallery(get_db_manager())
 
-# Create necessary directories
-os.makedirs('database', exist_ok=True)
-os.makedirs('known_faces', exist_ok=True)
-os.makedirs('user_profiles', exist_ok=True)
+@st.cache_resource
+def get_encoding_service() -> EncodingService:
+    """Worker pool shared by every Streamlit session in this process"""
+    service = EncodingService()
+    if MODEL_WARMUP:
+        service.warm_up()
+    return service
 
-class DatabaseManager:
-    def __init__(self):
-        self.db_path = 'database/advanced_faces.db'
-        self.init_database()
-    
-    def get_connection(self):
-        """Create a database connection"""
-        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
-        return sqlite3.connect(self.db_path)
-    
-    def init_database(self):
-        """Initialize database with all required tables"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        # Users table for login system
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT NOT NULL UNIQUE,
-                password_hash TEXT NOT NULL,
-                user_type TEXT NOT NULL DEFAULT 'user',
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                last_login DATETIME,
-                profile_data TEXT
-            )
-        ''')
-        
-        # Faces table for face recognition with enhanced profile information
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS faces (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL UNIQUE,
-                photo BLOB NOT NULL,
-                encoding BLOB NOT NULL,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                description TEXT,
-                added_by TEXT,
-                tags TEXT,
-                age INTEGER,
-                occupation TEXT,
-                department TEXT,
-                contact_info TEXT,
-                last_seen DATETIME,
-                scan_count INTEGER DEFAULT 0,
-                profile_data TEXT
-            )
-        ''')
-        
-        # Recognition logs table with enhanced tracking
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS recognition_logs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                face_id INTEGER,
-                recognized_person TEXT,
-                confidence REAL,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                method TEXT,
-                location TEXT,
-                device_info TEXT,
-                FOREIGN KEY (user_id) REFERENCES users (id),
-                FOREIGN KEY (face_id) REFERENCES faces (id)
-            )
-        ''')
-        
-        # Face scan history table for detailed tracking
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS face_scan_history (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                face_id INTEGER,
-                scanned_by_user INTEGER,
-                confidence REAL,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                method TEXT,
-                FOREIGN KEY (face_id) REFERENCES faces (id),
-                FOREIGN KEY (scanned_by_user) REFERENCES users (id)
-            )
-        ''')
-        
-        # User profiles table for individual recognition history
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS user_profiles (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                recognized_faces TEXT,
-                total_recognitions INTEGER DEFAULT 0,
-                last_recognition DATETIME,
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-        ''')
-        
-        # Create default admin user if not exists
-        cursor.execute("SELECT * FROM users WHERE username = 'admin'")
-        if not cursor.fetchone():
-            admin_password = self.hash_password('admin123')
-            cursor.execute('''
-                INSERT INTO users (username, password_hash, user_type, profile_data)
-                VALUES (?, ?, ?, ?)
-            ''', ('admin', admin_password, 'admin', '{}'))
-        
-        conn.commit()
-        conn.close()
-    
-    def hash_password(self, password: str) -> str:
-        """Hash password using SHA256"""
-        return hashlib.sha256(password.encode()).hexdigest()
-    
-    def verify_user(self, username: str, password: str) -> Optional[Dict]:
-        """Verify user credentials"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        password_hash = self.hash_password(password)
-        cursor.execute('''
-            SELECT id, username, user_type, profile_data 
-            FROM users 
-            WHERE username = ? AND password_hash = ?
-        ''', (username, password_hash))
-        
-        user = cursor.fetchone()
-        conn.close()
-        
-        if user:
-            return {
-                'id': user[0],
-                'username': user[1],
-                'user_type': user[2],
-                'profile_data': json.loads(user[3] or '{}')
-            }
-        return None
-    
-    def create_user(self, username: str, password: str, user_type: str = 'user') -> bool:
-        """Create a new user"""
-        try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            
-            password_hash = self.hash_password(password)
-            cursor.execute('''
-                INSERT INTO users (username, password_hash, user_type, profile_data)
-                VALUES (?, ?, ?, ?)
-            ''', (username, password_hash, user_type, '{}'))
-            
-            conn.commit()
-            conn.close()
-            return True
-        except sqlite3.IntegrityError:
-            return False
-    
-    def get_all_users(self) -> List[Dict]:
-        """Get all users (admin only)"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT id, username, user_type, created_at, last_login
-            FROM users
-            ORDER BY created_at DESC
-        ''')
-        
-        users = []
-        for row in cursor.fetchall():
-            users.append({
-                'id': row[0],
-                'username': row[1],
-                'user_type': row[2],
-                'created_at': row[3],
-                'last_login': row[4]
-            })
-        
-        conn.close()
-        return users
-    
-    def update_last_login(self, user_id: int):
-        """Update user's last login time"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            UPDATE users 
-            SET last_login = CURRENT_TIMESTAMP 
-            WHERE id = ?
-        ''', (user_id,))
-        
-        conn.commit()
-        conn.close()
+@st.cache_resource
+def get_recognition_writer() -> Optional[RecognitionWriter]:
+    """Shared write-behind writer, or None to commit every recognition immediately"""
+    return RecognitionWriter(get_db_manager()) if WRITE_BEHIND else None
 
-class FaceRecognitionManager:
-    def __init__(self, db_manager: DatabaseManager):
-        self.db_manager = db_manager
-    
-    def encode_face_from_image(self, image):
-        """Extract face encoding from image using face_recognition library"""
-        try:
-            if isinstance(image, Image.Image):
-                # Convert PIL image to RGB if it's not already
-                if image.mode == 'RGBA':
-                    # Convert RGBA to RGB by creating a white background
-                    background = Image.new('RGB', image.size, (255, 255, 255))
-                    background.paste(image, mask=image.split()[-1])  # Use alpha channel as mask
-                    image = background
-                elif image.mode not in ['RGB', 'L']:
-                    # Convert any other mode to RGB
-                    image = image.convert('RGB')
-                
-                image_array = np.array(image)
-            else:
-                image_array = image
-            
-            # Ensure the image is in the correct data type
-            if image_array.dtype != np.uint8:
-                if image_array.dtype in [np.float32, np.float64]:
-                    # If it's floating point, assume it's normalized to 0-1
-                    image_array = (image_array * 255).astype(np.uint8)
-                else:
-                    # For other types, just convert to uint8
-                    image_array = image_array.astype(np.uint8)
-            
-            # Handle different image shapes
-            if len(image_array.shape) == 3:
-                if image_array.shape[2] == 4:  # RGBA
-                    # Convert RGBA to RGB
-                    rgb_image = cv2.cvtColor(image_array, cv2.COLOR_RGBA2RGB)
-                elif image_array.shape[2] == 3:  # RGB or BGR
-                    # Check if it's BGR and convert to RGB
-                    rgb_image = cv2.cvtColor(image_array, cv2.COLOR_BGR2RGB)
-                else:
-                    return None, f"Unsupported number of channels: {image_array.shape[2]}"
-            elif len(image_array.shape) == 2:  # Grayscale
-                # Convert grayscale to RGB
-                rgb_image = cv2.cvtColor(image_array, cv2.COLOR_GRAY2RGB)
-            else:
-                return None, f"Unsupported image shape: {image_array.shape}"
-            
-            # Ensure the image is 8-bit
-            if rgb_image.dtype != np.uint8:
-                rgb_image = rgb_image.astype(np.uint8)
-            
-            face_locations = face_recognition.face_locations(rgb_image)
-            
-            if len(face_locations) == 0:
-                return None, "No face detected in the image"
-            
-            if len(face_locations) > 1:
-                return None, "Multiple faces detected. Please use an image with only one face"
-            
-            face_encodings = face_recognition.face_encodings(rgb_image, face_locations)
-            
-            if len(face_encodings) > 0:
-                return face_encodings[0], None
-            else:
-                return None, "Could not encode the face"
-                
-        except Exception as e:
-            return None, f"Error processing image: {str(e)}"
-    
-    def add_face_to_database(self, name: str, image, description: str = "", added_by: str = "", 
-                           age: int = None, occupation: str = "", department: str = "", 
-                           contact_info: str = "", profile_data: dict = None):
-        """Add a face to the database with enhanced profile information"""
-        try:
-            encoding, error = self.encode_face_from_image(image)
-            if error:
-                return False, error
-            
-            # Convert image to bytes
-            if isinstance(image, Image.Image):
-                img_bytes = io.BytesIO()
-                image.save(img_bytes, format='PNG')
-                img_bytes = img_bytes.getvalue()
-            else:
-                is_success, buffer = cv2.imencode('.png', image)
-                if is_success:
-                    img_bytes = buffer.tobytes()
-                else:
-                    return False, "Failed to encode image"
-            
-            # Convert encoding to bytes
-            encoding_bytes = encoding.tobytes()
-            
-            # Convert profile_data to JSON
-            profile_json = json.dumps(profile_data) if profile_data else None
-            
-            conn = self.db_manager.get_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                INSERT INTO faces (name, photo, encoding, description, added_by, tags, 
-                                 age, occupation, department, contact_info, scan_count, profile_data)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0, ?)
-            ''', (name, img_bytes, encoding_bytes, description, added_by, "", 
-                  age, occupation, department, contact_info, profile_json))
-            
-            conn.commit()
-            conn.close()
-            return True, "Face added successfully"
-            
-        except sqlite3.IntegrityError:
-            return False, "A person with this name already exists"
-        except Exception as e:
-            return False, f"Error adding face: {str(e)}"
-    
-    def recognize_face(self, image, tolerance: float = 0.6):
-        """Recognize a face from the database with enhanced tracking"""
-        try:
-            encoding, error = self.encode_face_from_image(image)
-            if error:
-                return None, error, 0.0, None
-            
-            conn = self.db_manager.get_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute('SELECT id, name, encoding FROM faces')
-            faces_data = cursor.fetchall()
-            
-            if not faces_data:
-                conn.close()
-                return None, "No faces in database", 0.0, None
-            
-            known_encodings = []
-            known_names = []
-            face_ids = []
-            
-            for face_id, name, encoding_bytes in faces_data:
-                known_encoding = np.frombuffer(encoding_bytes, dtype=np.float64)
-                known_encodings.append(known_encoding)
-                known_names.append(name)
-                face_ids.append(face_id)
-            
-            if len(known_encodings) == 0:
-                conn.close()
-                return None, "No valid encodings in database", 0.0, None
-            
-            # Calculate distances
-            distances = face_recognition.face_distance(known_encodings, encoding)
-            min_distance = min(distances)
-            best_match_index = np.argmin(distances)
-            
-            if min_distance <= tolerance:
-                confidence = (1 - min_distance) * 100
-                matched_face_id = face_ids[best_match_index]
-                matched_name = known_names[best_match_index]
-                
-                # Update face scan statistics
-                cursor.execute('''
-                    UPDATE faces 
-                    SET scan_count = scan_count + 1, last_seen = CURRENT_TIMESTAMP 
-                    WHERE id = ?
-                ''', (matched_face_id,))
-                
-                conn.commit()
-                conn.close()
-                return matched_name, None, confidence, matched_face_id
-            else:
-                conn.close()
-                return None, "No match found", 0.0, None
-                
-        except Exception as e:
-            return None, f"Error during recognition: {str(e)}", 0.0, None
-    
-    def get_all_faces(self):
-        """Get all faces from database with enhanced profile information"""
-        conn = self.db_manager.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT id, name, description, timestamp, added_by, tags, 
-                   age, occupation, department, contact_info, last_seen, scan_count, profile_data
-            FROM faces
-            ORDER BY timestamp DESC
-        ''')
-        
-        faces = []
-        for row in cursor.fetchall():
-            faces.append({
-                'id': row[0],
-                'name': row[1],
-                'description': row[2],
-                'timestamp': row[3],
-                'added_by': row[4],
-                'tags': row[5],
-                'age': row[6],
-                'occupation': row[7],
-                'department': row[8],
-                'contact_info': row[9],
-                'last_seen': row[10],
-                'scan_count': row[11],
-                'profile_data': json.loads(row[12]) if row[12] else {}
-            })
-        
-        conn.close()
-        return faces
-    
-    def log_recognition(self, user_id: int, recognized_person: str, confidence: float, 
-                       method: str, face_id: int = None, location: str = "", device_info: str = ""):
-        """Log recognition event with enhanced tracking"""
-        conn = self.db_manager.get_connection()
-        cursor = conn.cursor()
-        
-        # Log recognition
-        cursor.execute('''
-            INSERT INTO recognition_logs (user_id, face_id, recognized_person, confidence, method, location, device_info)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (user_id, face_id, recognized_person, confidence, method, location, device_info))
-        
-        # Log face scan history if face_id is provided
-        if face_id:
-            cursor.execute('''
-                INSERT INTO face_scan_history (face_id, scanned_by_user, confidence, method)
-                VALUES (?, ?, ?, ?)
-            ''', (face_id, user_id, confidence, method))
-        
-        conn.commit()
-        conn.close()
-    
-    def get_face_profile(self, face_id: int):
-        """Get detailed face profile information with scan history"""
-        conn = self.db_manager.get_connection()
-        cursor = conn.cursor()
-        
-        # Get face information
-        cursor.execute('''
-            SELECT id, name, description, timestamp, added_by, tags,
-                   age, occupation, department, contact_info, last_seen, scan_count, profile_data
-            FROM faces WHERE id = ?
-        ''', (face_id,))
-        
-        face_data = cursor.fetchone()
-        if not face_data:
-            conn.close()
-            return None
-        
-        face_profile = {
-            'id': face_data[0],
-            'name': face_data[1],
-            'description': face_data[2],
-            'timestamp': face_data[3],
-            'added_by': face_data[4],
-            'tags': face_data[5],
-            'age': face_data[6],
-            'occupation': face_data[7],
-            'department': face_data[8],
-            'contact_info': face_data[9],
-            'last_seen': face_data[10],
-            'scan_count': face_data[11],
-            'profile_data': json.loads(face_data[12]) if face_data[12] else {}
-        }
-        
-        # Get recent scan history
-        cursor.execute('''
-            SELECT fsh.timestamp, fsh.confidence, fsh.method, u.username
-            FROM face_scan_history fsh
-            LEFT JOIN users u ON fsh.scanned_by_user = u.id
-            WHERE fsh.face_id = ?
-            ORDER BY fsh.timestamp DESC
-            LIMIT 10
-        ''', (face_id,))
-        
-        scan_history = cursor.fetchall()
-        face_profile['scan_history'] = scan_history
-        
-        conn.close()
-        return face_profile
-    
-    def update_user_profile(self, user_id: int, recognized_person: str):
-        """Update user profile with recognition data"""
-        conn = self.db_manager.get_connection()
-        cursor = conn.cursor()
-        
-        # Get existing profile
-        cursor.execute('''
-            SELECT recognized_faces, total_recognitions 
-            FROM user_profiles 
-            WHERE user_id = ?
-        ''', (user_id,))
-        
-        profile = cursor.fetchone()
-        
-        if profile:
-            recognized_faces = json.loads(profile[0] or '[]')
-            if recognized_person not in recognized_faces:
-                recognized_faces.append(recognized_person)
-            
-            cursor.execute('''
-                UPDATE user_profiles 
-                SET recognized_faces = ?, total_recognitions = ?, last_recognition = CURRENT_TIMESTAMP
-                WHERE user_id = ?
-            ''', (json.dumps(recognized_faces), profile[1] + 1, user_id))
-        else:
-            cursor.execute('''
-                INSERT INTO user_profiles (user_id, recognized_faces, total_recognitions, last_recognition)
-                VALUES (?, ?, 1, CURRENT_TIMESTAMP)
-                ''', (user_id, json.dumps([recognized_person])))
-        
-        conn.commit()
-        conn.close()
-    
-    def get_face_scan_history(self, face_id: int, limit: int = 50):
-        """Get detailed scan history for a face including user info and timestamps"""
-        conn = self.db_manager.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT fsh.timestamp, fsh.confidence, fsh.method, u.username, u.user_type,
-                   rl.location, rl.device_info
-            FROM face_scan_history fsh
-            LEFT JOIN users u ON fsh.scanned_by_user = u.id
-            LEFT JOIN recognition_logs rl ON (rl.face_id = fsh.face_id AND rl.timestamp = fsh.timestamp)
-            WHERE fsh.face_id = ?
-            ORDER BY fsh.timestamp DESC
-            LIMIT ?
-        ''', (face_id, limit))
-        
-        scan_history = cursor.fetchall()
-        conn.close()
-        
-        return [
-            {
-                'timestamp': row[0],
-                'confidence': row[1],
-                'method': row[2],
-                'username': row[3] or 'Unknown',
-                'user_type': row[4] or 'Unknown',
-                'location': row[5] or '',
-                'device_info': row[6] or ''
-            }
-            for row in scan_history
-        ]
+@st.cache_resource
+def get_encoding_cache() -> EncodingCache:
+    """Detection/encoding results shared by every Streamlit session in this process"""
+    return EncodingCache()
+
+@st.cache_resource
+def get_face_manager() -> FaceRecognitionManager:
+    """Recognition manager shared by every Streamlit session in this process"""
+    return FaceRecognitionManager(get_db_manager(), get_face_gallery(), get_encoding_service(),
+                                  get_recognition_writer(), get_encoding_cache())
+
+@st.cache_resource
+def get_metrics_writer() -> Optional[MetricsFileWriter]:
+    """Background export of the stage metrics to KHOYA_METRICS_FILE, or None when unset"""
+    return start_file_export()
+
+# Base URL of the HTTP service (service.py); when set, exports download from it as a streamed file
+SERVICE_URL = os.environ.get('KHOYA_SERVICE_URL', '').rstrip('/')
 
-# Initialize managers
-db_manager = DatabaseManager()
-face_manager = FaceRecognitionManager(db_manager)
+# Seconds a cached gallery page may show stale scan counts (new faces show up at once)
+GALLERY_CACHE_TTL = float(os.environ.get('KHOYA_GALLERY_CACHE_TTL', '30'))
+
+@st.cache_data(ttl=GALLERY_CACHE_TTL, max_entries=512, show_spinner=False)
+def cached_faces_page(generation: int, search: str, after):
+    """Gallery page shared by every session; a new ``generation`` (faces changed) misses the cache"""
+    return get_face_manager().get_faces_page(search, after)
+
+@st.cache_data(ttl=GALLERY_CACHE_TTL, max_entries=512, show_spinner=False)
+def cached_face_count(generation: int, search: str) -> int:
+    """Face count for a search, cached like the gallery pages"""
+    return get_face_manager().count_faces(search)
+
+# Bound by init_managers() at the start of each run, so importing this module opens nothing
+db_manager: Optional[DatabaseManager] = None
+face_manager: Optional[FaceRecognitionManager] = None
+
+def init_managers():
+    """Bind the shared managers for this script run"""
+    global db_manager, face_manager
+    db_manager = get_db_manager()
+    face_manager = get_face_manager()
+    get_metrics_writer()
 
 def login_page():
     """Login page"""
@@ -635,6 +140,65 @@ def login_page():
         # Registration info
         st.info("ℹ️ **New users** are created with regular user privileges")
         
+def page_cursors(key: str, query) -> list:
+    """Keyset cursors of the pages visited so far; a different ``query`` starts over at page 1"""
+    if st.session_state.get(f"{key}_query") != query:
+        st.session_state[f"{key}_query"] = query
+        st.session_state[f"{key}_cursors"] = [None]
+    return st.session_state[f"{key}_cursors"]
+
+def page_buttons(key: str, cursors: list, next_cursor):
+    """Newer/Older navigation for a keyset-paginated table"""
+    col1, col2, col3 = st.columns([1, 2, 1])
+    with col1:
+        if len(cursors) > 1 and st.button("⬅️ Newer", key=f"{key}_newer"):
+            cursors.pop()
+            st.rerun()
+    with col2:
+        st.caption(f"Page {len(cursors)}")
+    with col3:
+        if next_cursor is not None and st.button("Older ➡️", key=f"{key}_older"):
+            cursors.append(next_cursor)
+            st.rerun()
+
+def export_controls(key: str, file_stem: str, export, service_path: str, params: dict):
+    """Format picker plus an export download.
+
+    With KHOYA_SERVICE_URL set the button links to the HTTP service, which
+    streams the file from disk. Otherwise the export is written to a temp
+    file and handed to st.download_button, which holds the whole file in
+    the app's memory while it is offered.
+    """
+    col1, col2 = st.columns([1, 2])
+    with col1:
+        fmt = st.selectbox("Format", available_formats(), format_func=lambda f: EXPORT_FORMATS[f][0],
+                           key=f"{key}_format")
+    label, extension, mime = EXPORT_FORMATS[fmt]
+    with col2:
+        if SERVICE_URL:
+            query = urlencode({name: value for name, value in dict(params, format=fmt).items() if value})
+            st.link_button(f"📥 Download ({label})", f"{SERVICE_URL}{service_path}?{query}")
+            st.caption("Streamed by the HTTP service; sign in with your account when the browser asks")
+            return
+        
+        if st.button("📥 Prepare Export", key=f"{key}_prepare"):
+            with st.spinner("Exporting..."):
+                path, rows = export(fmt)
+            try:
+                with open(path, 'rb') as handle:
+                    st.download_button(
+                        label=f"📥 Download {rows} rows ({label})",
+                        data=handle.read(),
+                        file_name=f"{file_stem}_{datetime.now().strftime('%Y%m%d_%H%M%S')}{extension}",
+                        mime=mime,
+                        key=f"{key}_download"
+                    )
+            finally:
+                # The download button keeps its own copy of the bytes
+                os.remove(path)
+        st.caption("The export is held in memory while it is offered; set KHOYA_SERVICE_URL "
+                   "to stream large exports from the HTTP service")
+
 def display_face_profile(face_id: int, face_name: str):
     """Display detailed face profile with scan history (admin only)"""
     if st.session_state.user_type != 'admin':
@@ -653,6 +217,10 @@ def display_face_profile(face_id: int, face_name: str):
     col1, col2 = st.columns(2)
     
     with col1:
+        thumbnail = face_manager.get_face_photo(face_id, thumbnail=True)
+        if thumbnail:
+            st.image(thumbnail, caption="Enrollment photo")
+        
         st.markdown("### Basic Information")
         st.write(f"**Name:** {profile['name']}")
         if profile.get('age'):
@@ -681,6 +249,8 @@ def display_face_profile(face_id: int, face_name: str):
         scan_history = face_manager.get_face_scan_history(face_id)
         st.metric("Detailed Records", len(scan_history))
     
+    face_samples_section(face_id)
+    
     # Detailed scan history
     st.markdown("### 📊 Detailed Scan History")
     st.markdown("*All instances when this face was spotted, along with user information*")
@@ -712,20 +282,50 @@ def display_face_profile(face_id: int, face_name: str):
         # Export option
         if len(scan_history) > 0:
             st.markdown("### 📥 Export Data")
-            export_df = pd.DataFrame(scan_history)
-            csv_data = export_df.to_csv(index=False)
-            
-            st.download_button(
-                label="📥 Download Scan History (CSV)",
-                data=csv_data,
-                file_name=f"{face_name}_scan_history_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-                mime="text/csv"
+            date_range = st.date_input("Date Range (UTC)", value=[], key=f"scan_export_range_{face_id}")
+            start, end = date_range_bounds(date_range)
+            export_controls(
+                f"scan_export_{face_id}",
+                f"{face_name}_scan_history",
+                lambda fmt: face_manager.export_face_scan_history(face_id, fmt, start, end),
+                f"/faces/{face_id}/history/export", {'start': start, 'end': end}
             )
     else:
         st.info("No scan history available for this face.")
 
+def face_samples_section(face_id: int):
+    """Enrollment samples of a face, with controls to add or remove photos"""
+    st.markdown("### 🧬 Enrollment Samples")
+    st.markdown("*More photos of the same person (other angles, lighting, glasses) improve matching*")
+    
+    samples = face_manager.get_face_samples(face_id)
+    columns = st.columns(min(max(len(samples), 1), 6))
+    for i, sample in enumerate(samples):
+        with columns[i % len(columns)]:
+            if sample['thumbnail']:
+                st.image(sample['thumbnail'], use_container_width=True)
+            distance = f"{sample['distance']:.2f}" if sample['distance'] is not None else "n/a"
+            st.caption(f"#{sample['id']} · {sample['added_at'][:10]} · distance {distance}")
+            if len(samples) > 1 and st.button("🗑️ Remove", key=f"remove_sample_{sample['id']}"):
+                success, message = face_manager.remove_face_sample(face_id, sample['id'])
+                if success:
+                    st.rerun()
+                st.error(message)
+    
+    with st.form(f"add_sample_form_{face_id}", clear_on_submit=True):
+        uploaded_file = st.file_uploader("Add another photo", type=['jpg', 'jpeg', 'png', 'bmp', 'tiff', 'tif', 'webp'])
+        if st.form_submit_button("➕ Add Sample") and uploaded_file:
+            success, message = face_manager.add_face_sample(face_id, Image.open(uploaded_file),
+                                                            uploaded_file.getvalue())
+            if success:
+                st.success(message)
+            else:
+                st.error(message)
+
 def admin_dashboard():
     """Admin dashboard with full control"""
+    import pandas as pd
+    
     st.title("👨‍💼 Admin Dashboard")
     
     # Sidebar for admin functions
@@ -733,7 +333,8 @@ def admin_dashboard():
         st.subheader("Admin Functions")
         admin_action = st.selectbox(
             "Select Action",
-            ["User Management", "Face Database", "System Analytics", "Recognition Logs", "User Profiles"]
+            ["User Management", "Face Database", "System Analytics", "Performance", "Recognition Logs",
+             "User Profiles"]
         )
     
     if admin_action == "User Management":
@@ -769,6 +370,9 @@ def admin_dashboard():
     elif admin_action == "System Analytics":
         system_analytics()
     
+    elif admin_action == "Performance":
+        performance_dashboard()
+    
     elif admin_action == "Recognition Logs":
         recognition_logs()
     
@@ -799,10 +403,72 @@ def user_dashboard():
     elif user_action == "Recognition History":
         user_recognition_history()
 
+def draw_face_boxes(image, faces) -> Image.Image:
+    """Draw a labelled box around every recognized (green) or unknown (red) face"""
+    annotated = image.convert('RGB') if image.mode != 'RGB' else image.copy()
+    draw = ImageDraw.Draw(annotated)
+    line_width = max(2, annotated.width // 300)
+    for face in faces:
+        top, right, bottom, left = face['box']
+        color = (0, 200, 0) if face['name'] else (220, 0, 0)
+        label = f"{face['name']} ({face['confidence']:.0f}%)" if face['name'] else "Unknown"
+        draw.rectangle([left, top, right, bottom], outline=color, width=line_width)
+        text_box = draw.textbbox((left, bottom), label)
+        draw.rectangle([text_box[0] - 2, text_box[1] - 2, text_box[2] + 2, text_box[3] + 2], fill=color)
+        draw.text((left, bottom), label, fill=(255, 255, 255))
+    return annotated
+
+def show_multi_face_results(image, method: str, location: str, device_info: str):
+    """Recognize every face in the image, draw the results and log the matches"""
+    import pandas as pd
+    
+    faces, error = face_manager.recognize_faces_in_image(
+        image,
+        user_id=st.session_state.current_user['id'],
+        method=method,
+        location=location,
+        device_info=device_info
+    )
+    
+    if error:
+        st.error(f"Recognition failed: {error}")
+        return
+    
+    st.image(draw_face_boxes(image, faces), caption=f"{len(faces)} faces detected", use_container_width=True)
+    
+    recognized = [face for face in faces if face['name']]
+    st.info(f"🕐 Scan Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    if recognized:
+        st.success(f"✅ Recognized {len(recognized)} of {len(faces)} faces")
+        st.dataframe(pd.DataFrame([
+            {'Person': face['name'], 'Confidence': round(face['confidence'], 2), 'Box (top, right, bottom, left)': str(face['box'])}
+            for face in recognized
+        ]), use_container_width=True)
+    else:
+        st.warning("❌ None of the detected faces match the database")
+
+def show_candidates(ranked):
+    """Top-k candidates of a ranked match, so close calls can be reviewed without recognizing again"""
+    import pandas as pd
+    
+    if ranked.ambiguous:
+        st.warning(f"⚠️ Ambiguous match: the top two candidates are only {ranked.margin:.3f} apart")
+    with st.expander(f"🔎 Top {len(ranked.candidates)} candidates", expanded=ranked.ambiguous):
+        df = pd.DataFrame([(c.name, c.face_id, round(c.distance, 3), f"{c.probability * 100:.1f}%")
+                           for c in ranked.candidates], columns=['Name', 'Face ID', 'Distance', 'Probability'])
+        st.dataframe(df, use_container_width=True, hide_index=True)
+        if ranked.margin is not None:
+            st.caption(f"Margin between first and second candidate: {ranked.margin:.3f}")
+
 def photo_recognition():
     """Photo upload and recognition feature"""
     st.subheader("📷 Photo Recognition")
     
+    mode = st.radio("Mode", ["Single Image", "Batch Upload"], horizontal=True)
+    if mode == "Batch Upload":
+        batch_photo_recognition()
+        return
+    
     uploaded_file = st.file_uploader(
         "Upload an image for recognition",
         type=['jpg', 'jpeg', 'png', 'bmp', 'tiff', 'tif', 'webp'],
@@ -823,10 +489,29 @@ def photo_recognition():
                 st.image(image, caption="Uploaded Image", use_container_width=True)
             
             with col2:
-                if st.button("🔍 Recognize Face", type="primary"):
+                multi_face = st.checkbox("👥 Detect all faces (group photo)")
+                recognize_button = st.button("🔍 Recognize Face", type="primary")
+                
+                if recognize_button and multi_face:
+                    with st.spinner("Recognizing faces..."):
+                        show_multi_face_results(image, "photo_upload", "Web App", "Browser Upload")
+                elif recognize_button:
                     with st.spinner("Recognizing face..."):
-                        result = face_manager.recognize_face(image)
-                        name, error, confidence, face_id = result
+                        # Matches are logged and added to the user's profile in the same transaction
+                        ranked, error = face_manager.recognize_face_ranked(
+                            image,
+                            user_id=st.session_state.current_user['id'],
+                            method="photo_upload",
+                            location="Web App",
+                            device_info="Browser Upload"
+                        )
+                        best = ranked.best(0.6) if ranked else None
+                        name, confidence, face_id = None, 0.0, None
+                        if best:
+                            name, confidence, face_id = best.name, best.probability * 100, best.face_id
+                        
+                        if ranked and ranked.candidates:
+                            show_candidates(ranked)
                         
                         if error:
                             st.error(f"Recognition failed: {error}")
@@ -835,20 +520,6 @@ def photo_recognition():
                             st.info(f"Confidence: {confidence:.2f}%")
                             st.info(f"🕐 Scan Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
                             
-                            # Log the recognition with face ID
-                            face_manager.log_recognition(
-                                st.session_state.current_user['id'],
-                                name,
-                                confidence,
-                                "photo_upload",
-                                face_id,
-                                "Web App",
-                                "Browser Upload"
-                            )
-                            
-                            # Update user profile
-                            face_manager.update_user_profile(st.session_state.current_user['id'], name)
-                            
                             # Display face profile information
                             if face_id:
                                 profile = face_manager.get_face_profile(face_id)
@@ -877,12 +548,76 @@ def photo_recognition():
         except Exception as e:
             st.error(f"Error processing image: {str(e)}")
 
+def batch_photo_recognition():
+    """Recognize many uploaded photos at once, streaming results into a table"""
+    import pandas as pd
+    
+    uploaded_files = st.file_uploader(
+        "Upload images for recognition",
+        type=['jpg', 'jpeg', 'png', 'bmp', 'tiff', 'tif', 'webp'],
+        accept_multiple_files=True,
+        help="Upload any number of images; each one should contain a single face"
+    )
+    
+    if uploaded_files:
+        st.info(f"{len(uploaded_files)} images selected")
+        
+        if st.button("🔍 Recognize All", type="primary"):
+            progress = st.progress(0.0)
+            table = st.empty()
+            rows = []
+            
+            # Work in chunks so the table fills in while the rest are still processing
+            chunk_size = 16
+            for start in range(0, len(uploaded_files), chunk_size):
+                chunk = uploaded_files[start:start + chunk_size]
+                images = []
+                for uploaded_file in chunk:
+                    try:
+                        images.append(Image.open(uploaded_file))
+                    except Exception:
+                        images.append(None)
+                
+                loaded = [image for image in images if image is not None]
+                results = iter(face_manager.recognize_faces_batch(
+                    loaded,
+                    user_id=st.session_state.current_user['id'],
+                    method="batch_upload",
+                    location="Web App",
+                    device_info="Browser Batch Upload"
+                ))
+                
+                for uploaded_file, image in zip(chunk, images):
+                    if image is None:
+                        name, error, confidence = None, "Could not open image", 0.0
+                    else:
+                        name, error, confidence, _ = next(results)
+                    rows.append({
+                        'File': uploaded_file.name,
+                        'Recognized Person': name or '',
+                        'Confidence': round(confidence, 2),
+                        'Status': error or 'Matched'
+                    })
+                
+                table.dataframe(pd.DataFrame(rows), use_container_width=True)
+                progress.progress(min(1.0, (start + len(chunk)) / len(uploaded_files)))
+            
+            matched = sum(1 for row in rows if row['Status'] == 'Matched')
+            st.success(f"✅ Recognized {matched} of {len(rows)} images")
+
 def live_recognition():
     """Live camera recognition feature"""
     st.subheader("📹 Live Recognition")
     
     st.info("📌 Use your camera to capture and recognize faces in real-time")
     
+    mode = st.radio("Mode", ["📸 Snapshot", "🎥 Video Stream"], horizontal=True)
+    if mode == "🎥 Video Stream":
+        live_video_recognition()
+        return
+    
+    multi_face = st.checkbox("👥 Detect all faces (group photo)")
+    
     # Camera input
     camera_input = st.camera_input("Take a picture for recognition")
     
@@ -890,6 +625,11 @@ def live_recognition():
         try:
             image = Image.open(camera_input)
             
+            if multi_face:
+                with st.spinner("Recognizing faces..."):
+                    show_multi_face_results(image, "live_camera", "Web App Camera", "Live Camera Feed")
+                return
+            
             col1, col2 = st.columns(2)
             
             with col1:
@@ -897,7 +637,14 @@ def live_recognition():
             
             with col2:
                 with st.spinner("Recognizing face..."):
-                    result = face_manager.recognize_face(image)
+                    # Matches are logged and added to the user's profile in the same transaction
+                    result = face_manager.recognize_face(
+                        image,
+                        user_id=st.session_state.current_user['id'],
+                        method="live_camera",
+                        location="Web App Camera",
+                        device_info="Live Camera Feed"
+                    )
                     name, error, confidence, face_id = result
                     
                     if error:
@@ -907,20 +654,6 @@ def live_recognition():
                         st.info(f"Confidence: {confidence:.2f}%")
                         st.info(f"🕐 Scan Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
                         
-                        # Log the recognition with face ID
-                        face_manager.log_recognition(
-                            st.session_state.current_user['id'],
-                            name,
-                            confidence,
-                            "live_camera",
-                            face_id,
-                            "Web App Camera",
-                            "Live Camera Feed"
-                        )
-                        
-                        # Update user profile
-                        face_manager.update_user_profile(st.session_state.current_user['id'], name)
-                        
                         # Display face profile information
                         if face_id:
                             profile = face_manager.get_face_profile(face_id)
@@ -947,11 +680,80 @@ def live_recognition():
         except Exception as e:
             st.error(f"Error processing image: {str(e)}")
 
+def live_video_recognition():
+    """Continuous recognition on a camera, stream URL or uploaded video file"""
+    from video_pipeline import VIDEO_DETECT_EVERY, VideoRecognizer, draw_tracks, open_capture
+    
+    source_type = st.radio("Source", ["Camera / Stream URL", "Video File"], horizontal=True)
+    
+    if source_type == "Video File":
+        video_file = st.file_uploader("Upload a video", type=['mp4', 'avi', 'mov', 'mkv'])
+        if video_file is None:
+            return
+        # OpenCV reads from a path, so keep one temp copy per upload across reruns
+        if st.session_state.get('video_upload_id') != video_file.file_id:
+            suffix = os.path.splitext(video_file.name)[1]
+            with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as handle:
+                handle.write(video_file.getvalue())
+            st.session_state.video_upload_id = video_file.file_id
+            st.session_state.video_upload_path = handle.name
+        source = st.session_state.video_upload_path
+        source_label = video_file.name
+    else:
+        source = st.text_input("Camera index or stream URL (RTSP/HTTP)", value="0")
+        source_label = source
+    
+    detect_every = st.slider("Run face detection every N frames", 1, 30, VIDEO_DETECT_EVERY)
+    
+    if not st.toggle("▶️ Start stream"):
+        st.info("📌 Faces are detected every few frames, tracked in between and identified once per track")
+        return
+    
+    try:
+        capture = open_capture(source)
+    except IOError as e:
+        st.error(str(e))
+        return
+    
+    frame_slot = st.empty()
+    metrics_slot = st.empty()
+    recognizer = VideoRecognizer(face_manager.match_encodings, detect_every=detect_every)
+    deduplicator = RecognitionDeduplicator()
+    user_id = st.session_state.current_user['id']
+    session = f"{user_id}:{source_label}"
+    
+    try:
+        for frame, result in recognizer.run(capture):
+            # Every frame's sightings collapse into one event per face until it leaves for the cooldown
+            for track in result.tracks:
+                if track.face_id is not None:
+                    deduplicator.observe(RecognitionEvent(
+                        track.face_id, track.name, track.confidence, user_id,
+                        "live_video", "Video Stream", source_label
+                    ), session)
+            face_manager.record_recognitions(deduplicator.expired())
+            
+            frame_slot.image(draw_tracks(frame, result.tracks), channels="BGR")
+            
+            if result.detected:
+                metrics = recognizer.metrics.snapshot()
+                metrics_slot.caption(
+                    f"⚡ {metrics['fps']:.1f} FPS · detect {metrics['detect_ms']:.0f} ms · "
+                    f"track {metrics['track_ms']:.1f} ms · encode {metrics['encode_ms']:.0f} ms · "
+                    f"{len(result.tracks)} faces · {metrics['encodes']} encodes in {metrics['frames']} frames · "
+                    f"{deduplicator.observed} sightings → {deduplicator.emitted} log entries"
+                )
+    finally:
+        capture.release()
+        face_manager.record_recognitions(deduplicator.flush())
+    
+    st.info("Stream ended")
+
 def face_database_management():
     """Face database management (admin feature)"""
     st.subheader("🗄️ Face Database Management")
     
-    tab1, tab2, tab3 = st.tabs(["Add New Face", "View Database", "Live Add Face"])
+    tab1, tab2, tab3, tab4 = st.tabs(["Add New Face", "View Database", "Live Add Face", "Bulk Import"])
     
     with tab1:
         st.subheader("Add New Face to Database")
@@ -975,6 +777,8 @@ def face_database_management():
                 help="Upload a clear image of the person's face (supports JPG, PNG, BMP, TIFF, WebP)"
             )
             
+            allow_duplicate = st.checkbox("Allow near-duplicate", help="Add even if the face closely matches someone already enrolled")
+            
             submit_button = st.form_submit_button("Add to Database")
             
             if submit_button:
@@ -996,7 +800,9 @@ def face_database_management():
                             age=age if age and age > 0 else None,
                             occupation=occupation,
                             department=department,
-                            contact_info=contact_info
+                            contact_info=contact_info,
+                            photo_bytes=uploaded_file.getvalue(),
+                            allow_duplicate=allow_duplicate
                         )
                         
                         if success:
@@ -1010,7 +816,6 @@ def face_database_management():
     
     with tab2:
         st.subheader("Face Database")
-        faces = face_manager.get_all_faces()
         
         # Check if we should show a specific profile
         if 'show_profile_id' in st.session_state and st.session_state.show_profile_id:
@@ -1027,26 +832,30 @@ def face_database_management():
             display_face_profile(face_id, face_name)
         
         else:
-            # Normal database view
-            if faces:
-                st.info(f"Total faces in database: {len(faces)}")
+            # Normal database view, one cached page at a time
+            generation = db_manager.get_gallery_generation()
+            total = cached_face_count(generation, "")
+            if total:
+                st.info(f"Total faces in database: {total}")
                 
-                # Search functionality
-                search_term = st.text_input("🔍 Search by name:", placeholder="Enter name to search...")
+                # Server-side search over name, description, occupation, department and tags
+                search_term = st.text_input("🔍 Search people:", placeholder="Name, occupation, department...")
+                search_term = search_term.strip()
+                cursors = page_cursors('gallery', search_term)
+                page_faces, next_cursor = cached_faces_page(generation, search_term, cursors[-1])
                 
-                # Filter faces based on search
-                if search_term:
-                    filtered_faces = [face for face in faces if search_term.lower() in face['name'].lower()]
-                else:
-                    filtered_faces = faces
-                
-                if filtered_faces:
-                    st.write(f"**Showing {len(filtered_faces)} of {len(faces)} faces**")
+                if page_faces:
+                    matches = cached_face_count(generation, search_term) if search_term else total
+                    st.write(f"**Showing {len(page_faces)} of {matches} matching faces**")
                     
                     # Display as cards with enhanced profile information
-                    for face in filtered_faces:
+                    for face in page_faces:
                         with st.expander(f"👤 {face['name']} (ID: {face['id']}) - {face.get('scan_count', 0)} scans"):
-                            col1, col2, col3, col4 = st.columns([2, 2, 2, 1])
+                            col0, col1, col2, col3, col4 = st.columns([1, 2, 2, 2, 1])
+                            
+                            with col0:
+                                if face['thumbnail']:
+                                    st.image(face['thumbnail'], use_container_width=True)
                             
                             with col1:
                                 st.write("**Basic Information**")
@@ -1091,7 +900,7 @@ def face_database_management():
                     st.markdown("*Click on any name to view detailed profile*")
                     
                     # Create a more interactive table
-                    for face in filtered_faces:
+                    for face in page_faces:
                         cols = st.columns([3, 2, 2, 2, 2, 2])
                         
                         with cols[0]:
@@ -1124,6 +933,8 @@ def face_database_management():
                             st.write(f"By: {face.get('added_by', 'Unknown')}")
                         
                         st.divider()
+                    
+                    page_buttons('gallery', cursors, next_cursor)
                 
                 else:
                     st.warning(f"No faces found matching '{search_term}'")
@@ -1155,6 +966,7 @@ def face_database_management():
                     department = st.text_input("Department")
                     contact_info = st.text_input("Contact Info")
                     description = st.text_area("Description")
+                    allow_duplicate = st.checkbox("Allow near-duplicate")
                     
                     add_button = st.form_submit_button("Add to Database")
                     
@@ -1169,7 +981,9 @@ def face_database_management():
                                     age=age if age and age > 0 else None,
                                     occupation=occupation,
                                     department=department,
-                                    contact_info=contact_info
+                                    contact_info=contact_info,
+                                    photo_bytes=camera_input.getvalue(),
+                                    allow_duplicate=allow_duplicate
                                 )
                                 
                                 if success:
@@ -1181,9 +995,79 @@ def face_database_management():
                                 st.error(f"Error processing image: {str(e)}")
                         else:
                             st.error("Please provide a name for the person")
+    
+    with tab4:
+        bulk_import_tab()
+
+def bulk_import_tab():
+    """Enroll many faces at once from a ZIP upload or a folder/manifest on the server"""
+    import pandas as pd
+    from bulk_import import BulkImporter, open_source, open_upload
+    
+    st.subheader("📦 Bulk Import")
+    st.info("📌 Each image is enrolled under its file name, or under the names listed in a manifest.csv "
+            "(columns: file, name, description, age, occupation, department, contact_info, tags). "
+            "Importing the same source again skips files that were already added.")
+    
+    with st.form("bulk_import_form"):
+        uploaded_zip = st.file_uploader("Upload a ZIP archive", type=['zip'])
+        server_path = st.text_input("...or a folder, ZIP or manifest.csv path on the server")
+        col1, col2 = st.columns(2)
+        with col1:
+            allow_duplicates = st.checkbox("Allow near-duplicates")
+        with col2:
+            retry_errors = st.checkbox("Retry files that failed before")
+        start_button = st.form_submit_button("🚀 Start Import")
+    
+    if not start_button:
+        return
+    sources = ExitStack()
+    try:
+        if uploaded_zip is not None:
+            source, items = sources.enter_context(open_upload(uploaded_zip.getvalue()))
+        elif server_path:
+            source, items = sources.enter_context(open_source(server_path))
+        else:
+            st.error("Upload a ZIP archive or enter a path")
+            return
+    except Exception as e:
+        st.error(f"Could not open the import source: {str(e)}")
+        return
+    with sources:
+        if not items:
+            st.warning("No images found")
+            return
+        
+        progress_bar = st.progress(0.0)
+        status = st.empty()
+        
+        def show_progress(report):
+            progress_bar.progress((report.processed + report.skipped) / report.total)
+            status.text(report.summary())
+        
+        importer = BulkImporter(face_manager, st.session_state.current_user['username'],
+                                allow_duplicates=allow_duplicates, retry_errors=retry_errors)
+        report = importer.run(source, items, progress=show_progress)
+    
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Added", report.added)
+    col2.metric("Failed", report.failed)
+    col3.metric("Skipped", report.skipped)
+    col4.metric("Files/s", f"{report.rate():.1f}")
+    
+    if report.errors:
+        st.dataframe(pd.DataFrame(report.errors, columns=['File', 'Name', 'Error']), use_container_width=True)
+        buffer = io.StringIO()
+        report.write_errors(buffer)
+        st.download_button("📥 Download error report", buffer.getvalue(),
+                           file_name="bulk_import_errors.csv", mime="text/csv")
+    else:
+        st.success("All files imported")
 
 def user_profile():
     """User profile page"""
+    import pandas as pd
+    
     st.subheader("👤 My Profile")
     
     user = st.session_state.current_user
@@ -1197,50 +1081,33 @@ def user_profile():
     
     with col2:
         # Get user profile data
-        conn = db_manager.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT recognized_faces, total_recognitions, last_recognition
-            FROM user_profiles WHERE user_id = ?
-        ''', (user['id'],))
-        
-        profile = cursor.fetchone()
-        conn.close()
+        profile = db_manager.get_user_profile_summary(user['id'])
         
         if profile:
-            recognized_faces = json.loads(profile[0] or '[]')
-            st.metric("Total Recognitions", profile[1] or 0)
-            st.metric("Unique Faces Recognized", len(recognized_faces))
-            if profile[2]:
-                st.info(f"Last Recognition: {profile[2]}")
-            
-            if recognized_faces:
-                st.subheader("Recognized People:")
-                for face in recognized_faces:
-                    st.write(f"• {face}")
+            st.metric("Total Recognitions", profile['total_recognitions'])
+            st.metric("Unique Faces Recognized", profile['unique_faces'])
+            if profile['last_recognition']:
+                st.info(f"Last Recognition: {profile['last_recognition']}")
         else:
             st.info("No recognition data available")
+    
+    if profile and profile['unique_faces']:
+        st.subheader("Recognized People:")
+        cursors = page_cursors('profile_faces', user['id'])
+        people, next_cursor = db_manager.get_user_face_counts_page(user['id'], cursors[-1])
+        df = pd.DataFrame([person[1:] for person in people], columns=['Person', 'Times Recognized', 'Last Seen'])
+        st.dataframe(df, use_container_width=True)
+        page_buttons('profile_faces', cursors, next_cursor)
 
 def user_recognition_history():
     """User's recognition history"""
+    import pandas as pd
+    
     st.subheader("📊 Recognition History")
     
     user_id = st.session_state.current_user['id']
     
-    conn = db_manager.get_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT recognized_person, confidence, timestamp, method
-        FROM recognition_logs 
-        WHERE user_id = ?
-        ORDER BY timestamp DESC
-        LIMIT 50
-    ''', (user_id,))
-    
-    logs = cursor.fetchall()
-    conn.close()
+    logs = db_manager.get_user_recognition_history(user_id, 50)
     
     if logs:
         df = pd.DataFrame(logs, columns=['Person', 'Confidence', 'Timestamp', 'Method'])
@@ -1261,75 +1128,138 @@ def user_recognition_history():
 
 def system_analytics():
     """System analytics (admin only)"""
-    st.subheader("📊 System Analytics")
-    
-    conn = db_manager.get_connection()
-    cursor = conn.cursor()
+    import pandas as pd
     
-    # Total statistics
-    cursor.execute("SELECT COUNT(*) FROM users")
-    total_users = cursor.fetchone()[0]
-    
-    cursor.execute("SELECT COUNT(*) FROM faces")
-    total_faces = cursor.fetchone()[0]
+    st.subheader("📊 System Analytics")
     
-    cursor.execute("SELECT COUNT(*) FROM recognition_logs")
-    total_recognitions = cursor.fetchone()[0]
+    # Totals and charts read only the trigger-maintained rollup tables
+    totals = db_manager.get_analytics_totals()
     
     col1, col2, col3 = st.columns(3)
     with col1:
-        st.metric("Total Users", total_users)
+        st.metric("Total Users", totals['users'])
     with col2:
-        st.metric("Total Faces", total_faces)
+        st.metric("Total Faces", totals['faces'])
     with col3:
-        st.metric("Total Recognitions", total_recognitions)
-    
-    # Recent activity
-    st.subheader("Recent Activity")
-    cursor.execute('''
-        SELECT u.username, rl.recognized_person, rl.confidence, rl.timestamp, rl.method
-        FROM recognition_logs rl
-        JOIN users u ON rl.user_id = u.id
-        ORDER BY rl.timestamp DESC
-        LIMIT 20
-    ''')
-    
-    recent_logs = cursor.fetchall()
+        st.metric("Total Recognitions", totals['recognitions'])
+    
+    # Gallery search backend
+    index_info = face_manager.gallery.describe_index()
+    st.caption(
+        f"Search index: {index_info['backend']} ({index_info['recall']}) over {index_info['size']} encodings"
+    )
+    if face_manager.cache is not None and face_manager.cache.enabled:
+        cache_stats = face_manager.cache.stats()
+        st.caption(
+            f"Encoding cache: {cache_stats['entries']} entries ({cache_stats['size_mb']:.1f} MB), "
+            f"{cache_stats['hits']} hits ({cache_stats['disk_hits']} from disk) / {cache_stats['misses']} misses "
+            f"({cache_stats['hit_rate']:.0%}), {cache_stats['evictions']} evictions"
+        )
+    
+    days = st.slider("Days", 7, 365, 30)
+    
+    daily = db_manager.get_daily_recognitions(days)
+    if daily:
+        st.subheader("Recognitions per Day")
+        daily_df = pd.DataFrame(daily, columns=['Day', 'Recognitions', 'Average Confidence']).set_index('Day')
+        st.line_chart(daily_df['Recognitions'])
+    
+    histogram = db_manager.get_confidence_histogram(days)
+    if histogram:
+        st.subheader("Confidence Distribution")
+        hist_df = pd.DataFrame(
+            [(f"{bucket * 10}-{bucket * 10 + 10}%", count) for bucket, count in histogram],
+            columns=['Confidence', 'Recognitions']
+        ).set_index('Confidence')
+        st.bar_chart(hist_df)
+    
+    top_people = db_manager.get_top_people()
+    if top_people:
+        st.subheader("Most Recognized People")
+        st.dataframe(
+            pd.DataFrame(top_people, columns=['Person', 'Recognitions', 'Average Confidence', 'Last Recognized']),
+            use_container_width=True
+        )
+    
+    # Recent activity: the newest rows, read backwards off the log timestamp index
+    recent_logs = db_manager.get_recent_activity(20)
     if recent_logs:
+        st.subheader("Recent Activity")
         df = pd.DataFrame(recent_logs, columns=['User', 'Recognized Person', 'Confidence', 'Timestamp', 'Method'])
         st.dataframe(df, use_container_width=True)
+
+def performance_dashboard():
+    """Latency of each recognition pipeline stage (admin only)"""
+    import pandas as pd
+    
+    st.subheader("⏱️ Performance")
+    
+    rows = REGISTRY.summary()
+    if not rows:
+        st.info("No timings recorded yet. Run a recognition and come back.")
+        return
     
-    conn.close()
+    df = pd.DataFrame(rows).set_index('stage')
+    df['description'] = [STAGES.get(stage, '') for stage in df.index]
+    st.caption(
+        f"Percentiles cover the last {REGISTRY.window} runs of each stage in this app process; "
+        f"counts since {datetime.fromtimestamp(REGISTRY.started).strftime('%Y-%m-%d %H:%M:%S')}"
+    )
+    st.dataframe(
+        df.rename(columns={'count': 'Count', 'errors': 'Errors', 'mean_ms': 'Mean (ms)', 'p50_ms': 'p50 (ms)',
+                           'p95_ms': 'p95 (ms)', 'p99_ms': 'p99 (ms)', 'max_ms': 'Max (ms)',
+                           'description': 'Measures'}),
+        use_container_width=True
+    )
+    
+    st.subheader("p95 Latency by Stage (ms)")
+    st.bar_chart(df['p95_ms'])
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        st.download_button("📥 Prometheus Export", REGISTRY.render(), file_name="khoya_metrics.prom",
+                           mime="text/plain")
+    with col2:
+        if st.button("🔄 Reset Timings"):
+            REGISTRY.reset()
+            st.rerun()
 
 def recognition_logs():
-    """View all recognition logs (admin only)"""
+    """View recognition logs one page at a time (admin only)"""
+    import pandas as pd
+    
     st.subheader("📋 Recognition Logs")
     
-    conn = db_manager.get_connection()
-    cursor = conn.cursor()
+    users = {user['id']: user['username'] for user in db_manager.get_all_users()}
     
-    cursor.execute('''
-        SELECT u.username, rl.recognized_person, rl.confidence, rl.timestamp, rl.method
-        FROM recognition_logs rl
-        JOIN users u ON rl.user_id = u.id
-        ORDER BY rl.timestamp DESC
-    ''')
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        user_id = st.selectbox("User", [None] + list(users), format_func=lambda uid: "All" if uid is None else users[uid])
+    with col2:
+        person = st.text_input("Recognized Person").strip()
+    with col3:
+        method = st.selectbox("Method", [""] + db_manager.get_log_methods(), format_func=lambda m: m or "All")
+    with col4:
+        date_range = st.date_input("Date Range (UTC)", value=[])
     
-    logs = cursor.fetchall()
-    conn.close()
+    start, end = date_range_bounds(date_range)
+    filters = LogFilters(user_id, person, method, start, end)
+    
+    cursors = page_cursors('logs', filters)
+    logs, next_cursor = db_manager.get_recognition_logs_page(filters, cursors[-1])
     
     if logs:
-        df = pd.DataFrame(logs, columns=['User', 'Recognized Person', 'Confidence', 'Timestamp', 'Method'])
+        df = pd.DataFrame([log[1:] for log in logs],
+                          columns=['User', 'Recognized Person', 'Confidence', 'Timestamp', 'Method'])
         st.dataframe(df, use_container_width=True)
         
-        # Download option
-        csv = df.to_csv(index=False)
-        st.download_button(
-            label="Download CSV",
-            data=csv,
-            file_name=f"recognition_logs_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-            mime="text/csv"
-        )
+        page_buttons('logs', cursors, next_cursor)
+        
+        # Export every row matching the filters, not just this page
+        st.markdown("### 📥 Export Data")
+        export_controls("log_export", "recognition_logs",
+                        lambda fmt: db_manager.export_recognition_logs(filters, fmt),
+                        "/logs/export", filters._asdict())
     else:
         st.info("No recognition logs available")
 
@@ -1338,6 +1268,7 @@ def user_profiles_admin():
     st.subheader("👥 User Profiles")
     
     users = db_manager.get_all_users()
+    summaries = db_manager.get_user_recognition_summaries()
     
     if users:
         for user in users:
@@ -1350,33 +1281,38 @@ def user_profiles_admin():
                     st.write(f"**Last Login:** {user['last_login'] or 'Never'}")
                 
                 with col2:
-                    # Get user's recognition data
-                    conn = db_manager.get_connection()
-                    cursor = conn.cursor()
-                    
-                    cursor.execute('''
-                        SELECT COUNT(*) FROM recognition_logs WHERE user_id = ?
-                    ''', (user['id'],))
-                    total_recognitions = cursor.fetchone()[0]
-                    
-                    cursor.execute('''
-                        SELECT recognized_faces, total_recognitions FROM user_profiles WHERE user_id = ?
-                    ''', (user['id'],))
-                    profile = cursor.fetchone()
-                    
-                    st.write(f"**Total Recognitions:** {total_recognitions}")
-                    if profile:
-                        recognized_faces = json.loads(profile[0] or '[]')
-                        st.write(f"**Unique Faces:** {len(recognized_faces)}")
-                    else:
-                        st.write("**Unique Faces:** 0")
-                    
-                    conn.close()
+                    # User's recognition data from the rollup
+                    summary = summaries.get(user['id'], {'total_recognitions': 0, 'unique_faces': 0})
+                    st.write(f"**Total Recognitions:** {summary['total_recognitions']}")
+                    st.write(f"**Unique Faces:** {summary['unique_faces']}")
     else:
         st.info("No users found")
 
+def init_session_state():
+    """Initialize per-session state on the first run of a session"""
+    defaults = {
+        'logged_in': False,
+        'user_type': None,
+        'current_user': None,
+        'camera_active': False,
+        'show_profile_id': None,
+        'show_profile_name': None,
+    }
+    for key, value in defaults.items():
+        if key not in st.session_state:
+            st.session_state[key] = value
+
 def main():
     """Main application function"""
+    # Page configuration
+    st.set_page_config(
+        page_title="Advanced Face Recognition System",
+        page_icon="🔐",
+        layout="wide",
+        initial_sidebar_state="expanded"
+    )
+    init_session_state()
+    init_managers()
     
     # Logout button in sidebar
     if st.session_state.logged_in:
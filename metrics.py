@@ -0,0 +1,252 @@
+"""Per-stage latency spans for the recognition pipeline.
+
+Each stage (image decoding, colour conversion, detection, encoding, the
+gallery read and distance pass, the database writes) runs inside
+``span(stage)``. Each span adds one observation to a process-wide
+histogram. The histograms are exported in the Prometheus text format, by
+the HTTP service at ``/metrics`` and, when ``KHOYA_METRICS_FILE`` is set,
+by rewriting that file every few seconds. A node_exporter textfile
+collector or any scraper can read that file. The last ``KHOYA_METRICS_WINDOW``
+observations of every stage are also kept for exact p50/p95/p99 on the
+admin Performance page.
+
+Detection and encoding run in worker processes. There, spans are captured
+per job and sent back with the result, so they land in the parent
+process's histograms like every other stage.
+"""
+import atexit
+import functools
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# Set to 0 to turn every span into a no-op
+METRICS_ENABLED = os.environ.get('KHOYA_METRICS', '1') != '0'
+# Recent observations kept per stage for the percentiles on the Performance page
+METRICS_WINDOW = int(os.environ.get('KHOYA_METRICS_WINDOW', '2048'))
+# File rewritten with the Prometheus text export ('' disables) and how often
+METRICS_FILE = os.environ.get('KHOYA_METRICS_FILE', '')
+METRICS_FILE_INTERVAL = float(os.environ.get('KHOYA_METRICS_FILE_INTERVAL', '15'))
+
+# Histogram bucket upper bounds in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Pipeline stages in the order a recognition runs through them
+STAGES = {
+    'decode': "PIL image decoded into a pixel array",
+    'color_convert': "Pixel array converted to 8-bit RGB",
+    'cache_lookup': "Encoding cache lookup by image content",
+    'encoding_queue': "Wait between submitting an encoding job and a worker starting it",
+    'detect': "face_locations on the detection copy",
+    'encode': "face_encodings of the detected faces",
+    'encode_job': "Whole encoding job as seen by the caller (queue, detect, encode, transfer)",
+    'gallery_refresh': "SQLite read of the gallery generation before a search",
+    'gallery_reload': "SQLite read of every stored encoding",
+    'gallery_search': "Distance pass and top-k selection against the gallery",
+    'write_scan_count': "UPDATE of faces scan counts",
+    'write_logs': "INSERT into recognition_logs",
+    'write_scan_history': "INSERT into face_scan_history",
+    'write_profile': "Update of the user's recognition counters",
+    'db_write': "Whole recognition write transaction including the commit",
+    'recognize': "recognize_face / recognize_face_ranked end to end",
+    'recognize_batch': "recognize_faces_batch end to end",
+    'recognize_group': "recognize_faces_in_image end to end",
+}
+
+
+class StageStats:
+    """Cumulative histogram plus a window of recent observations for one stage"""
+
+    def __init__(self, window: int):
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.errors = 0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.recent.append(seconds)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                break
+
+
+class MetricsRegistry:
+    """Thread-safe per-stage latency histograms for this process"""
+
+    def __init__(self, window: int = METRICS_WINDOW):
+        self.window = window
+        self.started = time.time()
+        self._stages: Dict[str, StageStats] = {}
+        self._lock = threading.Lock()
+
+    def _stage(self, stage: str) -> StageStats:
+        stats = self._stages.get(stage)
+        if stats is None:
+            stats = self._stages[stage] = StageStats(self.window)
+        return stats
+
+    def observe(self, stage: str, seconds: float, error: bool = False):
+        with self._lock:
+            stats = self._stage(stage)
+            stats.observe(seconds)
+            stats.errors += error
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+            self.started = time.time()
+
+    def _ordered(self):
+        order = {stage: i for i, stage in enumerate(STAGES)}
+        return sorted(self._stages.items(), key=lambda item: (order.get(item[0], len(order)), item[0]))
+
+    def summary(self, percentiles=(50, 95, 99)) -> List[Dict]:
+        """One row per stage: count, errors, mean and the given percentiles (ms) of the recent window"""
+        with self._lock:
+            stages = [(stage, stats.count, stats.errors, stats.total, np.array(stats.recent))
+                      for stage, stats in self._ordered()]
+        rows = []
+        for stage, count, errors, total, recent in stages:
+            row = {'stage': stage, 'count': count, 'errors': errors,
+                   'mean_ms': total / count * 1000 if count else 0.0}
+            values = np.percentile(recent, percentiles) * 1000 if len(recent) else [0.0] * len(percentiles)
+            for percentile, value in zip(percentiles, values):
+                row[f'p{percentile}_ms'] = float(value)
+            row['max_ms'] = float(recent.max()) * 1000 if len(recent) else 0.0
+            rows.append(row)
+        return rows
+
+    def render(self) -> str:
+        """Every stage in the Prometheus text exposition format"""
+        lines = [
+            '# HELP khoya_stage_seconds Latency of each recognition pipeline stage.',
+            '# TYPE khoya_stage_seconds histogram',
+        ]
+        errors = []
+        with self._lock:
+            for stage, stats in self._ordered():
+                cumulative = 0
+                for bound, count in zip(BUCKETS, stats.buckets):
+                    cumulative += count
+                    lines.append(f'khoya_stage_seconds_bucket{{stage="{stage}",le="{bound:g}"}} {cumulative}')
+                lines.append(f'khoya_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {stats.count}')
+                lines.append(f'khoya_stage_seconds_sum{{stage="{stage}"}} {stats.total:.6f}')
+                lines.append(f'khoya_stage_seconds_count{{stage="{stage}"}} {stats.count}')
+                errors.append(f'khoya_stage_errors_total{{stage="{stage}"}} {stats.errors}')
+            started = self.started
+        lines += ['# HELP khoya_stage_errors_total Spans that ended with an exception.',
+                  '# TYPE khoya_stage_errors_total counter'] + errors
+        lines += ['# HELP khoya_metrics_start_time_seconds When these counters were last reset.',
+                  '# TYPE khoya_metrics_start_time_seconds gauge',
+                  f'khoya_metrics_start_time_seconds {started:.3f}']
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path: str):
+        """Atomically replace ``path`` with the current export"""
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as handle:
+            handle.write(self.render())
+        os.replace(tmp_path, path)
+
+
+REGISTRY = MetricsRegistry()
+_local = threading.local()
+
+
+def record(stage: str, seconds: float, error: bool = False):
+    """Add one observation, to the job being captured on this thread if any"""
+    if not METRICS_ENABLED:
+        return
+    captured = getattr(_local, 'captured', None)
+    if captured is not None:
+        captured.append((stage, seconds, error))
+    else:
+        REGISTRY.observe(stage, seconds, error)
+
+
+@contextmanager
+def span(stage: str):
+    """Time the enclosed block as one observation of ``stage``"""
+    if not METRICS_ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        record(stage, time.perf_counter() - start, error=True)
+        raise
+    record(stage, time.perf_counter() - start)
+
+
+def timed(stage: str):
+    """Decorator form of span for functions that are one stage end to end"""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+@contextmanager
+def capture():
+    """Collect the spans of the enclosed block in a list instead of the registry (worker jobs)"""
+    previous = getattr(_local, 'captured', None)
+    _local.captured = []
+    try:
+        yield _local.captured
+    finally:
+        _local.captured = previous
+
+
+def record_all(observations):
+    """Add observations captured in another process"""
+    for stage, seconds, error in observations:
+        REGISTRY.observe(stage, seconds, error)
+
+
+class MetricsFileWriter:
+    """Background thread that rewrites the metrics file every ``interval`` seconds"""
+
+    def __init__(self, path: str = METRICS_FILE, interval: float = METRICS_FILE_INTERVAL,
+                 registry: MetricsRegistry = REGISTRY):
+        self.path = path
+        self.interval = interval
+        self.registry = registry
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="metrics-file", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+    def flush(self):
+        try:
+            self.registry.write(self.path)
+        except OSError:
+            pass
+
+    def close(self):
+        if not self._stop.is_set():
+            self._stop.set()
+            self.flush()
+
+
+def start_file_export(path: str = METRICS_FILE) -> Optional[MetricsFileWriter]:
+    """Start rewriting ``path`` in the background, or return None when no file is configured"""
+    if not path or not METRICS_ENABLED:
+        return None
+    return MetricsFileWriter(path)
@@ -0,0 +1,85 @@
+"""Content-addressed storage for enrollment photos.
+
+Photos live in the ``face_photos`` table keyed by the SHA-256 of their
+bytes, separate from the ``faces`` rows that hold metadata and encodings.
+Uploads are kept in their original compressed format (JPEG stays JPEG), each
+photo is stored once however many faces reference it, and a fixed-size JPEG
+thumbnail is generated alongside it for list views.
+"""
+import hashlib
+import io
+from typing import Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+THUMBNAIL_SIZE = (160, 160)
+
+# Formats kept exactly as uploaded; anything else is re-encoded as JPEG
+PASSTHROUGH_FORMATS = {'JPEG', 'PNG', 'WEBP'}
+
+
+def photo_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def make_thumbnail(data: bytes) -> bytes:
+    """Fixed-size JPEG thumbnail (aspect ratio kept, longest side THUMBNAIL_SIZE)"""
+    image = Image.open(io.BytesIO(data))
+    image.draft('RGB', THUMBNAIL_SIZE)  # let JPEG decode at reduced size
+    image = image.convert('RGB')
+    image.thumbnail(THUMBNAIL_SIZE)
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=85)
+    return buffer.getvalue()
+
+
+def prepare_photo(image, photo_bytes: Optional[bytes] = None) -> Tuple[bytes, str, int, int]:
+    """Bytes, format and size to store for an enrollment image.
+
+    ``photo_bytes`` (the uploaded file as received) is stored untouched when
+    given. Otherwise a PIL image is saved in its own format if that is a
+    compressed web format, and arrays or other formats become JPEG.
+    """
+    if photo_bytes is not None:
+        with Image.open(io.BytesIO(photo_bytes)) as original:
+            return photo_bytes, original.format or 'JPEG', original.width, original.height
+
+    if isinstance(image, Image.Image):
+        fmt = image.format if image.format in PASSTHROUGH_FORMATS else 'JPEG'
+        to_save = image if fmt != 'JPEG' or image.mode in ('RGB', 'L') else image.convert('RGB')
+        buffer = io.BytesIO()
+        to_save.save(buffer, format=fmt, **({'quality': 95} if fmt == 'JPEG' else {}))
+        return buffer.getvalue(), fmt, image.width, image.height
+
+    import cv2
+
+    is_success, buffer = cv2.imencode('.jpg', np.asarray(image), [cv2.IMWRITE_JPEG_QUALITY, 95])
+    if not is_success:
+        raise ValueError("Failed to encode image")
+    return buffer.tobytes(), 'JPEG', image.shape[1], image.shape[0]
+
+
+def store_photo(cursor, data: bytes, fmt: str, width: Optional[int], height: Optional[int],
+                thumbnail: bool = True) -> str:
+    """Insert a photo (once per distinct content) and return its hash.
+
+    ``thumbnail=False`` stores the bytes as they are, without decoding them,
+    for photos that cannot be read as an image.
+    """
+    digest = photo_hash(data)
+    cursor.execute("SELECT 1 FROM face_photos WHERE hash = ?", (digest,))
+    if cursor.fetchone() is None:
+        cursor.execute('''
+            INSERT INTO face_photos (hash, format, data, thumbnail, width, height)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (digest, fmt, data, make_thumbnail(data) if thumbnail else None, width, height))
+    return digest
+
+
+def load_photo(cursor, digest: str, thumbnail: bool = False) -> Optional[bytes]:
+    """Original bytes (or thumbnail) of a stored photo"""
+    column = 'thumbnail' if thumbnail else 'data'
+    cursor.execute(f"SELECT {column} FROM face_photos WHERE hash = ?", (digest,))
+    row = cursor.fetchone()
+    return row[0] if row else None
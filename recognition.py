@@ -0,0 +1,1681 @@
+"""Database, gallery and recognition managers shared by every front end.
+
+The Streamlit app (``main.py``), the HTTP service (``service.py``) and the
+command-line tools all build on these classes. Importing this module has no
+Streamlit dependency and no side effects beyond reading ``KHOYA_*`` settings;
+the database is opened and migrated when a ``DatabaseManager`` is created.
+"""
+import numpy as np
+import os
+import sqlite3
+import hashlib
+import json
+import re
+from datetime import datetime, timedelta, timezone
+import time
+import threading
+import atexit
+import queue
+from contextlib import contextmanager
+from concurrent.futures import Future
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from face_pipeline import DETECTION_MAX_SIDE, to_rgb_array
+from encoding_service import EncodingService, EncodingServiceBusy, encode_all_faces, encode_single_face
+from schema import is_current, migrate
+from encoding_format import ENCODING_DIM, EncodingFormatError, decode_encoding, encode_encoding
+from encoding_cache import EncodingCache, image_key
+from log_export import export_to_tempfile
+from photo_store import load_photo, prepare_photo, store_photo
+from ann_index import ANN_MIN_GALLERY_SIZE, index_path, make_index, pairwise_distances, top_k
+from scoring import ScoreCalibration
+from metrics import record, span, timed
+
+# Persistent SQLite connections kept per process and how long to wait on locks
+DB_POOL_SIZE = int(os.environ.get('KHOYA_DB_POOL_SIZE', '8'))
+DB_BUSY_TIMEOUT = float(os.environ.get('KHOYA_DB_BUSY_TIMEOUT', '30'))
+
+class ConnectionPool:
+    """Thread-safe pool of persistent, tuned SQLite connections.
+
+    Connections are opened lazily up to ``size`` and reused, so each keeps
+    its compiled-statement cache warm. The database runs in WAL mode so
+    readers never block the single writer, and ``busy_timeout`` makes
+    writers wait for the lock instead of failing with "database is locked".
+    """
+
+    def __init__(self, db_path: str, size: int = DB_POOL_SIZE, busy_timeout: float = DB_BUSY_TIMEOUT):
+        self.db_path = db_path
+        self.size = size
+        self.busy_timeout = busy_timeout
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def connect(self) -> sqlite3.Connection:
+        """Open a new connection with the pool's pragmas applied"""
+        conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout,
+                               check_same_thread=False, cached_statements=256)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout * 1000)}")
+        conn.execute("PRAGMA mmap_size=268435456")
+        conn.execute("PRAGMA cache_size=-20000")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+
+    def _acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+        if create:
+            try:
+                return self.connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        try:
+            return self._idle.get(timeout=self.busy_timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError("Timed out waiting for a database connection")
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection; commit on success, roll back on error, then return it"""
+        conn = self._acquire()
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            self._idle.put(conn)
+
+    def close(self):
+        """Close every idle connection"""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+            with self._lock:
+                self._created -= 1
+
+def utc_timestamp() -> str:
+    """Current UTC time in SQLite's CURRENT_TIMESTAMP format"""
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+class RecognitionEvent(NamedTuple):
+    """A successful match waiting to be written"""
+    face_id: int
+    name: str
+    confidence: float
+    user_id: Optional[int] = None
+    method: str = ""
+    location: str = ""
+    device_info: str = ""
+    timestamp: Optional[str] = None
+    last_seen: Optional[str] = None
+    sightings: int = 1
+
+# Rows per page in the recognition log viewer
+LOG_PAGE_SIZE = int(os.environ.get('KHOYA_LOG_PAGE_SIZE', '50'))
+
+class LogFilters(NamedTuple):
+    """Server-side filters for the recognition log viewer (timestamps in UTC)"""
+    user_id: Optional[int] = None
+    person: str = ""
+    method: str = ""
+    start: Optional[str] = None  # inclusive
+    end: Optional[str] = None  # exclusive
+
+LOG_EXPORT_COLUMNS = [
+    ('user', 'text'), ('recognized_person', 'text'), ('confidence', 'float'), ('timestamp', 'text'),
+    ('method', 'text'), ('location', 'text'), ('device_info', 'text'), ('last_seen', 'text'),
+    ('sightings', 'int'),
+]
+SCAN_EXPORT_COLUMNS = [
+    ('timestamp', 'text'), ('confidence', 'float'), ('method', 'text'), ('username', 'text'),
+    ('user_type', 'text'), ('location', 'text'), ('device_info', 'text'),
+]
+
+# Hot reads of the tables that grow without bound. They live here, not inline,
+# so tests/test_query_plans.py and benchmarks/check_query_plans.py explain the
+# exact SQL the app runs. Templates take their WHERE clause from the *_query builders.
+USER_RECOGNITION_HISTORY_SQL = '''
+    SELECT recognized_person, confidence, timestamp, method
+    FROM recognition_logs
+    WHERE user_id = ?
+    ORDER BY timestamp DESC
+    LIMIT ?
+'''
+# CROSS JOIN keeps recognition_logs as the outer loop so the index
+# supplies the order and LIMIT stops the scan after one page
+RECENT_ACTIVITY_SQL = '''
+    SELECT u.username, rl.recognized_person, rl.confidence, rl.timestamp, rl.method
+    FROM recognition_logs rl
+    CROSS JOIN users u ON rl.user_id = u.id
+    ORDER BY rl.timestamp DESC
+    LIMIT ?
+'''
+# Distinct methods, one index seek per value instead of reading the whole index
+LOG_METHODS_SQL = '''
+    WITH RECURSIVE methods(method) AS (
+        SELECT MIN(method) FROM recognition_logs
+        UNION ALL
+        SELECT (SELECT MIN(method) FROM recognition_logs WHERE method > methods.method)
+        FROM methods WHERE methods.method IS NOT NULL
+    )
+    SELECT method FROM methods WHERE method IS NOT NULL AND method != ''
+'''
+RECOGNITION_LOGS_PAGE_SQL = '''
+    SELECT rl.id, u.username, rl.recognized_person, rl.confidence, rl.timestamp, rl.method
+    FROM recognition_logs rl
+    CROSS JOIN users u ON rl.user_id = u.id
+    {where}
+    ORDER BY rl.timestamp DESC, rl.id DESC
+    LIMIT ?
+'''
+USER_RECOGNITION_SUMMARIES_SQL = '''
+    SELECT u.id, IFNULL(ru.recognitions, 0),
+           (SELECT COUNT(*) FROM user_face_counts uf WHERE uf.user_id = u.id)
+    FROM users u
+    LEFT JOIN recognition_by_user ru ON ru.user_id = u.id
+'''
+USER_PROFILE_SUMMARY_SQL = '''
+    SELECT total_recognitions, last_recognition,
+           (SELECT COUNT(*) FROM user_face_counts WHERE user_id = ?)
+    FROM user_profiles WHERE user_id = ?
+'''
+USER_FACE_COUNTS_PAGE_SQL = '''
+    SELECT uf.face_id, IFNULL(f.name, '(deleted)'), uf.count, uf.last_seen
+    FROM user_face_counts uf
+    LEFT JOIN faces f ON f.id = uf.face_id
+    WHERE uf.user_id = ? {condition}
+    ORDER BY uf.last_seen DESC, uf.face_id DESC
+    LIMIT ?
+'''
+FACES_PAGE_SQL = '''
+    SELECT f.id, f.name, f.description, f.timestamp, f.added_by, f.tags, f.age, f.occupation,
+           f.department, f.contact_info, f.last_seen, f.scan_count, p.thumbnail
+    FROM {source}
+    LEFT JOIN face_photos p ON p.hash = f.photo_hash
+    {where}
+    ORDER BY f.timestamp DESC, f.id DESC
+    LIMIT ?
+'''
+FACE_SAMPLES_SQL = '''
+    SELECT id, encoding, photo_hash, added_at FROM face_encodings
+    WHERE face_id = ? ORDER BY id
+'''
+FACE_RECENT_SCANS_SQL = '''
+    SELECT fsh.timestamp, fsh.confidence, fsh.method, u.username
+    FROM face_scan_history fsh
+    LEFT JOIN users u ON fsh.scanned_by_user = u.id
+    WHERE fsh.face_id = ?
+    ORDER BY fsh.timestamp DESC
+    LIMIT 10
+'''
+FACE_SCAN_HISTORY_SQL = '''
+    SELECT fsh.timestamp, fsh.confidence, fsh.method, u.username, u.user_type,
+           rl.location, rl.device_info
+    FROM face_scan_history fsh
+    LEFT JOIN users u ON fsh.scanned_by_user = u.id
+    LEFT JOIN recognition_logs rl ON (rl.face_id = fsh.face_id AND rl.timestamp = fsh.timestamp)
+    WHERE fsh.face_id = ?
+    ORDER BY fsh.timestamp DESC
+    LIMIT ?
+'''
+
+def date_range_bounds(date_range):
+    """(start, end) UTC timestamps for an inclusive pair of dates, or (None, None)"""
+    if len(date_range) != 2:
+        return None, None
+    start = date_range[0].strftime('%Y-%m-%d 00:00:00')
+    end = (date_range[1] + timedelta(days=1)).strftime('%Y-%m-%d 00:00:00')
+    return start, end
+
+# SQLite database file shared by the app, the HTTP service and the tools
+DB_PATH = os.environ.get('KHOYA_DB_PATH', 'database/advanced_faces.db')
+
+class DatabaseManager:
+    def __init__(self, db_path: str = DB_PATH):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        self.pool = ConnectionPool(self.db_path)
+        self.init_database()
+    
+    def get_connection(self):
+        """Create a dedicated database connection (caller closes it)"""
+        return self.pool.connect()
+    
+    def connection(self):
+        """Borrow a pooled connection as a context manager that commits on exit"""
+        return self.pool.connection()
+    
+    def init_database(self):
+        """Initialize database with all required tables"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            # Up-to-date databases (every start but the first) skip the DDL and the write lock
+            if is_current(cursor) and self._admin_exists(cursor):
+                return
+            
+            # Take the write lock first so concurrent processes migrate one at a time
+            cursor.execute("BEGIN IMMEDIATE")
+            migrate(cursor)
+            
+            # Create default admin user if not exists
+            if not self._admin_exists(cursor):
+                admin_password = self.hash_password('admin123')
+                cursor.execute('''
+                    INSERT INTO users (username, password_hash, user_type, profile_data)
+                    VALUES (?, ?, ?, ?)
+                ''', ('admin', admin_password, 'admin', '{}'))
+    
+    @staticmethod
+    def _admin_exists(cursor) -> bool:
+        cursor.execute("SELECT 1 FROM users WHERE username = 'admin'")
+        return cursor.fetchone() is not None
+    
+    def write_recognitions(self, events: List['RecognitionEvent']):
+        """Apply a list of recognition events in a single transaction (one commit)"""
+        with span('db_write'), self.connection() as conn:
+            cursor = conn.cursor()
+            
+            with span('write_scan_count'):
+                cursor.executemany('''
+                    UPDATE faces 
+                    SET scan_count = scan_count + 1, last_seen = ?
+                    WHERE id = ?
+                ''', [(event.last_seen or event.timestamp or utc_timestamp(), event.face_id) for event in events])
+            
+            logged = [event._replace(timestamp=event.timestamp or utc_timestamp())
+                      for event in events if event.user_id is not None]
+            if logged:
+                # Both rows share the event timestamp so scan history can be joined back to its log
+                with span('write_logs'):
+                    cursor.executemany('''
+                        INSERT INTO recognition_logs (user_id, face_id, recognized_person, confidence, method, location, device_info,
+                                                      timestamp, last_seen, sightings)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ''', [(event.user_id, event.face_id, event.name, event.confidence, event.method,
+                           event.location, event.device_info, event.timestamp, event.last_seen or event.timestamp,
+                           event.sightings) for event in logged])
+                with span('write_scan_history'):
+                    cursor.executemany('''
+                        INSERT INTO face_scan_history (face_id, scanned_by_user, confidence, method, timestamp)
+                        VALUES (?, ?, ?, ?, ?)
+                    ''', [(event.face_id, event.user_id, event.confidence, event.method, event.timestamp)
+                          for event in logged if event.face_id])
+                
+                faces_by_user = {}
+                for event in logged:
+                    faces_by_user.setdefault(event.user_id, []).append((event.face_id, event.timestamp))
+                with span('write_profile'):
+                    for user_id, seen in faces_by_user.items():
+                        self.apply_profile_update(cursor, user_id, seen)
+    
+    def apply_profile_update(self, cursor, user_id: int, seen: List[Tuple[Optional[int], str]]):
+        """Fold (face_id, timestamp) recognitions into the user's counters using an open cursor"""
+        counts = {}
+        for face_id, timestamp in seen:
+            if face_id is None:
+                continue
+            count, last_seen = counts.get(face_id, (0, timestamp))
+            counts[face_id] = (count + 1, max(last_seen, timestamp))
+        
+        cursor.executemany('''
+            INSERT INTO user_face_counts (user_id, face_id, count, last_seen)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (user_id, face_id) DO UPDATE SET
+                count = count + excluded.count,
+                last_seen = MAX(IFNULL(last_seen, ''), excluded.last_seen)
+        ''', [(user_id, face_id, count, last_seen) for face_id, (count, last_seen) in counts.items()])
+        
+        last_recognition = max(timestamp for _, timestamp in seen)
+        cursor.execute('''
+            UPDATE user_profiles 
+            SET total_recognitions = total_recognitions + ?, last_recognition = ?
+            WHERE user_id = ?
+        ''', (len(seen), last_recognition, user_id))
+        if cursor.rowcount == 0:
+            cursor.execute('''
+                INSERT INTO user_profiles (user_id, total_recognitions, last_recognition)
+                VALUES (?, ?, ?)
+            ''', (user_id, len(seen), last_recognition))
+    
+    def get_user_profile_summary(self, user_id: int) -> Optional[Dict]:
+        """Total recognitions, unique faces and last recognition for one user"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute(USER_PROFILE_SUMMARY_SQL, (user_id, user_id))
+            
+            row = cursor.fetchone()
+        
+        if not row:
+            return None
+        return {'total_recognitions': row[0] or 0, 'last_recognition': row[1], 'unique_faces': row[2]}
+    
+    def get_user_face_counts_page(self, user_id: int, after: Optional[Tuple[str, int]] = None,
+                                  page_size: int = LOG_PAGE_SIZE):
+        """People a user has recognized, most recently seen first, after the keyset cursor (last_seen, face_id).
+        
+        Returns (rows, next_cursor) with rows of (face_id, name, count, last_seen).
+        """
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(*self.user_face_counts_page_query(user_id, after, page_size))
+            
+            rows = cursor.fetchall()
+        
+        next_cursor = None
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            next_cursor = (rows[-1][3], rows[-1][0])
+        return rows, next_cursor
+    
+    @staticmethod
+    def user_face_counts_page_query(user_id: int, after: Optional[Tuple[str, int]], page_size: int):
+        """(sql, params) for one page of get_user_face_counts_page"""
+        condition, params = "", [user_id]
+        if after is not None:
+            condition = "AND (uf.last_seen, uf.face_id) < (?, ?)"
+            params.extend(after)
+        return USER_FACE_COUNTS_PAGE_SQL.format(condition=condition), params + [page_size + 1]
+    
+    def hash_password(self, password: str) -> str:
+        """Hash password using SHA256"""
+        return hashlib.sha256(password.encode()).hexdigest()
+    
+    def verify_user(self, username: str, password: str) -> Optional[Dict]:
+        """Verify user credentials"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            
+            password_hash = self.hash_password(password)
+            cursor.execute('''
+                SELECT id, username, user_type, profile_data 
+                FROM users 
+                WHERE username = ? AND password_hash = ?
+            ''', (username, password_hash))
+            
+            user = cursor.fetchone()
+        
+        if user:
+            return {
+                'id': user[0],
+                'username': user[1],
+                'user_type': user[2],
+                'profile_data': json.loads(user[3] or '{}')
+            }
+        return None
+    
+    def create_user(self, username: str, password: str, user_type: str = 'user') -> bool:
+        """Create a new user"""
+        try:
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                
+                password_hash = self.hash_password(password)
+                cursor.execute('''
+                    INSERT INTO users (username, password_hash, user_type, profile_data)
+                    VALUES (?, ?, ?, ?)
+                ''', (username, password_hash, user_type, '{}'))
+            
+            return True
+        except sqlite3.IntegrityError:
+            return False
+    
+    def get_all_users(self) -> List[Dict]:
+        """Get all users (admin only)"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                SELECT id, username, user_type, created_at, last_login
+                FROM users
+                ORDER BY created_at DESC
+            ''')
+            
+            users = []
+            for row in cursor.fetchall():
+                users.append({
+                    'id': row[0],
+                    'username': row[1],
+                    'user_type': row[2],
+                    'created_at': row[3],
+                    'last_login': row[4]
+                })
+        
+        return users
+    
+    def get_recognition_logs_page(self, filters: LogFilters, after: Optional[Tuple[str, int]] = None,
+                                  page_size: int = LOG_PAGE_SIZE):
+        """One page of recognition logs, newest first, after the keyset cursor (timestamp, id).
+        
+        Returns (rows, next_cursor); next_cursor is None on the last page.
+        """
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(*self.recognition_logs_page_query(filters, after, page_size))
+            
+            rows = cursor.fetchall()
+        
+        next_cursor = None
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            next_cursor = (rows[-1][4], rows[-1][0])
+        return rows, next_cursor
+    
+    @classmethod
+    def recognition_logs_page_query(cls, filters: LogFilters, after: Optional[Tuple[str, int]], page_size: int):
+        """(sql, params) for one page of get_recognition_logs_page"""
+        conditions, params = cls._log_filter_conditions(filters)
+        if after is not None:
+            conditions.append("(rl.timestamp, rl.id) < (?, ?)")
+            params.extend(after)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        return RECOGNITION_LOGS_PAGE_SQL.format(where=where), params + [page_size + 1]
+    
+    def export_recognition_logs(self, filters: LogFilters, fmt: str):
+        """Stream every log row matching the filters, oldest first, into a temp file.
+        
+        Returns (path, rows); the caller deletes the file once it has been served.
+        """
+        conditions, params = self._log_filter_conditions(filters)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute(f'''
+                SELECT u.username, rl.recognized_person, rl.confidence, rl.timestamp, rl.method,
+                       rl.location, rl.device_info, rl.last_seen, rl.sightings
+                FROM recognition_logs rl
+                CROSS JOIN users u ON rl.user_id = u.id
+                {where}
+                ORDER BY rl.timestamp, rl.id
+            ''', params)
+            
+            return export_to_tempfile(cursor, LOG_EXPORT_COLUMNS, fmt)
+    
+    def get_log_methods(self) -> List[str]:
+        """Every recognition method that appears in the logs, for the log viewer's filter"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(LOG_METHODS_SQL)
+            return [row[0] for row in cursor.fetchall()]
+    
+    @staticmethod
+    def _log_filter_conditions(filters: LogFilters):
+        """WHERE conditions and parameters for the recognition log filters"""
+        conditions, params = [], []
+        if filters.user_id is not None:
+            conditions.append("rl.user_id = ?")
+            params.append(filters.user_id)
+        if filters.person:
+            conditions.append("rl.recognized_person = ?")
+            params.append(filters.person)
+        if filters.method:
+            conditions.append("rl.method = ?")
+            params.append(filters.method)
+        if filters.start:
+            conditions.append("rl.timestamp >= ?")
+            params.append(filters.start)
+        if filters.end:
+            conditions.append("rl.timestamp < ?")
+            params.append(filters.end)
+        return conditions, params
+    
+    def get_analytics_totals(self) -> Dict:
+        """User, face and recognition totals from the analytics rollup"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT users, faces, recognitions FROM analytics_totals WHERE id = 1")
+            row = cursor.fetchone() or (0, 0, 0)
+        
+        return {'users': row[0], 'faces': row[1], 'recognitions': row[2]}
+    
+    def get_gallery_generation(self) -> int:
+        """Counter the faces triggers bump whenever a face is added, removed or changed"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT generation FROM gallery_state WHERE id = 1")
+            row = cursor.fetchone()
+        
+        return row[0] if row else 0
+    
+    def get_daily_recognitions(self, days: int = 30):
+        """(day, recognitions, average confidence) for the last ``days`` days, oldest first"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                SELECT day, recognitions, confidence_sum / MAX(recognitions, 1)
+                FROM recognition_daily
+                WHERE day >= date('now', ?) AND recognitions > 0
+                ORDER BY day
+            ''', (f'-{days} days',))
+            
+            return cursor.fetchall()
+    
+    def get_confidence_histogram(self, days: int = 30):
+        """(bucket, recognitions) over the last ``days`` days; bucket b covers b*10 to b*10+10 %"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                SELECT bucket, SUM(recognitions)
+                FROM confidence_histogram
+                WHERE day >= date('now', ?)
+                GROUP BY bucket
+                ORDER BY bucket
+            ''', (f'-{days} days',))
+            
+            return cursor.fetchall()
+    
+    def get_top_people(self, limit: int = 10):
+        """(person, recognitions, average confidence, last recognition) for the most recognized people"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                SELECT recognized_person, recognitions, confidence_sum / MAX(recognitions, 1), last_recognition
+                FROM recognition_by_person
+                ORDER BY recognitions DESC
+                LIMIT ?
+            ''', (limit,))
+            
+            return cursor.fetchall()
+    
+    def get_recent_activity(self, limit: int = 20):
+        """(user, person, confidence, timestamp, method) of the newest logs, read backwards off the timestamp index"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute(RECENT_ACTIVITY_SQL, (limit,))
+            
+            return cursor.fetchall()
+    
+    def get_user_recognition_history(self, user_id: int, limit: int = 50):
+        """(person, confidence, timestamp, method) of a user's newest recognitions"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(USER_RECOGNITION_HISTORY_SQL, (user_id, limit))
+            return cursor.fetchall()
+    
+    def get_user_recognition_summaries(self) -> Dict[int, Dict]:
+        """Recognition totals and unique faces for every user in one query"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute(USER_RECOGNITION_SUMMARIES_SQL)
+            
+            return {
+                row[0]: {
+                    'total_recognitions': row[1],
+                    'unique_faces': row[2]
+                }
+                for row in cursor.fetchall()
+            }
+    
+    def update_last_login(self, user_id: int):
+        """Update user's last login time"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                UPDATE users 
+                SET last_login = CURRENT_TIMESTAMP 
+                WHERE id = ?
+            ''', (user_id,))
+        
+
+# Write-behind batching of recognition writes (for high-throughput kiosks)
+WRITE_BEHIND = os.environ.get('KHOYA_WRITE_BEHIND', '0') == '1'
+WRITE_BEHIND_MAX_BATCH = int(os.environ.get('KHOYA_WRITE_BEHIND_MAX_BATCH', '500'))
+WRITE_BEHIND_MAX_DELAY = float(os.environ.get('KHOYA_WRITE_BEHIND_MAX_DELAY', '0.5'))
+
+class RecognitionWriter:
+    """Write-behind queue that commits many recognitions per transaction.
+
+    Events are stamped with their own time when submitted, then a
+    background thread drains the queue and hands up to ``max_batch`` events
+    (or whatever arrived within ``max_delay`` seconds) to
+    DatabaseManager.write_recognitions as one commit.
+    """
+
+    def __init__(self, db_manager: DatabaseManager, max_batch: int = WRITE_BEHIND_MAX_BATCH,
+                 max_delay: float = WRITE_BEHIND_MAX_DELAY):
+        self.db_manager = db_manager
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.failed = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="recognition-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, events: List[RecognitionEvent]):
+        now = utc_timestamp()
+        for event in events:
+            self._queue.put(event if event.timestamp else event._replace(timestamp=now))
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            event = self._queue.get()
+            if event is None:
+                break
+            batch = [event]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    event = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if event is None:
+                    stopping = True
+                    break
+                batch.append(event)
+            try:
+                self.db_manager.write_recognitions(batch)
+            except Exception:
+                # Keep the writer alive; the count surfaces lost batches
+                self.failed += len(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def flush(self):
+        """Block until every submitted event has been committed"""
+        self._queue.join()
+
+    def close(self):
+        """Commit what is queued and stop the background thread"""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+# Seconds without a sighting before a face's stream event is closed and written
+DEDUP_COOLDOWN = float(os.environ.get('KHOYA_DEDUP_COOLDOWN', '30'))
+# Longest a sighting stays open before it is written and a new one starts
+DEDUP_MAX_SIGHTING = float(os.environ.get('KHOYA_DEDUP_MAX_SIGHTING', '300'))
+
+class RecognitionDeduplicator:
+    """Collapses repeated sightings of a face on one stream into a single event.
+
+    Sightings are keyed by (face_id, session). The first sighting opens an
+    event; later ones only extend its last-seen time, count and peak
+    confidence. Once a key has not been seen for ``cooldown`` seconds (or
+    has been open for ``max_sighting`` seconds) the collapsed event is
+    handed back by ``expired`` for recording.
+    """
+
+    def __init__(self, cooldown: float = DEDUP_COOLDOWN, max_sighting: float = DEDUP_MAX_SIGHTING):
+        self.cooldown = cooldown
+        self.max_sighting = max_sighting
+        self.observed = 0
+        self.emitted = 0
+        self._open = {}
+
+    def observe(self, event: RecognitionEvent, session: str = "", now: Optional[float] = None):
+        now = time.monotonic() if now is None else now
+        stamp = event.timestamp or utc_timestamp()
+        key = (event.face_id, session)
+        self.observed += 1
+        
+        sighting = self._open.get(key)
+        if sighting is None:
+            self._open[key] = [event._replace(timestamp=stamp, last_seen=stamp, sightings=1), now, now]
+            return
+        
+        open_event = sighting[0]
+        peak = event if event.confidence > open_event.confidence else open_event
+        sighting[0] = open_event._replace(
+            name=peak.name, confidence=peak.confidence,
+            last_seen=stamp, sightings=open_event.sightings + 1
+        )
+        sighting[1] = now
+
+    def expired(self, now: Optional[float] = None) -> List[RecognitionEvent]:
+        """Close and return the events whose cooldown (or maximum length) has passed"""
+        now = time.monotonic() if now is None else now
+        closed = [key for key, (_, last, started) in self._open.items()
+                  if now - last >= self.cooldown or now - started >= self.max_sighting]
+        return self._close(closed)
+
+    def flush(self) -> List[RecognitionEvent]:
+        """Close and return every open event (stream ended)"""
+        return self._close(list(self._open))
+
+    def _close(self, keys) -> List[RecognitionEvent]:
+        events = [self._open.pop(key)[0] for key in keys]
+        self.emitted += len(events)
+        return events
+
+FACE_ENCODING_DIM = ENCODING_DIM
+
+# Nearest-neighbour backend for large galleries ('exact', 'ivf' or 'hnsw')
+# and its recall-versus-latency preset ('fast', 'balanced' or 'accurate')
+ANN_BACKEND = os.environ.get('KHOYA_ANN_BACKEND', 'ivf')
+ANN_RECALL = os.environ.get('KHOYA_ANN_RECALL', 'balanced')
+
+# How a person with several samples is matched: by their nearest sample
+# ('nearest') or by the mean of their samples ('centroid')
+MATCH_MODES = ('nearest', 'centroid')
+MATCH_MODE = os.environ.get('KHOYA_MATCH_MODE', 'nearest')
+
+class FaceGallery:
+    """Process-wide in-memory copy of the stored face encodings.
+
+    Encodings live in one contiguous float32 (N x 128) matrix with parallel
+    row id, face id and name arrays, so every query is one vectorized
+    distance pass. In 'nearest' match mode the rows are every enrolled
+    sample and several rows map to the same person; in 'centroid' mode
+    they are one mean encoding per person. The copy is loaded once,
+    appended to in place when a face is enrolled, and reloaded only when
+    the database generation moves on by something this process did not
+    see (another session or process, or an added sample).
+    """
+
+    def __init__(self, db_manager: DatabaseManager, match_mode: str = MATCH_MODE):
+        if match_mode not in MATCH_MODES:
+            raise ValueError(f"Unknown match mode '{match_mode}', expected one of {MATCH_MODES}")
+        self.db_manager = db_manager
+        self.match_mode = match_mode
+        self._lock = threading.RLock()
+        self._encodings = np.empty((0, FACE_ENCODING_DIM), dtype=np.float32)
+        self.invalid_rows = 0
+        self._row_ids = np.empty(0, dtype=np.int64)
+        self._face_ids = np.empty(0, dtype=np.int64)
+        self._names = np.empty(0, dtype=object)
+        self._count = 0
+        self.identities = 0
+        self.max_samples = 1
+        self.generation = -1
+        self.index = None
+        self.index_backend = ANN_BACKEND
+        self.index_recall = ANN_RECALL
+
+    def _read_generation(self, cursor) -> int:
+        cursor.execute("SELECT generation FROM gallery_state WHERE id = 1")
+        row = cursor.fetchone()
+        return row[0] if row else 0
+
+    def _reserve(self, capacity: int):
+        """Grow the backing arrays geometrically so appends stay amortised O(1)"""
+        if capacity <= len(self._face_ids):
+            return
+        new_capacity = max(capacity, 2 * len(self._face_ids), 64)
+        encodings = np.empty((new_capacity, FACE_ENCODING_DIM), dtype=np.float32)
+        row_ids = np.empty(new_capacity, dtype=np.int64)
+        face_ids = np.empty(new_capacity, dtype=np.int64)
+        names = np.empty(new_capacity, dtype=object)
+        encodings[:self._count] = self._encodings[:self._count]
+        row_ids[:self._count] = self._row_ids[:self._count]
+        face_ids[:self._count] = self._face_ids[:self._count]
+        names[:self._count] = self._names[:self._count]
+        self._encodings, self._row_ids, self._face_ids, self._names = encodings, row_ids, face_ids, names
+
+    @timed('gallery_reload')
+    def reload(self):
+        """Load every stored encoding from the database"""
+        with self.db_manager.connection() as conn:
+            cursor = conn.cursor()
+            generation = self._read_generation(cursor)
+            if self.match_mode == 'nearest':
+                # Samples come out grouped by person, so appended faces keep the grouping
+                cursor.execute('''
+                    SELECT e.id, f.id, f.name, e.encoding
+                    FROM faces f CROSS JOIN face_encodings e ON e.face_id = f.id
+                    ORDER BY f.id, e.id
+                ''')
+            else:
+                cursor.execute('SELECT id, id, name, encoding FROM faces ORDER BY id')
+            rows = cursor.fetchall()
+
+        encodings = np.empty((len(rows), FACE_ENCODING_DIM), dtype=np.float32)
+        row_ids = np.empty(len(rows), dtype=np.int64)
+        face_ids = np.empty(len(rows), dtype=np.int64)
+        names = np.empty(len(rows), dtype=object)
+        count = 0
+        for row_id, face_id, name, encoding_bytes in rows:
+            try:
+                encodings[count] = decode_encoding(encoding_bytes, FACE_ENCODING_DIM)
+            except EncodingFormatError:
+                # Wrong dimension, model or a corrupt blob: never match against it
+                continue
+            row_ids[count] = row_id
+            face_ids[count] = face_id
+            names[count] = name
+            count += 1
+        encodings, row_ids, face_ids, names = encodings[:count], row_ids[:count], face_ids[:count], names[:count]
+        _, samples = np.unique(face_ids, return_counts=True)
+
+        with self._lock:
+            self._encodings, self._row_ids, self._face_ids, self._names = encodings, row_ids, face_ids, names
+            self._count = count
+            self.identities = len(samples)
+            self.max_samples = int(samples.max()) if len(samples) else 1
+            self.invalid_rows = len(rows) - count
+            self.generation = generation
+            self.index = None
+
+    def refresh(self):
+        """Reload the gallery if the database generation has moved on"""
+        with span('gallery_refresh'), self.db_manager.connection() as conn:
+            generation = self._read_generation(conn.cursor())
+        if generation != self.generation:
+            self.reload()
+
+    def append(self, face_id: int, sample_id: int, name: str, encoding: np.ndarray, generation: int):
+        """Add a freshly inserted face (and its first sample) without reloading the whole gallery.
+
+        ``generation`` is the database generation read in the inserting
+        transaction. If anything else changed the faces table in between,
+        the gallery is marked stale and reloaded on the next snapshot.
+        """
+        with self._lock:
+            if generation != self.generation + 1:
+                self.generation = -1
+                return
+            self._reserve(self._count + 1)
+            self._encodings[self._count] = encoding
+            self._row_ids[self._count] = sample_id if self.match_mode == 'nearest' else face_id
+            self._face_ids[self._count] = face_id
+            self._names[self._count] = name
+            self._count += 1
+            self.identities += 1
+            self.generation = generation
+
+    def _rows(self):
+        """(encodings, row_ids, face_ids, names) views that are safe to read without the lock"""
+        self.refresh()
+        with self._lock:
+            n = self._count
+            return self._encodings[:n], self._row_ids[:n], self._face_ids[:n], self._names[:n]
+
+    def snapshot(self):
+        """Return (encodings, face_ids, names) views, one row per sample or centroid"""
+        encodings, _, face_ids, names = self._rows()
+        return encodings, face_ids, names
+
+    def _ensure_index(self, encodings: np.ndarray, row_ids: np.ndarray):
+        """Load or (re)build the ANN index so it covers most of the gallery"""
+        with self._lock:
+            index = self.index
+            if index is not None and index.size >= 0.9 * len(row_ids):
+                return index
+            index = make_index(self.index_backend, self.index_recall)
+            path = index_path(self.db_manager.db_path, index.name, self.match_mode)
+            if not (index.load(path, encodings, row_ids) and index.size >= 0.9 * len(row_ids)):
+                index.build(encodings)
+                index.save(path, row_ids)
+            self.index = index
+            return index
+
+    def search(self, queries: np.ndarray, k: int = 1):
+        """Find the k nearest stored people for each query encoding.
+
+        Small galleries are scanned exactly; larger ones go through the ANN
+        index, with rows appended since the index was built scanned exactly.
+        When people have several samples, enough rows are fetched to hold k
+        different people and each person is ranked by their nearest sample.
+        Returns (face_ids, names, distances), each shaped (len(queries), k).
+        """
+        queries = np.atleast_2d(queries)
+        encodings, row_ids, face_ids, names = self._rows()
+        max_samples = self.max_samples
+        candidates = k * max_samples
+
+        with span('gallery_search'):
+            if self.index_backend == 'exact' or len(face_ids) < ANN_MIN_GALLERY_SIZE:
+                indices, distances = top_k(pairwise_distances(queries, encodings), candidates)
+            else:
+                index = self._ensure_index(encodings, row_ids)
+                indices, distances = index.search(queries, candidates)
+                if index.size < len(face_ids):
+                    tail_indices, tail_distances = top_k(pairwise_distances(queries, encodings[index.size:]), candidates)
+                    merged_indices = np.concatenate([indices, tail_indices + index.size], axis=1)
+                    merged_distances = np.concatenate([distances, tail_distances], axis=1)
+                    best, distances = top_k(merged_distances, candidates)
+                    indices = np.take_along_axis(merged_indices, best, axis=1)
+
+            if max_samples > 1:
+                indices, distances = self._nearest_per_person(indices, distances, face_ids, k)
+        return face_ids[indices], names[indices], distances
+
+    @staticmethod
+    def _nearest_per_person(indices: np.ndarray, distances: np.ndarray, face_ids: np.ndarray, k: int):
+        """Keep the first (nearest) candidate row of each person, up to k per query"""
+        # Rows the index could not fill (-1) count as distinct people so they sort last
+        people = np.where(indices >= 0, face_ids[indices], -1 - np.arange(indices.shape[1]))
+        firsts = [np.sort(np.unique(row, return_index=True)[1]) for row in people]
+        width = min([k] + [len(first) for first in firsts])
+        keep = np.array([first[:width] for first in firsts], dtype=np.int64).reshape(len(indices), width)
+        return np.take_along_axis(indices, keep, axis=1), np.take_along_axis(distances, keep, axis=1)
+
+    def describe_index(self) -> Dict:
+        """Active search backend and its recall-versus-latency setting"""
+        with self._lock:
+            if self.index_backend == 'exact' or self._count < ANN_MIN_GALLERY_SIZE:
+                description = {'backend': 'exact', 'size': self._count, 'recall': 'exact',
+                               'ann_threshold': ANN_MIN_GALLERY_SIZE}
+            elif self.index is None:
+                description = {'backend': self.index_backend, 'size': 0, 'recall': self.index_recall,
+                               'status': 'built on next search'}
+            else:
+                description = self.index.describe()
+            return dict(description, match_mode=self.match_mode, people=self.identities)
+
+# Enrollments closer than this to an existing face are flagged as near-duplicates (0 disables)
+DUPLICATE_DISTANCE = float(os.environ.get('KHOYA_DUPLICATE_DISTANCE', '0.35'))
+
+# Extra samples further than this from the person's centroid are refused
+SAMPLE_MAX_DISTANCE = float(os.environ.get('KHOYA_SAMPLE_MAX_DISTANCE', '0.6'))
+
+# Faces per page in the gallery listing
+GALLERY_PAGE_SIZE = int(os.environ.get('KHOYA_GALLERY_PAGE_SIZE', '24'))
+
+def search_query(text: str) -> Optional[str]:
+    """FTS5 MATCH expression for free text: every word must match as a prefix"""
+    words = re.findall(r'\w+', text or '')
+    return ' '.join(f'"{word}"*' for word in words) or None
+
+# Candidates returned by the ranked recognition API, and the distance gap
+# between the first two below which a match is flagged for review
+TOP_K = int(os.environ.get('KHOYA_TOP_K', '5'))
+AMBIGUOUS_MARGIN = float(os.environ.get('KHOYA_AMBIGUOUS_MARGIN', '0.05'))
+
+class MatchCandidate(NamedTuple):
+    """One ranked candidate identity for a probe face"""
+    face_id: int
+    name: str
+    distance: float
+    probability: float
+
+class RankedMatch(NamedTuple):
+    """The k nearest people for a probe face, nearest first"""
+    candidates: List[MatchCandidate]
+    margin: Optional[float]  # distance from the first to the second candidate; None with one person
+    ambiguous: bool  # margin below AMBIGUOUS_MARGIN: the first two are hard to tell apart
+
+    def best(self, tolerance: float) -> Optional[MatchCandidate]:
+        """The first candidate if it is within ``tolerance``"""
+        if self.candidates and self.candidates[0].distance <= tolerance:
+            return self.candidates[0]
+        return None
+
+class FaceRecognitionManager:
+    def __init__(self, db_manager: DatabaseManager, gallery: FaceGallery = None,
+                 encoder: EncodingService = None, writer: RecognitionWriter = None,
+                 cache: EncodingCache = None, calibration: ScoreCalibration = None):
+        self.db_manager = db_manager
+        self.calibration = calibration or ScoreCalibration()
+        self.writer = writer
+        self.gallery = gallery or FaceGallery(db_manager)
+        # Without a shared service, encode inline on the calling thread
+        self.encoder = encoder or EncodingService(max_workers=0)
+        self.cache = cache
+        self.detection_max_side = DETECTION_MAX_SIDE
+    
+    def _submit_cached(self, kind: str, job, rgb_image: np.ndarray, timeout: float) -> Future:
+        """Serve an encoding job from the cache, or queue it and cache its result"""
+        if self.cache is None or not self.cache.enabled:
+            return self._submit_timed(job, rgb_image, timeout)
+        
+        with span('cache_lookup'):
+            key = image_key(rgb_image, kind, self.detection_max_side)
+            cached = self.cache.get(key, kind)
+        if cached is not None:
+            future = Future()
+            future.set_result(cached)
+            return future
+        
+        def store(done: Future):
+            if not done.cancelled() and done.exception() is None:
+                self.cache.put(key, kind, done.result())
+        
+        future = self._submit_timed(job, rgb_image, timeout)
+        future.add_done_callback(store)
+        return future
+    
+    def _submit_timed(self, job, rgb_image: np.ndarray, timeout: float) -> Future:
+        """Queue an encoding job and record its submit-to-result time as the encode_job stage"""
+        submitted = time.perf_counter()
+        future = self.encoder.submit(job, rgb_image, self.detection_max_side, timeout=timeout)
+        
+        def finished(done: Future):
+            failed = done.cancelled() or done.exception() is not None
+            record('encode_job', time.perf_counter() - submitted, error=failed)
+        
+        future.add_done_callback(finished)
+        return future
+    
+    def submit_encode(self, image, timeout: float = -1) -> Future:
+        """Queue single-face encoding on the encoding service; resolves to (encoding, error)"""
+        rgb_image, error = to_rgb_array(image)
+        if error:
+            future = Future()
+            future.set_result((None, error))
+            return future
+        return self._submit_cached('single', encode_single_face, rgb_image, timeout)
+    
+    def submit_encode_all(self, image, timeout: float = -1) -> Future:
+        """Queue multi-face encoding on the encoding service; resolves to (face_locations, encodings, error)"""
+        rgb_image, error = to_rgb_array(image)
+        if error:
+            future = Future()
+            future.set_result(([], None, error))
+            return future
+        return self._submit_cached('all', encode_all_faces, rgb_image, timeout)
+    
+    def encode_face_from_image(self, image):
+        """Extract face encoding from image using face_recognition library"""
+        try:
+            return self.submit_encode(image).result()
+        except EncodingServiceBusy as e:
+            return None, str(e)
+        except Exception as e:
+            return None, f"Error processing image: {str(e)}"
+    
+    def encode_faces_from_image(self, image):
+        """Extract the locations and encodings of every face in an image.
+
+        All detected faces are encoded with a single face_encodings call.
+        Returns (face_locations, encodings, error) where encodings is an
+        (n_faces x 128) array and locations are (top, right, bottom, left).
+        """
+        try:
+            return self.submit_encode_all(image).result()
+        except EncodingServiceBusy as e:
+            return [], None, str(e)
+        except Exception as e:
+            return [], None, f"Error processing image: {str(e)}"
+    
+    def add_face_to_database(self, name: str, image, description: str = "", added_by: str = "", 
+                           age: int = None, occupation: str = "", department: str = "", 
+                           contact_info: str = "", profile_data: dict = None, photo_bytes: bytes = None,
+                           allow_duplicate: bool = False):
+        """Add a face to the database with enhanced profile information.
+        
+        ``photo_bytes`` is the uploaded file as received; when given it is
+        stored unchanged in the photo store instead of re-encoding ``image``.
+        A face within DUPLICATE_DISTANCE of an enrolled face is refused
+        unless ``allow_duplicate`` is set.
+        """
+        try:
+            encoding, error = self.encode_face_from_image(image)
+            if error:
+                return False, error
+            
+            if not allow_duplicate:
+                duplicate = self.find_near_duplicates(encoding[None, :])[0]
+                if duplicate:
+                    return False, (f"This face looks like a near-duplicate of '{duplicate[0]}' "
+                                   f"(distance {duplicate[1]:.2f}). "
+                                   f"Tick 'Allow near-duplicate' to add it anyway")
+            
+            # Keep the photo in its original compressed format
+            try:
+                photo = prepare_photo(image, photo_bytes)
+            except Exception:
+                return False, "Failed to encode image"
+            
+            profile = {'description': description, 'age': age, 'occupation': occupation,
+                       'department': department, 'contact_info': contact_info, 'profile_data': profile_data}
+            with self.db_manager.connection() as conn:
+                face_id, sample_id, generation = self.insert_face(conn.cursor(), name, encoding, photo,
+                                                                  added_by, profile)
+            
+            self.gallery.append(face_id, sample_id, name, encoding, generation)
+            return True, "Face added successfully"
+            
+        except sqlite3.IntegrityError:
+            return False, "A person with this name already exists"
+        except Exception as e:
+            return False, f"Error adding face: {str(e)}"
+    
+    def find_near_duplicates(self, encodings: np.ndarray) -> List[Optional[Tuple[str, float]]]:
+        """(name, distance) of the enrolled face within DUPLICATE_DISTANCE of each encoding, or None"""
+        if DUPLICATE_DISTANCE <= 0 or len(encodings) == 0:
+            return [None] * len(encodings)
+        face_ids, known_names, distances = self.gallery.search(encodings, k=1)
+        if face_ids.shape[1] == 0:
+            return [None] * len(encodings)
+        return [(known_names[row, 0], float(distances[row, 0])) if distances[row, 0] <= DUPLICATE_DISTANCE else None
+                for row in range(len(encodings))]
+    
+    def insert_face(self, cursor, name: str, encoding: np.ndarray, photo: Tuple[bytes, str, int, int],
+                    added_by: str = "", profile: dict = None) -> Tuple[int, int, int]:
+        """Insert one face inside the caller's transaction; returns (face_id, sample_id, gallery generation).
+        
+        ``photo`` is the (data, format, width, height) from prepare_photo and
+        ``profile`` holds any of description, age, occupation, department,
+        contact_info, tags and profile_data. Raises sqlite3.IntegrityError
+        when the name is taken. The caller appends the face to the gallery
+        once the transaction has committed.
+        """
+        profile = profile or {}
+        photo_hash = store_photo(cursor, *photo)
+        
+        # Convert profile_data to JSON
+        profile_json = json.dumps(profile['profile_data']) if profile.get('profile_data') else None
+        
+        cursor.execute('''
+            INSERT INTO faces (name, photo_hash, encoding, description, added_by, tags, 
+                             age, occupation, department, contact_info, scan_count, profile_data)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0, ?)
+        ''', (name, photo_hash, encode_encoding(encoding), profile.get('description', ""), added_by,
+              profile.get('tags', ""), profile.get('age'), profile.get('occupation', ""),
+              profile.get('department', ""), profile.get('contact_info', ""), profile_json))
+        face_id = cursor.lastrowid
+        
+        # Read the first sample and the generation written by the insert triggers in the same transaction
+        cursor.execute('''
+            SELECT (SELECT MAX(id) FROM face_encodings WHERE face_id = ?), generation
+            FROM gallery_state WHERE id = 1
+        ''', (face_id,))
+        sample_id, generation = cursor.fetchone()
+        return face_id, sample_id, generation
+    
+    def add_face_sample(self, face_id: int, image, photo_bytes: bytes = None,
+                        max_distance: float = SAMPLE_MAX_DISTANCE):
+        """Add another enrollment photo of an existing person.
+        
+        The new encoding becomes one more sample of the person and their
+        centroid is recomputed in the same transaction. Photos further than
+        ``max_distance`` from the person's current centroid are refused as
+        probably showing someone else.
+        """
+        try:
+            encoding, error = self.encode_face_from_image(image)
+            if error:
+                return False, error
+            
+            try:
+                photo = prepare_photo(image, photo_bytes)
+            except Exception:
+                return False, "Failed to encode image"
+            
+            with self.db_manager.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT name, encoding FROM faces WHERE id = ?", (face_id,))
+                row = cursor.fetchone()
+                if row is None:
+                    return False, "Profile not found"
+                name, centroid = row[0], decode_encoding(row[1], FACE_ENCODING_DIM)
+                distance = float(np.linalg.norm(centroid - encoding))
+                if distance > max_distance:
+                    return False, f"This photo does not look like {name} (distance {distance:.2f})"
+                
+                photo_hash = store_photo(cursor, *photo)
+                cursor.execute('''
+                    INSERT INTO face_encodings (face_id, encoding, photo_hash) VALUES (?, ?, ?)
+                ''', (face_id, encode_encoding(encoding), photo_hash))
+                samples = self.update_centroid(cursor, face_id)
+            
+            # The centroid update moved the gallery generation, so the next search reloads
+            return True, f"Sample added ({samples} samples for {name})"
+        
+        except Exception as e:
+            return False, f"Error adding sample: {str(e)}"
+    
+    def remove_face_sample(self, face_id: int, sample_id: int):
+        """Delete one sample of a person; their last sample cannot be removed"""
+        with self.db_manager.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT COUNT(*) FROM face_encodings WHERE face_id = ?", (face_id,))
+            if cursor.fetchone()[0] <= 1:
+                return False, "A person needs at least one sample"
+            cursor.execute("DELETE FROM face_encodings WHERE id = ? AND face_id = ?", (sample_id, face_id))
+            if cursor.rowcount == 0:
+                return False, "Sample not found"
+            samples = self.update_centroid(cursor, face_id)
+        return True, f"Sample removed ({samples} left)"
+    
+    @staticmethod
+    def update_centroid(cursor, face_id: int) -> int:
+        """Store the mean of a person's samples as faces.encoding; returns the sample count"""
+        cursor.execute("SELECT encoding FROM face_encodings WHERE face_id = ?", (face_id,))
+        encodings = []
+        for (blob,) in cursor.fetchall():
+            try:
+                encodings.append(decode_encoding(blob, FACE_ENCODING_DIM))
+            except EncodingFormatError:
+                continue
+        if encodings:
+            centroid = np.mean(encodings, axis=0)
+            cursor.execute("UPDATE faces SET encoding = ? WHERE id = ?", (encode_encoding(centroid), face_id))
+        return len(encodings)
+    
+    def get_face_samples(self, face_id: int) -> List[Dict]:
+        """Samples of a person, oldest first, with their distance to the person's centroid"""
+        with self.db_manager.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT encoding FROM faces WHERE id = ?", (face_id,))
+            row = cursor.fetchone()
+            if row is None:
+                return []
+            centroid = decode_encoding(row[0], FACE_ENCODING_DIM)
+            cursor.execute(FACE_SAMPLES_SQL, (face_id,))
+            samples = []
+            for sample_id, blob, photo_hash, added_at in cursor.fetchall():
+                thumbnail = load_photo(cursor, photo_hash, thumbnail=True) if photo_hash else None
+                try:
+                    distance = float(np.linalg.norm(decode_encoding(blob, FACE_ENCODING_DIM) - centroid))
+                except EncodingFormatError:
+                    distance = None
+                samples.append({'id': sample_id, 'added_at': added_at, 'thumbnail': thumbnail,
+                                'distance': distance})
+        return samples
+    
+    def get_face_photo(self, face_id: int, thumbnail: bool = False) -> Optional[bytes]:
+        """Stored photo (original bytes, or the fixed-size JPEG thumbnail) for a face"""
+        with self.db_manager.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT photo_hash FROM faces WHERE id = ?", (face_id,))
+            row = cursor.fetchone()
+            if not row or not row[0]:
+                return None
+            return load_photo(cursor, row[0], thumbnail)
+    
+    @timed('recognize')
+    def recognize_face(self, image, tolerance: float = 0.6, user_id: int = None,
+                       method: str = "photo_upload", location: str = "", device_info: str = ""):
+        """Recognize a face from the database with enhanced tracking.
+
+        A match is recorded through record_recognitions: the scan count
+        always, plus logs and the user's profile when ``user_id`` is given.
+        """
+        try:
+            encoding, error = self.encode_face_from_image(image)
+            if error:
+                return None, error, 0.0, None
+            
+            face_ids, known_names, distances = self.gallery.search(encoding, k=1)
+            
+            if face_ids.shape[1] == 0:
+                return None, "No faces in database", 0.0, None
+            
+            min_distance = float(distances[0, 0])
+            
+            if min_distance <= tolerance:
+                confidence = self.calibration.confidence(min_distance)
+                matched_face_id = int(face_ids[0, 0])
+                matched_name = known_names[0, 0]
+                
+                self.record_recognitions([RecognitionEvent(
+                    matched_face_id, matched_name, confidence, user_id, method, location, device_info
+                )])
+                
+                return matched_name, None, confidence, matched_face_id
+            else:
+                return None, "No match found", 0.0, None
+                
+        except Exception as e:
+            return None, f"Error during recognition: {str(e)}", 0.0, None
+    
+    @timed('recognize_batch')
+    def recognize_faces_batch(self, images, tolerance: float = 0.6, user_id: int = None,
+                              method: str = "batch_upload", location: str = "", device_info: str = ""):
+        """Recognize many images at once.
+
+        Images are encoded concurrently on the encoding service, matched against the gallery in a
+        single matrix-vs-matrix distance pass, and every resulting write
+        (scan counts, logs, scan history, user profile) goes through one
+        record_recognitions call. Logs are only written when ``user_id`` is given.
+        Returns one (name, error, confidence, face_id) tuple per image, in order.
+        """
+        results = [(None, "Not processed", 0.0, None)] * len(images)
+        if not images:
+            return results
+        
+        # Submit everything up front (throttled by the service's queue bound), then gather
+        futures = []
+        for image in images:
+            try:
+                futures.append(self.submit_encode(image, timeout=None))
+            except Exception as e:
+                futures.append(e)
+        
+        encoded = []
+        for future in futures:
+            try:
+                if isinstance(future, Exception):
+                    raise future
+                encoded.append(future.result())
+            except Exception as e:
+                encoded.append((None, f"Error processing image: {str(e)}"))
+        
+        valid = []
+        for i, (encoding, error) in enumerate(encoded):
+            if error:
+                results[i] = (None, error, 0.0, None)
+            else:
+                valid.append(i)
+        if not valid:
+            return results
+        
+        queries = np.vstack([encoded[i][0] for i in valid])
+        face_ids, known_names, distances = self.gallery.search(queries, k=1)
+        if face_ids.shape[1] == 0:
+            for i in valid:
+                results[i] = (None, "No faces in database", 0.0, None)
+            return results
+        
+        matches = []
+        for row, i in enumerate(valid):
+            min_distance = float(distances[row, 0])
+            if min_distance <= tolerance:
+                confidence = self.calibration.confidence(min_distance)
+                matched_face_id = int(face_ids[row, 0])
+                results[i] = (known_names[row, 0], None, confidence, matched_face_id)
+                matches.append(RecognitionEvent(
+                    matched_face_id, known_names[row, 0], confidence, user_id, method, location, device_info
+                ))
+            else:
+                results[i] = (None, "No match found", 0.0, None)
+        
+        if matches:
+            self.record_recognitions(matches)
+        
+        return results
+    
+    @timed('recognize_group')
+    def recognize_faces_in_image(self, image, tolerance: float = 0.6, user_id: int = None,
+                                 method: str = "photo_upload", location: str = "", device_info: str = ""):
+        """Recognize every face in an image (group photos, crowds).
+
+        All faces are encoded together and matched against the gallery in
+        one vectorized distance pass. Returns (faces, error) where each face
+        is a dict with its box, name, confidence and face_id (name and
+        face_id are None for unknown faces). Matches are recorded together
+        and logged when ``user_id`` is given.
+        """
+        face_locations, encodings, error = self.encode_faces_from_image(image)
+        if error:
+            return [], error
+        
+        face_ids, known_names, distances = self.gallery.search(encodings, k=1)
+        if face_ids.shape[1] == 0:
+            return [], "No faces in database"
+        
+        faces = []
+        matches = []
+        for row, box in enumerate(face_locations):
+            min_distance = float(distances[row, 0])
+            face = {'box': box, 'name': None, 'confidence': 0.0, 'face_id': None}
+            if min_distance <= tolerance:
+                face['name'] = known_names[row, 0]
+                face['confidence'] = self.calibration.confidence(min_distance)
+                face['face_id'] = int(face_ids[row, 0])
+                matches.append(RecognitionEvent(
+                    face['face_id'], face['name'], face['confidence'], user_id, method, location, device_info
+                ))
+            faces.append(face)
+        
+        if matches:
+            self.record_recognitions(matches)
+        
+        return faces, None
+    
+    def match_encodings(self, encodings: np.ndarray, tolerance: float = 0.6):
+        """(face_id, name, confidence) per encoding; face_id and name are None when no face is within tolerance"""
+        face_ids, known_names, distances = self.gallery.search(encodings, k=1)
+        matches = []
+        for row in range(len(encodings)):
+            if face_ids.shape[1] == 0 or float(distances[row, 0]) > tolerance:
+                matches.append((None, None, 0.0))
+            else:
+                min_distance = float(distances[row, 0])
+                matches.append((int(face_ids[row, 0]), known_names[row, 0], self.calibration.confidence(min_distance)))
+        return matches
+
+    def rank_encodings(self, encodings: np.ndarray, k: int = TOP_K) -> List[RankedMatch]:
+        """The k nearest people per encoding with calibrated probabilities and the first-to-second margin.
+
+        The gallery selects the k nearest with a partial sort (argpartition)
+        rather than ordering every enrolled face.
+        """
+        encodings = np.atleast_2d(encodings)
+        face_ids, known_names, distances = self.gallery.search(encodings, k=max(k, 2))
+        probabilities = self.calibration.probability(distances)
+        margins = distances[:, 1] - distances[:, 0] if distances.shape[1] > 1 else None
+
+        ranked = []
+        for row in range(len(encodings)):
+            candidates = [MatchCandidate(int(face_ids[row, col]), known_names[row, col],
+                                         float(distances[row, col]), float(probabilities[row, col]))
+                          for col in range(min(k, distances.shape[1])) if np.isfinite(distances[row, col])]
+            margin = float(margins[row]) if margins is not None and np.isfinite(margins[row]) else None
+            ranked.append(RankedMatch(candidates, margin, margin is not None and margin < AMBIGUOUS_MARGIN))
+        return ranked
+
+    @timed('recognize')
+    def recognize_face_ranked(self, image, k: int = TOP_K, tolerance: float = 0.6, user_id: int = None,
+                              method: str = "photo_upload", location: str = "", device_info: str = ""):
+        """Like recognize_face, but returns (RankedMatch, error) with the top-k candidates.
+
+        The first candidate is recorded when it is within ``tolerance``,
+        exactly as recognize_face would; the runners-up let a reviewer settle
+        an ambiguous match without recognizing the photo again.
+        """
+        try:
+            encoding, error = self.encode_face_from_image(image)
+            if error:
+                return None, error
+
+            ranked = self.rank_encodings(encoding, k)[0]
+            if not ranked.candidates:
+                return ranked, "No faces in database"
+
+            best = ranked.best(tolerance)
+            if best:
+                self.record_recognitions([RecognitionEvent(
+                    best.face_id, best.name, best.probability * 100, user_id, method, location, device_info
+                )])
+            return ranked, None
+
+        except Exception as e:
+            return None, f"Error during recognition: {str(e)}"
+
+    def record_recognitions(self, events: List['RecognitionEvent']):
+        """Record matches: queued on the write-behind writer if enabled, else in one transaction now"""
+        if not events:
+            return
+        if self.writer is not None:
+            self.writer.submit(events)
+        else:
+            self.db_manager.write_recognitions(events)
+    
+    def record_recognition(self, user_id: int, recognized_person: str, confidence: float,
+                           method: str, face_id: int, location: str = "", device_info: str = ""):
+        """Record one match: scan count, recognition log, scan history and user profile together"""
+        self.record_recognitions([RecognitionEvent(
+            face_id, recognized_person, confidence, user_id, method, location, device_info
+        )])
+    
+    def get_all_faces(self):
+        """Get all faces from database with enhanced profile information"""
+        with self.db_manager.connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                SELECT id, name, description, timestamp, added_by, tags, 
+                       age, occupation, department, contact_info, last_seen, scan_count, profile_data
+                FROM faces
+                ORDER BY timestamp DESC
+            ''')
+            
+            faces = []
+            for row in cursor.fetchall():
+                faces.append({
+                    'id': row[0],
+                    'name': row[1],
+                    'description': row[2],
+                    'timestamp': row[3],
+                    'added_by': row[4],
+                    'tags': row[5],
+                    'age': row[6],
+                    'occupation': row[7],
+                    'department': row[8],
+                    'contact_info': row[9],
+                    'last_seen': row[10],
+                    'scan_count': row[11],
+                    'profile_data': json.loads(row[12]) if row[12] else {}
+                })
+        
+        return faces
+    
+    def get_faces_page(self, search: str = "", after: Optional[Tuple[str, int]] = None,
+                       page_size: int = GALLERY_PAGE_SIZE):
+        """One page of the gallery, newest first, with each face's stored thumbnail.
+        
+        ``search`` matches word prefixes in the name, description, occupation,
+        department and tags through the faces_fts index. Returns
+        (faces, next_cursor); next_cursor is None on the last page.
+        """
+        with self.db_manager.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(*self.faces_page_query(search, after, page_size))
+            
+            rows = cursor.fetchall()
+        
+        next_cursor = None
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            next_cursor = (rows[-1][3], rows[-1][0])
+        
+        keys = ('id', 'name', 'description', 'timestamp', 'added_by', 'tags', 'age', 'occupation',
+                'department', 'contact_info', 'last_seen', 'scan_count', 'thumbnail')
+        return [dict(zip(keys, row)) for row in rows], next_cursor
+    
+    @staticmethod
+    def faces_page_query(search: str, after: Optional[Tuple[str, int]], page_size: int):
+        """(sql, params) for one page of get_faces_page"""
+        conditions, params = [], []
+        source = "faces f"
+        match = search_query(search)
+        if match:
+            # Start from the matching rows, then fetch their faces by id
+            source = "faces_fts CROSS JOIN faces f ON f.id = faces_fts.rowid"
+            conditions.append("faces_fts MATCH ?")
+            params.append(match)
+        if after is not None:
+            conditions.append("(f.timestamp, f.id) < (?, ?)")
+            params.extend(after)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        return FACES_PAGE_SQL.format(source=source, where=where), params + [page_size + 1]
+    
+    def count_faces(self, search: str = "") -> int:
+        """Number of enrolled faces, or of faces matching ``search``"""
+        match = search_query(search)
+        if not match:
+            return self.db_manager.get_analytics_totals()['faces']
+        with self.db_manager.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT COUNT(*) FROM faces_fts WHERE faces_fts MATCH ?", (match,))
+            return cursor.fetchone()[0]
+    
+    def get_face_profile(self, face_id: int):
+        """Get detailed face profile information with scan history"""
+        with self.db_manager.connection() as conn:
+            cursor = conn.cursor()
+            
+            # Get face information
+            cursor.execute('''
+                SELECT id, name, description, timestamp, added_by, tags,
+                       age, occupation, department, contact_info, last_seen, scan_count, profile_data
+                FROM faces WHERE id = ?
+            ''', (face_id,))
+            
+            face_data = cursor.fetchone()
+            if not face_data:
+                return None
+            
+            face_profile = {
+                'id': face_data[0],
+                'name': face_data[1],
+                'description': face_data[2],
+                'timestamp': face_data[3],
+                'added_by': face_data[4],
+                'tags': face_data[5],
+                'age': face_data[6],
+                'occupation': face_data[7],
+                'department': face_data[8],
+                'contact_info': face_data[9],
+                'last_seen': face_data[10],
+                'scan_count': face_data[11],
+                'profile_data': json.loads(face_data[12]) if face_data[12] else {}
+            }
+            
+            # Get recent scan history
+            cursor.execute(FACE_RECENT_SCANS_SQL, (face_id,))
+            
+            scan_history = cursor.fetchall()
+            face_profile['scan_history'] = scan_history
+        
+        return face_profile
+    
+    def get_face_scan_history(self, face_id: int, limit: int = 50):
+        """Get detailed scan history for a face including user info and timestamps"""
+        with self.db_manager.connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute(FACE_SCAN_HISTORY_SQL, (face_id, limit))
+            
+            scan_history = cursor.fetchall()
+        
+        return [
+            {
+                'timestamp': row[0],
+                'confidence': row[1],
+                'method': row[2],
+                'username': row[3] or 'Unknown',
+                'user_type': row[4] or 'Unknown',
+                'location': row[5] or '',
+                'device_info': row[6] or ''
+            }
+            for row in scan_history
+        ]
+    
+    def export_face_scan_history(self, face_id: int, fmt: str, start: Optional[str] = None,
+                                 end: Optional[str] = None):
+        """Stream a face's scan history (optionally a UTC date range) into a temp file; returns (path, rows)"""
+        conditions, params = ["fsh.face_id = ?"], [face_id]
+        if start:
+            conditions.append("fsh.timestamp >= ?")
+            params.append(start)
+        if end:
+            conditions.append("fsh.timestamp < ?")
+            params.append(end)
+        
+        with self.db_manager.connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute(f'''
+                SELECT fsh.timestamp, fsh.confidence, fsh.method, u.username, u.user_type,
+                       rl.location, rl.device_info
+                FROM face_scan_history fsh
+                LEFT JOIN users u ON fsh.scanned_by_user = u.id
+                LEFT JOIN recognition_logs rl ON (rl.face_id = fsh.face_id AND rl.timestamp = fsh.timestamp)
+                WHERE {' AND '.join(conditions)}
+                ORDER BY fsh.timestamp
+            ''', params)
+            
+            return export_to_tempfile(cursor, SCAN_EXPORT_COLUMNS, fmt)
@@ -0,0 +1,607 @@
+"""Database schema and versioned migrations.
+
+``migrate`` brings any database, including ones created before versioning
+existed, up to the latest schema. Each migration runs inside the caller's
+transaction and is recorded in ``schema_version``, so it is applied exactly
+once. New schema changes are appended to ``MIGRATIONS``; released entries
+are never edited.
+"""
+import io
+import json
+import logging
+import sqlite3
+from typing import List
+
+from PIL import Image
+
+from encoding_format import EncodingFormatError, decode_encoding, encode_encoding, is_current_format
+from photo_store import store_photo
+
+logger = logging.getLogger(__name__)
+
+
+def create_base_schema(cursor):
+    """Version 1: the original tables plus the gallery generation counter"""
+    # Users table for login system
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL UNIQUE,
+            password_hash TEXT NOT NULL,
+            user_type TEXT NOT NULL DEFAULT 'user',
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            last_login DATETIME,
+            profile_data TEXT
+        )
+    ''')
+    
+    # Faces table for face recognition with enhanced profile information
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS faces (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE,
+            photo BLOB NOT NULL,
+            encoding BLOB NOT NULL,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            description TEXT,
+            added_by TEXT,
+            tags TEXT,
+            age INTEGER,
+            occupation TEXT,
+            department TEXT,
+            contact_info TEXT,
+            last_seen DATETIME,
+            scan_count INTEGER DEFAULT 0,
+            profile_data TEXT
+        )
+    ''')
+    
+    # Recognition logs table with enhanced tracking
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS recognition_logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            face_id INTEGER,
+            recognized_person TEXT,
+            confidence REAL,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            method TEXT,
+            location TEXT,
+            device_info TEXT,
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            FOREIGN KEY (face_id) REFERENCES faces (id)
+        )
+    ''')
+    
+    # Face scan history table for detailed tracking
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS face_scan_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            face_id INTEGER,
+            scanned_by_user INTEGER,
+            confidence REAL,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            method TEXT,
+            FOREIGN KEY (face_id) REFERENCES faces (id),
+            FOREIGN KEY (scanned_by_user) REFERENCES users (id)
+        )
+    ''')
+    
+    # User profiles table for individual recognition history
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_profiles (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            recognized_faces TEXT,
+            total_recognitions INTEGER DEFAULT 0,
+            last_recognition DATETIME,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+
+    # Gallery generation counter, bumped by triggers whenever the faces
+    # table changes so every in-memory gallery can tell it is stale
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS gallery_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            generation INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute("INSERT OR IGNORE INTO gallery_state (id, generation) VALUES (1, 0)")
+
+    create_gallery_triggers(cursor)
+
+
+def create_gallery_triggers(cursor):
+    """Triggers that bump the gallery generation whenever faces change"""
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS faces_gallery_insert AFTER INSERT ON faces
+        BEGIN
+            UPDATE gallery_state SET generation = generation + 1 WHERE id = 1;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS faces_gallery_delete AFTER DELETE ON faces
+        BEGIN
+            UPDATE gallery_state SET generation = generation + 1 WHERE id = 1;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS faces_gallery_update AFTER UPDATE OF name, encoding ON faces
+        BEGIN
+            UPDATE gallery_state SET generation = generation + 1 WHERE id = 1;
+        END
+    ''')
+
+
+def move_photos_to_blob_store(cursor):
+    """Version 3: photos move out of faces into the content-addressed face_photos table"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS face_photos (
+            hash TEXT PRIMARY KEY,
+            format TEXT NOT NULL,
+            data BLOB NOT NULL,
+            thumbnail BLOB,
+            width INTEGER,
+            height INTEGER,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # Stream the existing inline photos (stored as PNG) into the blob store
+    photo_hashes = []
+    unreadable = 0
+    reader = cursor.connection.cursor()
+    for face_id, photo in reader.execute("SELECT id, photo FROM faces"):
+        if not photo:
+            continue
+        try:
+            with Image.open(io.BytesIO(photo)) as image:
+                fmt, width, height = image.format or 'PNG', image.width, image.height
+            digest = store_photo(cursor, photo, fmt, width, height)
+        except (OSError, SyntaxError, ValueError, Image.DecompressionBombError):
+            # Keep the bytes so nothing is lost, but one bad row must not block startup
+            unreadable += 1
+            digest = store_photo(cursor, photo, 'unknown', None, None, thumbnail=False)
+        photo_hashes.append((digest, face_id))
+    if unreadable:
+        logger.warning("%d stored photos could not be decoded; moved without thumbnail or dimensions",
+                       unreadable)
+    
+    # Rebuild faces without the photo column so rows hold only metadata and the encoding
+    cursor.execute('''
+        CREATE TABLE faces_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE,
+            photo_hash TEXT REFERENCES face_photos (hash),
+            encoding BLOB NOT NULL,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            description TEXT,
+            added_by TEXT,
+            tags TEXT,
+            age INTEGER,
+            occupation TEXT,
+            department TEXT,
+            contact_info TEXT,
+            last_seen DATETIME,
+            scan_count INTEGER DEFAULT 0,
+            profile_data TEXT
+        )
+    ''')
+    cursor.execute('''
+        INSERT INTO faces_new (id, name, encoding, timestamp, description, added_by, tags, age,
+                               occupation, department, contact_info, last_seen, scan_count, profile_data)
+        SELECT id, name, encoding, timestamp, description, added_by, tags, age,
+               occupation, department, contact_info, last_seen, scan_count, profile_data
+        FROM faces
+    ''')
+    cursor.executemany("UPDATE faces_new SET photo_hash = ? WHERE id = ?", photo_hashes)
+    cursor.execute("DROP TABLE faces")
+    cursor.execute("ALTER TABLE faces_new RENAME TO faces")
+    create_gallery_triggers(cursor)
+    cursor.execute("UPDATE gallery_state SET generation = generation + 1 WHERE id = 1")
+
+
+def compact_encodings(cursor):
+    """Version 4: rewrite raw float64 encodings in the versioned compact format"""
+    updates = []
+    reader = cursor.connection.cursor()
+    for face_id, blob in reader.execute("SELECT id, encoding FROM faces"):
+        if is_current_format(blob):
+            continue
+        try:
+            updates.append((encode_encoding(decode_encoding(blob)), face_id))
+        except EncodingFormatError:
+            # Unreadable rows are left as they are; the gallery skips them on load
+            continue
+    cursor.executemany("UPDATE faces SET encoding = ? WHERE id = ?", updates)
+
+
+# Confidence histogram buckets: 10 points wide, clamped to 0..9
+CONFIDENCE_BUCKET = "MAX(0, MIN(9, CAST({0}.confidence / 10 AS INTEGER)))"
+
+
+def create_analytics_rollups(cursor):
+    """Version 6: rollup tables for the analytics pages, backfilled from the logs"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS analytics_totals (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            users INTEGER NOT NULL DEFAULT 0,
+            faces INTEGER NOT NULL DEFAULT 0,
+            recognitions INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS recognition_daily (
+            day TEXT PRIMARY KEY,
+            recognitions INTEGER NOT NULL DEFAULT 0,
+            confidence_sum REAL NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS recognition_by_user (
+            user_id INTEGER PRIMARY KEY,
+            recognitions INTEGER NOT NULL DEFAULT 0,
+            confidence_sum REAL NOT NULL DEFAULT 0,
+            last_recognition DATETIME
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS recognition_by_person (
+            recognized_person TEXT PRIMARY KEY,
+            recognitions INTEGER NOT NULL DEFAULT 0,
+            confidence_sum REAL NOT NULL DEFAULT 0,
+            last_recognition DATETIME
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS confidence_histogram (
+            day TEXT NOT NULL,
+            bucket INTEGER NOT NULL,
+            recognitions INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, bucket)
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_recognition_by_person_count
+        ON recognition_by_person (recognitions)
+    ''')
+
+    # Backfill from the existing rows
+    cursor.execute('''
+        INSERT OR REPLACE INTO analytics_totals (id, users, faces, recognitions)
+        VALUES (1, (SELECT COUNT(*) FROM users), (SELECT COUNT(*) FROM faces),
+                (SELECT COUNT(*) FROM recognition_logs))
+    ''')
+    cursor.execute('''
+        INSERT INTO recognition_daily (day, recognitions, confidence_sum)
+        SELECT date(timestamp), COUNT(*), TOTAL(confidence)
+        FROM recognition_logs GROUP BY date(timestamp)
+    ''')
+    cursor.execute('''
+        INSERT INTO recognition_by_user (user_id, recognitions, confidence_sum, last_recognition)
+        SELECT user_id, COUNT(*), TOTAL(confidence), MAX(timestamp)
+        FROM recognition_logs WHERE user_id IS NOT NULL GROUP BY user_id
+    ''')
+    cursor.execute('''
+        INSERT INTO recognition_by_person (recognized_person, recognitions, confidence_sum, last_recognition)
+        SELECT recognized_person, COUNT(*), TOTAL(confidence), MAX(timestamp)
+        FROM recognition_logs WHERE recognized_person IS NOT NULL GROUP BY recognized_person
+    ''')
+    cursor.execute(f'''
+        INSERT INTO confidence_histogram (day, bucket, recognitions)
+        SELECT date(timestamp), {CONFIDENCE_BUCKET.format('recognition_logs')}, COUNT(*)
+        FROM recognition_logs WHERE confidence IS NOT NULL GROUP BY 1, 2
+    ''')
+
+    create_analytics_triggers(cursor)
+
+
+def create_analytics_triggers(cursor):
+    """Triggers that keep the analytics rollups in step with every insert and delete"""
+    for table, column in (('users', 'users'), ('faces', 'faces')):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_analytics_insert AFTER INSERT ON {table}
+            BEGIN
+                UPDATE analytics_totals SET {column} = {column} + 1 WHERE id = 1;
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_analytics_delete AFTER DELETE ON {table}
+            BEGIN
+                UPDATE analytics_totals SET {column} = {column} - 1 WHERE id = 1;
+            END
+        ''')
+
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS recognition_logs_analytics_insert AFTER INSERT ON recognition_logs
+        BEGIN
+            UPDATE analytics_totals SET recognitions = recognitions + 1 WHERE id = 1;
+            INSERT INTO recognition_daily (day, recognitions, confidence_sum)
+            VALUES (date(NEW.timestamp), 1, IFNULL(NEW.confidence, 0))
+            ON CONFLICT (day) DO UPDATE SET
+                recognitions = recognitions + 1,
+                confidence_sum = confidence_sum + excluded.confidence_sum;
+            INSERT INTO recognition_by_user (user_id, recognitions, confidence_sum, last_recognition)
+            SELECT NEW.user_id, 1, IFNULL(NEW.confidence, 0), NEW.timestamp WHERE NEW.user_id IS NOT NULL
+            ON CONFLICT (user_id) DO UPDATE SET
+                recognitions = recognitions + 1,
+                confidence_sum = confidence_sum + excluded.confidence_sum,
+                last_recognition = MAX(IFNULL(last_recognition, ''), excluded.last_recognition);
+            INSERT INTO recognition_by_person (recognized_person, recognitions, confidence_sum, last_recognition)
+            SELECT NEW.recognized_person, 1, IFNULL(NEW.confidence, 0), NEW.timestamp
+            WHERE NEW.recognized_person IS NOT NULL
+            ON CONFLICT (recognized_person) DO UPDATE SET
+                recognitions = recognitions + 1,
+                confidence_sum = confidence_sum + excluded.confidence_sum,
+                last_recognition = MAX(IFNULL(last_recognition, ''), excluded.last_recognition);
+            INSERT INTO confidence_histogram (day, bucket, recognitions)
+            SELECT date(NEW.timestamp), {CONFIDENCE_BUCKET.format('NEW')}, 1 WHERE NEW.confidence IS NOT NULL
+            ON CONFLICT (day, bucket) DO UPDATE SET recognitions = recognitions + 1;
+        END
+    ''')
+    # Deletes only decrement counters; last_recognition is left as an upper bound
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS recognition_logs_analytics_delete AFTER DELETE ON recognition_logs
+        BEGIN
+            UPDATE analytics_totals SET recognitions = recognitions - 1 WHERE id = 1;
+            UPDATE recognition_daily
+            SET recognitions = recognitions - 1, confidence_sum = confidence_sum - IFNULL(OLD.confidence, 0)
+            WHERE day = date(OLD.timestamp);
+            UPDATE recognition_by_user
+            SET recognitions = recognitions - 1, confidence_sum = confidence_sum - IFNULL(OLD.confidence, 0)
+            WHERE user_id = OLD.user_id;
+            UPDATE recognition_by_person
+            SET recognitions = recognitions - 1, confidence_sum = confidence_sum - IFNULL(OLD.confidence, 0)
+            WHERE recognized_person = OLD.recognized_person;
+            UPDATE confidence_histogram SET recognitions = recognitions - 1
+            WHERE day = date(OLD.timestamp) AND bucket = {CONFIDENCE_BUCKET.format('OLD')};
+        END
+    ''')
+
+def create_user_face_counts(cursor):
+    """Version 7: per-user recognition counters replace the JSON list in user_profiles"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_face_counts (
+            user_id INTEGER NOT NULL,
+            face_id INTEGER NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            last_seen DATETIME,
+            PRIMARY KEY (user_id, face_id),
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            FOREIGN KEY (face_id) REFERENCES faces (id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_user_face_counts_user_seen
+        ON user_face_counts (user_id, last_seen)
+    ''')
+
+    # Exact counts for every (user, face) pair the logs know about
+    cursor.execute('''
+        INSERT INTO user_face_counts (user_id, face_id, count, last_seen)
+        SELECT user_id, face_id, COUNT(*), MAX(timestamp)
+        FROM recognition_logs
+        WHERE user_id IS NOT NULL AND face_id IS NOT NULL
+        GROUP BY user_id, face_id
+    ''')
+
+    # People only present in a JSON profile count as seen once
+    face_ids = dict(cursor.execute("SELECT name, id FROM faces").fetchall())
+    profiles = cursor.execute('''
+        SELECT user_id, recognized_faces, last_recognition FROM user_profiles
+        WHERE user_id IS NOT NULL AND recognized_faces IS NOT NULL
+    ''').fetchall()
+    for user_id, recognized_faces, last_recognition in profiles:
+        try:
+            names = json.loads(recognized_faces)
+        except ValueError:
+            continue
+        cursor.executemany('''
+            INSERT OR IGNORE INTO user_face_counts (user_id, face_id, count, last_seen)
+            VALUES (?, ?, 1, ?)
+        ''', [(user_id, face_ids[name], last_recognition) for name in names if name in face_ids])
+    cursor.execute("UPDATE user_profiles SET recognized_faces = NULL")
+
+
+# Profile columns indexed for the gallery search box
+FACE_SEARCH_COLUMNS = ('name', 'description', 'occupation', 'department', 'tags')
+
+
+def create_faces_search(cursor):
+    """Version 9: FTS5 index over the face profile text and a newest-first listing index"""
+    columns = ', '.join(FACE_SEARCH_COLUMNS)
+    cursor.execute(f'''
+        CREATE VIRTUAL TABLE IF NOT EXISTS faces_fts USING fts5(
+            {columns},
+            content='faces', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+    ''')
+    cursor.execute("INSERT INTO faces_fts (faces_fts) VALUES ('rebuild')")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_faces_timestamp ON faces (timestamp)")
+    create_search_triggers(cursor)
+
+
+def create_search_triggers(cursor):
+    """Triggers that keep faces_fts in step with the faces table.
+
+    A migration that rebuilds faces must call this as well as
+    create_gallery_triggers, create_analytics_triggers and
+    create_sample_triggers.
+    """
+    columns = ', '.join(FACE_SEARCH_COLUMNS)
+    new_values = ', '.join(f'NEW.{column}' for column in FACE_SEARCH_COLUMNS)
+    old_values = ', '.join(f'OLD.{column}' for column in FACE_SEARCH_COLUMNS)
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS faces_search_insert AFTER INSERT ON faces
+        BEGIN
+            INSERT INTO faces_fts (rowid, {columns}) VALUES (NEW.id, {new_values});
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS faces_search_delete AFTER DELETE ON faces
+        BEGIN
+            INSERT INTO faces_fts (faces_fts, rowid, {columns}) VALUES ('delete', OLD.id, {old_values});
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS faces_search_update AFTER UPDATE OF {columns} ON faces
+        BEGIN
+            INSERT INTO faces_fts (faces_fts, rowid, {columns}) VALUES ('delete', OLD.id, {old_values});
+            INSERT INTO faces_fts (rowid, {columns}) VALUES (NEW.id, {new_values});
+        END
+    ''')
+
+# Version 2: covering indexes for the per-user history, per-face scan history
+# (and its join back to recognition_logs) and the newest-first log views
+INDEX_LOG_TABLES = [
+    '''CREATE INDEX IF NOT EXISTS idx_recognition_logs_user_time
+       ON recognition_logs (user_id, timestamp, recognized_person, confidence, method)''',
+    '''CREATE INDEX IF NOT EXISTS idx_recognition_logs_face_time
+       ON recognition_logs (face_id, timestamp, location, device_info)''',
+    '''CREATE INDEX IF NOT EXISTS idx_recognition_logs_time
+       ON recognition_logs (timestamp)''',
+    '''CREATE INDEX IF NOT EXISTS idx_face_scan_history_face_time
+       ON face_scan_history (face_id, timestamp, confidence, method, scanned_by_user)''',
+    '''CREATE INDEX IF NOT EXISTS idx_user_profiles_user
+       ON user_profiles (user_id)''',
+]
+
+# Version 5: filter indexes for the paginated log viewer
+INDEX_LOG_FILTERS = [
+    '''CREATE INDEX IF NOT EXISTS idx_recognition_logs_person_time
+       ON recognition_logs (recognized_person, timestamp)''',
+    '''CREATE INDEX IF NOT EXISTS idx_recognition_logs_method_time
+       ON recognition_logs (method, timestamp)''',
+]
+
+# Version 8: collapsed stream sightings keep their last-seen time and count
+LOG_SIGHTINGS = [
+    "ALTER TABLE recognition_logs ADD COLUMN last_seen DATETIME",
+    "ALTER TABLE recognition_logs ADD COLUMN sightings INTEGER NOT NULL DEFAULT 1",
+]
+
+# Version 10: per-file outcome of bulk imports, so an interrupted import resumes
+BULK_IMPORT_FILES = [
+    '''CREATE TABLE IF NOT EXISTS bulk_import_files (
+           source TEXT NOT NULL,
+           item TEXT NOT NULL,
+           name TEXT,
+           status TEXT NOT NULL,
+           face_id INTEGER,
+           error TEXT,
+           updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+           PRIMARY KEY (source, item)
+       ) WITHOUT ROWID''',
+]
+
+def create_face_encodings(cursor):
+    """Version 11: several encodings (samples) per person, with faces.encoding as their centroid.
+
+    Every existing face becomes its own first sample. New faces get theirs
+    from the insert trigger. Extra samples are written together with an
+    update of faces.encoding to the new centroid. That update is what bumps
+    the gallery generation, so each change still counts as one step.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS face_encodings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            face_id INTEGER NOT NULL REFERENCES faces (id),
+            encoding BLOB NOT NULL,
+            photo_hash TEXT REFERENCES face_photos (hash),
+            added_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_face_encodings_face ON face_encodings (face_id)")
+    cursor.execute('''
+        INSERT INTO face_encodings (face_id, encoding, photo_hash, added_at)
+        SELECT id, encoding, photo_hash, timestamp FROM faces ORDER BY id
+    ''')
+    create_sample_triggers(cursor)
+
+
+def create_sample_triggers(cursor):
+    """Triggers that give each new face its first sample and drop the samples of deleted faces"""
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS faces_samples_insert AFTER INSERT ON faces
+        BEGIN
+            INSERT INTO face_encodings (face_id, encoding, photo_hash) VALUES (NEW.id, NEW.encoding, NEW.photo_hash);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS faces_samples_delete AFTER DELETE ON faces
+        BEGIN
+            DELETE FROM face_encodings WHERE face_id = OLD.id;
+        END
+    ''')
+
+# (version, description, list of SQL statements or a callable taking a cursor)
+MIGRATIONS = [
+    (1, "Base tables and gallery generation triggers", create_base_schema),
+    (2, "Indexes for recognition log and scan history queries", INDEX_LOG_TABLES),
+    (3, "Move photos to the content-addressed face_photos table", move_photos_to_blob_store),
+    (4, "Store encodings in the versioned compact format", compact_encodings),
+    (5, "Indexes for the recognition log viewer filters", INDEX_LOG_FILTERS),
+    (6, "Analytics rollup tables maintained by triggers", create_analytics_rollups),
+    (7, "Normalize user profiles into user_face_counts", create_user_face_counts),
+    (8, "Sighting span and count on recognition logs", LOG_SIGHTINGS),
+    (9, "Full-text search and listing index for the face gallery", create_faces_search),
+    (10, "Resumable bulk import file status", BULK_IMPORT_FILES),
+    (11, "Several encodings per person in face_encodings", create_face_encodings),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(cursor) -> int:
+    """Highest applied migration (0 for a database that predates versioning)"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute("SELECT MAX(version) FROM schema_version")
+    return cursor.fetchone()[0] or 0
+
+
+def is_current(cursor) -> bool:
+    """True when every migration is applied; reads only, so it takes no write lock"""
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'schema_version'")
+    if cursor.fetchone() is None:
+        return False
+    cursor.execute("SELECT MAX(version) FROM schema_version")
+    return (cursor.fetchone()[0] or 0) >= LATEST_VERSION
+
+
+def migrate(cursor) -> List[int]:
+    """Apply every pending migration and return the versions applied"""
+    applied = []
+    version = current_version(cursor)
+    for target, description, step in MIGRATIONS:
+        if target <= version:
+            continue
+        if callable(step):
+            step(cursor)
+        else:
+            for statement in step:
+                cursor.execute(statement)
+        cursor.execute("INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                       (target, description))
+        applied.append(target)
+    return applied
+
+
+def explain_query_plan(cursor, sql: str, params=()) -> List[str]:
+    """Detail lines of EXPLAIN QUERY PLAN for a statement"""
+    cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+    return [row[-1] for row in cursor.fetchall()]
+
+
+def connect_memory() -> sqlite3.Connection:
+    """Fresh in-memory database at the latest schema version"""
+    conn = sqlite3.connect(':memory:')
+    migrate(conn.cursor())
+    return conn
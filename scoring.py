@@ -0,0 +1,73 @@
+"""Calibration of match distances into probabilities.
+
+``face_recognition`` reports a euclidean distance between encodings; the app
+shows it as a confidence percentage. The ``linear`` calibration keeps the
+historical ``1 - distance`` score. The ``logistic`` calibration maps a
+distance to the probability that both faces are the same person:
+
+    p = 1 / (1 + exp(slope * (distance - midpoint)))
+
+``midpoint`` is the distance scored 50% and ``slope`` how fast the score
+falls around it. Both can be fitted on labelled distances with
+``fit_logistic`` (see ``benchmarks/calibrate_scores.py``) and set through
+the ``KHOYA_SCORE_*`` variables.
+"""
+import os
+from typing import NamedTuple
+
+import numpy as np
+
+CALIBRATION_METHODS = ('linear', 'logistic')
+# Distance-to-probability calibration and its logistic parameters
+SCORE_CALIBRATION = os.environ.get('KHOYA_SCORE_CALIBRATION', 'linear')
+SCORE_MIDPOINT = float(os.environ.get('KHOYA_SCORE_MIDPOINT', '0.5'))
+SCORE_SLOPE = float(os.environ.get('KHOYA_SCORE_SLOPE', '20'))
+
+
+class ScoreCalibration(NamedTuple):
+    """Maps match distances to probabilities in [0, 1]"""
+    method: str = SCORE_CALIBRATION
+    midpoint: float = SCORE_MIDPOINT
+    slope: float = SCORE_SLOPE
+
+    def probability(self, distances):
+        """Same-person probability for a distance or an array of distances"""
+        distances = np.asarray(distances, dtype=np.float64)
+        if self.method == 'logistic':
+            # exp overflows to inf far beyond the midpoint, which correctly gives 0
+            with np.errstate(over='ignore'):
+                return 1.0 / (1.0 + np.exp(self.slope * (distances - self.midpoint)))
+        if self.method == 'linear':
+            return np.clip(1.0 - distances, 0.0, 1.0)
+        raise ValueError(f"Unknown score calibration '{self.method}', expected one of {CALIBRATION_METHODS}")
+
+    def confidence(self, distance: float) -> float:
+        """Probability of one distance as the percentage stored in the logs"""
+        return float(self.probability(distance)) * 100
+
+
+def fit_logistic(genuine: np.ndarray, impostor: np.ndarray, iterations: int = 100) -> ScoreCalibration:
+    """Fit a logistic calibration to distances of same-person and different-person pairs.
+
+    Classes are weighted equally, so the midpoint does not drift towards
+    whichever kind of pair is more common in the sample.
+    """
+    distances = np.concatenate([genuine, impostor]).astype(np.float64)
+    labels = np.concatenate([np.ones(len(genuine)), np.zeros(len(impostor))])
+    weights = np.concatenate([np.full(len(genuine), 0.5 / len(genuine)),
+                              np.full(len(impostor), 0.5 / len(impostor))])
+    # p = sigmoid(a + b * d); Newton-Raphson on the weighted log-likelihood, with a
+    # small ridge penalty so perfectly separated samples still converge
+    features = np.column_stack([np.ones_like(distances), distances])
+    params = np.zeros(2)
+    ridge = 1e-4
+    for _ in range(iterations):
+        p = 1.0 / (1.0 + np.exp(-features @ params))
+        gradient = features.T @ (weights * (labels - p)) - ridge * params
+        hessian = (features * (weights * p * (1 - p))[:, None]).T @ features + ridge * np.eye(2)
+        step = np.linalg.solve(hessian, gradient)
+        params += step
+        if np.abs(step).max() < 1e-8:
+            break
+    intercept, coefficient = params
+    return ScoreCalibration('logistic', midpoint=float(-intercept / coefficient), slope=float(-coefficient))
@@ -0,0 +1,420 @@
+"""Headless HTTP API for enrollment, recognition and log queries.
+
+Serves the same managers as the Streamlit app (``recognition.py``) to
+kiosks, cameras and other programs that cannot drive a browser session:
+
+    GET  /health              gallery size, encoding queue and cache stats
+    GET  /metrics             per-stage latency histograms in the Prometheus text format
+    POST /enroll              add a person (admin; multipart ``photo`` + profile fields)
+    POST /recognize           identify one face (with ``top_k=N`` candidates), or every face with ``all_faces=1``
+    POST /recognize/batch     identify one face per uploaded ``photos`` file
+    GET  /faces               enrolled faces, newest first, with ``q`` full-text search (admin)
+    GET  /faces/{id}/thumbnail  stored JPEG thumbnail of a face (admin)
+    POST /faces/{id}/samples  add another enrollment photo of a face (admin; multipart ``photo``)
+    GET  /logs                recognition logs, newest first, keyset paginated
+    GET  /logs/export         every log matching the /logs filters as a file (``format=csv|csv.gz|parquet|arrow``)
+    GET  /faces/{id}/history/export  a face's scan history as a file, optionally between ``start`` and ``end`` (admin)
+
+Requests authenticate with HTTP Basic using the app's own accounts.
+Recognitions are logged against the calling account with method ``api``.
+Handlers run the blocking manager calls on a thread pool, while detection
+and encoding go to the shared ``EncodingService`` process pool, so one
+process keeps every CPU busy. Connections are kept alive between requests
+for ``KHOYA_SERVICE_KEEP_ALIVE`` seconds.
+
+Run with:
+    python service.py --host 0.0.0.0 --port 8000
+"""
+import argparse
+import base64
+import io
+import os
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from PIL import Image
+from starlette.applications import Starlette
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import FileResponse, JSONResponse, Response
+from starlette.routing import Route
+
+from encoding_cache import EncodingCache
+from encoding_service import BUSY_MESSAGE, MODEL_WARMUP, EncodingService
+from log_export import EXPORT_FORMATS, available_formats
+from metrics import REGISTRY, start_file_export
+from recognition import (GALLERY_PAGE_SIZE, LOG_PAGE_SIZE, WRITE_BEHIND, DatabaseManager, FaceGallery,
+                         FaceRecognitionManager, LogFilters, RecognitionWriter)
+
+# Seconds an idle client connection is kept open for its next request
+SERVICE_KEEP_ALIVE = int(os.environ.get('KHOYA_SERVICE_KEEP_ALIVE', '30'))
+# Largest number of files accepted by one /recognize/batch request
+SERVICE_MAX_BATCH = int(os.environ.get('KHOYA_SERVICE_MAX_BATCH', '32'))
+# Retry-After seconds sent with 503 responses when every encoding worker is busy
+SERVICE_RETRY_AFTER = int(os.environ.get('KHOYA_SERVICE_RETRY_AFTER', '2'))
+
+RECOGNITION_METHOD = 'api'
+
+
+class ServiceError(Exception):
+    """Turned into a JSON error response with the given status code"""
+
+    def __init__(self, status_code: int, message: str, headers: Optional[dict] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+        self.headers = headers
+
+
+async def service_error(request: Request, exc: ServiceError) -> JSONResponse:
+    return JSONResponse({'error': exc.message}, status_code=exc.status_code, headers=exc.headers)
+
+
+async def authenticate(request: Request, admin: bool = False) -> dict:
+    """Account for the request's HTTP Basic credentials"""
+    header = request.headers.get('authorization', '')
+    scheme, _, encoded = header.partition(' ')
+    try:
+        username, _, password = base64.b64decode(encoded).decode().partition(':')
+    except (ValueError, UnicodeDecodeError):
+        username = password = ''
+    user = None
+    if scheme.lower() == 'basic' and username:
+        user = await run_in_threadpool(request.app.state.db_manager.verify_user, username, password)
+    if user is None:
+        raise ServiceError(401, "Invalid username or password",
+                           {'WWW-Authenticate': 'Basic realm="khoya_paya"'})
+    if admin and user['user_type'] != 'admin':
+        raise ServiceError(403, "Admin account required")
+    return user
+
+
+async def read_image(upload) -> Image.Image:
+    if upload is None or isinstance(upload, str):
+        raise ServiceError(400, "Upload the image as a multipart file field")
+    data = await upload.read()
+    try:
+        image = Image.open(io.BytesIO(data))
+        image.load()
+    except Exception:
+        raise ServiceError(400, f"Could not read '{upload.filename}' as an image")
+    return image
+
+
+def form_float(value, default: float, name: str) -> float:
+    try:
+        return default if value in (None, '') else float(value)
+    except ValueError:
+        raise ServiceError(400, f"'{name}' must be a number")
+
+
+def form_flag(value) -> bool:
+    return str(value).lower() in ('1', 'true', 'yes', 'on')
+
+
+def match_json(name, error, confidence, face_id) -> dict:
+    return {'name': name, 'face_id': face_id, 'confidence': round(confidence, 2), 'error': error}
+
+
+def ranked_json(ranked, error, tolerance: float) -> dict:
+    """match_json fields for the best candidate plus every candidate, the margin and the ambiguity flag"""
+    best = ranked.best(tolerance) if ranked else None
+    if best is None and error is None:
+        error = "No match found"
+    result = match_json(best.name if best else None, error, best.probability * 100 if best else 0.0,
+                        best.face_id if best else None)
+    result.update({
+        'candidates': [{'name': c.name, 'face_id': c.face_id, 'distance': round(c.distance, 4),
+                        'probability': round(c.probability, 4)} for c in (ranked.candidates if ranked else [])],
+        'margin': round(ranked.margin, 4) if ranked and ranked.margin is not None else None,
+        'ambiguous': bool(ranked and ranked.ambiguous),
+    })
+    return result
+
+
+async def health(request: Request) -> JSONResponse:
+    state = request.app.state
+    gallery = state.face_manager.gallery
+    encodings, _, _ = await run_in_threadpool(gallery.snapshot)
+    return JSONResponse({
+        'status': 'ok',
+        'gallery_size': gallery.identities,
+        'gallery_rows': len(encodings),
+        'index': gallery.describe_index(),
+        'encoding_workers': state.encoder.max_workers,
+        'encoding_pending': state.encoder.pending(),
+        'encoding_cache': state.cache.stats(),
+    })
+
+
+async def metrics(request: Request) -> Response:
+    return Response(REGISTRY.render(), media_type='text/plain; version=0.0.4')
+
+
+async def enroll(request: Request) -> JSONResponse:
+    user = await authenticate(request, admin=True)
+    form = await request.form()
+    name = (form.get('name') or '').strip()
+    if not name:
+        raise ServiceError(400, "'name' is required")
+    upload = form.get('photo')
+    image = await read_image(upload)
+    await upload.seek(0)
+    photo_bytes = await upload.read()
+    age = form.get('age')
+    if age:
+        try:
+            age = int(age)
+        except ValueError:
+            raise ServiceError(400, "'age' must be a whole number")
+
+    success, message = await run_in_threadpool(
+        request.app.state.face_manager.add_face_to_database,
+        name, image, form.get('description', ''), user['username'], age or None,
+        form.get('occupation', ''), form.get('department', ''), form.get('contact_info', ''),
+        None, photo_bytes, form_flag(form.get('allow_duplicate')),
+    )
+    if not success:
+        raise ServiceError(409 if 'already exists' in message or 'near-duplicate' in message else 422, message)
+    return JSONResponse({'name': name, 'message': message}, status_code=201)
+
+
+def check_busy(*errors):
+    """Turn the encoding pool's back-pressure into a 503, so clients can tell it apart from a failed match"""
+    if BUSY_MESSAGE in errors:
+        raise ServiceError(503, BUSY_MESSAGE, {'Retry-After': str(SERVICE_RETRY_AFTER)})
+
+
+async def recognize(request: Request) -> JSONResponse:
+    user = await authenticate(request)
+    form = await request.form()
+    image = await read_image(form.get('photo'))
+    tolerance = form_float(form.get('tolerance'), 0.6, 'tolerance')
+    manager = request.app.state.face_manager
+    location, device_info = form.get('location', ''), form.get('device_info', '')
+
+    if form_flag(form.get('all_faces')):
+        faces, error = await run_in_threadpool(
+            manager.recognize_faces_in_image, image, tolerance, user['id'],
+            RECOGNITION_METHOD, location, device_info,
+        )
+        check_busy(error)
+        return JSONResponse({
+            'faces': [{'box': list(face['box']), 'name': face['name'], 'face_id': face['face_id'],
+                       'confidence': round(face['confidence'], 2)} for face in faces],
+            'error': error,
+        })
+
+    if form.get('top_k'):
+        try:
+            k = min(max(int(form['top_k']), 1), 100)
+        except ValueError:
+            raise ServiceError(400, "'top_k' must be a whole number")
+        ranked, error = await run_in_threadpool(
+            manager.recognize_face_ranked, image, k, tolerance, user['id'], RECOGNITION_METHOD, location, device_info,
+        )
+        check_busy(error)
+        return JSONResponse(ranked_json(ranked, error, tolerance))
+
+    result = await run_in_threadpool(
+        manager.recognize_face, image, tolerance, user['id'], RECOGNITION_METHOD, location, device_info,
+    )
+    check_busy(result[1])
+    return JSONResponse(match_json(*result))
+
+
+async def recognize_batch(request: Request) -> JSONResponse:
+    user = await authenticate(request)
+    form = await request.form(max_files=SERVICE_MAX_BATCH)
+    uploads = form.getlist('photos')
+    if not uploads:
+        raise ServiceError(400, "Upload one or more 'photos' files")
+    images = [await read_image(upload) for upload in uploads]
+    tolerance = form_float(form.get('tolerance'), 0.6, 'tolerance')
+
+    results = await run_in_threadpool(
+        request.app.state.face_manager.recognize_faces_batch, images, tolerance, user['id'],
+        RECOGNITION_METHOD, form.get('location', ''), form.get('device_info', ''),
+    )
+    check_busy(*(error for _, error, _, _ in results))
+    return JSONResponse({'results': [dict(match_json(*result), file=upload.filename)
+                                     for upload, result in zip(uploads, results)]})
+
+
+def page_cursor(params, default_limit: int):
+    """(after, limit) from the after_ts/after_id/limit query parameters"""
+    try:
+        limit = min(max(int(params.get('limit', default_limit)), 1), 1000)
+        after = None
+        if params.get('after_ts') and params.get('after_id'):
+            after = (params['after_ts'], int(params['after_id']))
+    except ValueError:
+        raise ServiceError(400, "'limit' and 'after_id' must be whole numbers")
+    return after, limit
+
+
+def next_cursor_json(next_cursor) -> Optional[dict]:
+    return {'after_ts': next_cursor[0], 'after_id': next_cursor[1]} if next_cursor else None
+
+
+async def faces(request: Request) -> JSONResponse:
+    """Profiles only; thumbnails are fetched separately so they can be cached by the client"""
+    # Profiles carry contact details; the gallery is admin-only in the app too
+    await authenticate(request, admin=True)
+    params = request.query_params
+    after, limit = page_cursor(params, GALLERY_PAGE_SIZE)
+    page, next_cursor = await run_in_threadpool(
+        request.app.state.face_manager.get_faces_page, params.get('q', ''), after, limit,
+    )
+    for face in page:
+        face['thumbnail'] = f"/faces/{face['id']}/thumbnail" if face['thumbnail'] else None
+    return JSONResponse({'faces': page, 'next_cursor': next_cursor_json(next_cursor)})
+
+
+async def face_thumbnail(request: Request) -> Response:
+    await authenticate(request, admin=True)
+    thumbnail = await run_in_threadpool(
+        request.app.state.face_manager.get_face_photo, request.path_params['face_id'], True,
+    )
+    if thumbnail is None:
+        raise ServiceError(404, "No photo stored for this face")
+    # A face's enrollment photo never changes
+    return Response(thumbnail, media_type='image/jpeg', headers={'Cache-Control': 'private, max-age=86400'})
+
+
+async def add_sample(request: Request) -> JSONResponse:
+    await authenticate(request, admin=True)
+    form = await request.form()
+    upload = form.get('photo')
+    image = await read_image(upload)
+    await upload.seek(0)
+    photo_bytes = await upload.read()
+    success, message = await run_in_threadpool(
+        request.app.state.face_manager.add_face_sample, request.path_params['face_id'], image, photo_bytes,
+    )
+    if not success:
+        raise ServiceError(404 if message == "Profile not found" else 422, message)
+    return JSONResponse({'face_id': request.path_params['face_id'], 'message': message}, status_code=201)
+
+
+def log_filters(user: dict, params) -> LogFilters:
+    """Admins see every log (optionally ?user_id=); other accounts only their own"""
+    user_id = user['id']
+    if user['user_type'] == 'admin':
+        user_id = params.get('user_id') or None
+    try:
+        return LogFilters(int(user_id) if user_id is not None else None,
+                          params.get('person') or None, params.get('method') or None,
+                          params.get('start') or None, params.get('end') or None)
+    except ValueError:
+        raise ServiceError(400, "'user_id' must be a whole number")
+
+
+def export_format(params) -> str:
+    fmt = params.get('format', 'csv')
+    if fmt not in available_formats():
+        raise ServiceError(400, f"'format' must be one of {', '.join(available_formats())}")
+    return fmt
+
+
+def export_response(path: str, rows: int, fmt: str, file_stem: str) -> FileResponse:
+    """Send an export file in chunks and delete it once the response has been sent"""
+    _, extension, mime = EXPORT_FORMATS[fmt]
+    return FileResponse(path, media_type=mime, filename=f"{file_stem}{extension}",
+                        headers={'X-Export-Rows': str(rows)}, background=BackgroundTask(os.remove, path))
+
+
+async def logs(request: Request) -> JSONResponse:
+    user = await authenticate(request)
+    params = request.query_params
+    filters = log_filters(user, params)
+    after, limit = page_cursor(params, LOG_PAGE_SIZE)
+
+    rows, next_cursor = await run_in_threadpool(
+        request.app.state.db_manager.get_recognition_logs_page, filters, after, limit,
+    )
+    return JSONResponse({
+        'logs': [{'id': row[0], 'user': row[1], 'person': row[2], 'confidence': row[3],
+                  'timestamp': row[4], 'method': row[5]} for row in rows],
+        'next_cursor': next_cursor_json(next_cursor),
+    })
+
+
+async def export_logs(request: Request) -> FileResponse:
+    user = await authenticate(request)
+    params = request.query_params
+    filters = log_filters(user, params)
+    fmt = export_format(params)
+    path, rows = await run_in_threadpool(request.app.state.db_manager.export_recognition_logs, filters, fmt)
+    return export_response(path, rows, fmt, 'recognition_logs')
+
+
+async def export_face_history(request: Request) -> FileResponse:
+    # Scan history names who scanned the face, where and on which device
+    await authenticate(request, admin=True)
+    params = request.query_params
+    face_id = request.path_params['face_id']
+    fmt = export_format(params)
+    path, rows = await run_in_threadpool(
+        request.app.state.face_manager.export_face_scan_history, face_id, fmt,
+        params.get('start') or None, params.get('end') or None,
+    )
+    return export_response(path, rows, fmt, f'face_{face_id}_scan_history')
+
+
+@asynccontextmanager
+async def lifespan(app: Starlette):
+    """Open the database and worker pool once per service process"""
+    state = app.state
+    state.db_manager = DatabaseManager()
+    state.encoder = EncodingService()
+    if MODEL_WARMUP:
+        state.encoder.warm_up()
+    state.cache = EncodingCache()
+    state.metrics_writer = start_file_export()
+    state.writer = RecognitionWriter(state.db_manager) if WRITE_BEHIND else None
+    state.face_manager = FaceRecognitionManager(state.db_manager, FaceGallery(state.db_manager),
+                                                state.encoder, state.writer, state.cache)
+    try:
+        yield
+    finally:
+        if state.writer is not None:
+            state.writer.close()
+        state.encoder.shutdown()
+        state.db_manager.pool.close()
+        if state.metrics_writer is not None:
+            state.metrics_writer.close()
+
+
+app = Starlette(
+    routes=[
+        Route('/health', health),
+        Route('/metrics', metrics),
+        Route('/enroll', enroll, methods=['POST']),
+        Route('/recognize', recognize, methods=['POST']),
+        Route('/recognize/batch', recognize_batch, methods=['POST']),
+        Route('/faces', faces),
+        Route('/faces/{face_id:int}/thumbnail', face_thumbnail),
+        Route('/faces/{face_id:int}/samples', add_sample, methods=['POST']),
+        Route('/faces/{face_id:int}/history/export', export_face_history),
+        Route('/logs', logs),
+        Route('/logs/export', export_logs),
+    ],
+    exception_handlers={ServiceError: service_error},
+    lifespan=lifespan,
+)
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Run the recognition HTTP service")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    args = parser.parse_args()
+    uvicorn.run(app, host=args.host, port=args.port, timeout_keep_alive=SERVICE_KEEP_ALIVE)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+"""The app's hot queries must never scan a log or history table."""
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from check_query_plans import HOT_QUERIES, full_scans  # noqa: E402
+from schema import connect_memory, explain_query_plan  # noqa: E402
+
+
+@pytest.fixture(scope='module')
+def cursor():
+    conn = connect_memory()
+    yield conn.cursor()
+    conn.close()
+
+
+@pytest.mark.parametrize('name', list(HOT_QUERIES))
+def test_hot_query_uses_an_index(cursor, name):
+    sql, params = HOT_QUERIES[name]
+    plan = explain_query_plan(cursor, sql, params)
+    assert full_scans(sql, plan) == [], f"{name} scans a log table:\n" + "\n".join(plan)
+
+
+def test_full_scans_flags_an_unindexed_read(cursor):
+    sql = "SELECT * FROM recognition_logs rl WHERE rl.location = ?"
+    assert full_scans(sql, explain_query_plan(cursor, sql, ('gate',)))
+
+
+def test_full_scans_flags_an_index_scan_that_still_sorts():
+    # Fresh connection: a cached plan would not notice the dropped index
+    conn = connect_memory()
+    conn.execute("DROP INDEX idx_recognition_logs_time")
+    sql, params = HOT_QUERIES['recent_activity']
+    assert full_scans(sql, explain_query_plan(conn.cursor(), sql, params))
+    conn.close()
@@ -0,0 +1,271 @@
+"""Continuous recognition on a video stream (webcam, RTSP/HTTP URL or file).
+
+Running HOG detection and dlib encoding on every frame caps a CPU at a few
+frames per second. Instead faces are detected every ``detect_every`` frames
+and followed in between by a lightweight tracker: a handful of corner
+points inside each face box are tracked with pyramidal Lucas-Kanade optical
+flow and the box follows their median motion and spread. On detection frames the
+detections are matched to existing tracks by box overlap, and only faces
+that start a new track are encoded and identified; a track keeps its
+identity for as long as it is followed.
+
+Like ``face_pipeline`` this module has no Streamlit or database
+dependencies; identification is a callback supplied by the caller.
+"""
+import os
+import time
+from typing import Callable, Iterator, List, NamedTuple, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from face_pipeline import Box, detect_faces, encode_faces
+
+# Frames between full face detections (1 detects on every frame)
+VIDEO_DETECT_EVERY = int(os.environ.get('KHOYA_VIDEO_DETECT_EVERY', '5'))
+# Longest side of the copy used for detection on video frames
+VIDEO_DETECTION_MAX_SIDE = int(os.environ.get('KHOYA_VIDEO_DETECTION_MAX_SIDE', '480'))
+# Detection rounds a track may go unmatched before it is dropped
+VIDEO_TRACK_MAX_MISSES = int(os.environ.get('KHOYA_VIDEO_TRACK_MAX_MISSES', '2'))
+# Minimum box overlap (IoU) for a detection to continue an existing track
+VIDEO_TRACK_MIN_IOU = float(os.environ.get('KHOYA_VIDEO_TRACK_MIN_IOU', '0.3'))
+# Detection rounds between retries for tracks that did not match anyone
+VIDEO_UNKNOWN_RETRY = int(os.environ.get('KHOYA_VIDEO_UNKNOWN_RETRY', '3'))
+
+# encodings (N x 128) -> [(face_id, name, confidence)], face_id/name None when unknown
+Identify = Callable[[np.ndarray], List[Tuple[Optional[int], Optional[str], float]]]
+
+LK_PARAMS = dict(winSize=(15, 15), maxLevel=2,
+                 criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03))
+
+
+class Track:
+    """A face followed across frames"""
+
+    def __init__(self, track_id: int, box: Box):
+        self.track_id = track_id
+        self.box = box
+        self.points = np.empty((0, 1, 2), dtype=np.float32)
+        self.face_id = None
+        self.name = None
+        self.confidence = 0.0
+        self.identified = False
+        self.misses = 0
+        self.rounds_since_encode = 0
+        self.frames = 0
+
+
+class FrameResult(NamedTuple):
+    """What the pipeline knows about one frame"""
+    index: int
+    tracks: List[Track]
+    detected: bool
+    new_tracks: List[Track]
+
+
+class VideoMetrics:
+    """Rolling throughput and per-stage timings for the stream"""
+
+    def __init__(self, smoothing: float = 0.9):
+        self.smoothing = smoothing
+        self.frames = 0
+        self.detections = 0
+        self.encodes = 0
+        self.fps = 0.0
+        self.stage_ms = {'detect': 0.0, 'track': 0.0, 'encode': 0.0}
+        self._last_frame = None
+
+    def frame_done(self):
+        now = time.perf_counter()
+        if self._last_frame is not None:
+            instant = 1.0 / max(now - self._last_frame, 1e-6)
+            self.fps = instant if self.frames <= 1 else self.smoothing * self.fps + (1 - self.smoothing) * instant
+        self._last_frame = now
+        self.frames += 1
+
+    def stage(self, name: str, elapsed: float):
+        previous = self.stage_ms[name]
+        current = elapsed * 1000
+        self.stage_ms[name] = current if previous == 0.0 else self.smoothing * previous + (1 - self.smoothing) * current
+
+    def snapshot(self) -> dict:
+        return {'fps': self.fps, 'frames': self.frames, 'detections': self.detections,
+                'encodes': self.encodes, **{f'{name}_ms': ms for name, ms in self.stage_ms.items()}}
+
+
+def box_iou(a: Box, b: Box) -> float:
+    top, right = max(a[0], b[0]), min(a[1], b[1])
+    bottom, left = min(a[2], b[2]), max(a[3], b[3])
+    inter = max(0, right - left) * max(0, bottom - top)
+    area = lambda box: (box[1] - box[3]) * (box[2] - box[0])
+    union = area(a) + area(b) - inter
+    return inter / union if union else 0.0
+
+
+def open_capture(source) -> cv2.VideoCapture:
+    """Open a camera index ("0"), stream URL or video file path"""
+    if isinstance(source, str) and source.strip().isdigit():
+        source = int(source)
+    capture = cv2.VideoCapture(source)
+    if not capture.isOpened():
+        raise IOError(f"Could not open video source: {source}")
+    return capture
+
+
+class VideoRecognizer:
+    """Detect every Nth frame, track in between and identify new tracks only"""
+
+    def __init__(self, identify: Identify, detect_every: int = VIDEO_DETECT_EVERY,
+                 detection_max_side: int = VIDEO_DETECTION_MAX_SIDE,
+                 max_misses: int = VIDEO_TRACK_MAX_MISSES, min_iou: float = VIDEO_TRACK_MIN_IOU,
+                 unknown_retry: int = VIDEO_UNKNOWN_RETRY):
+        self.identify = identify
+        self.detect_every = max(1, detect_every)
+        self.detection_max_side = detection_max_side
+        self.max_misses = max_misses
+        self.min_iou = min_iou
+        self.unknown_retry = unknown_retry
+        self.metrics = VideoMetrics()
+        self.tracks: List[Track] = []
+        self._next_track_id = 1
+        self._prev_gray = None
+        self._index = 0
+
+    def _seed_points(self, gray: np.ndarray, track: Track):
+        top, right, bottom, left = track.box
+        mask = np.zeros(gray.shape, dtype=np.uint8)
+        mask[max(0, top):max(0, bottom), max(0, left):max(0, right)] = 255
+        points = cv2.goodFeaturesToTrack(gray, maxCorners=20, qualityLevel=0.01, minDistance=3, mask=mask)
+        track.points = points if points is not None else np.empty((0, 1, 2), dtype=np.float32)
+
+    def _follow(self, gray: np.ndarray):
+        """Move and rescale every track by the optical flow of its points"""
+        tracked = [track for track in self.tracks if len(track.points)]
+        if self._prev_gray is None or not tracked:
+            return
+        points = np.concatenate([track.points for track in tracked])
+        moved, status, _ = cv2.calcOpticalFlowPyrLK(self._prev_gray, gray, points, None, **LK_PARAMS)
+        status = status.ravel() == 1
+        height, width = gray.shape
+        start = 0
+        for track in tracked:
+            end = start + len(track.points)
+            good = status[start:end]
+            if good.sum() < 3:
+                track.points = np.empty((0, 1, 2), dtype=np.float32)
+            else:
+                before = points[start:end][good].reshape(-1, 2)
+                after = moved[start:end][good].reshape(-1, 2)
+                dx, dy = np.median(after - before, axis=0)
+                # Scale by how far the points spread from their centre (faces moving closer/away)
+                spread_before = np.median(np.linalg.norm(before - before.mean(axis=0), axis=1))
+                spread_after = np.median(np.linalg.norm(after - after.mean(axis=0), axis=1))
+                scale = spread_after / spread_before if spread_before > 1.0 else 1.0
+                top, right, bottom, left = track.box
+                cx, cy = (left + right) / 2 + dx, (top + bottom) / 2 + dy
+                half_w, half_h = (right - left) * scale / 2, (bottom - top) * scale / 2
+                track.box = (int(np.clip(cy - half_h, 0, height)), int(np.clip(cx + half_w, 0, width)),
+                             int(np.clip(cy + half_h, 0, height)), int(np.clip(cx - half_w, 0, width)))
+                track.points = after.reshape(-1, 1, 2)
+            start = end
+
+    def _associate(self, gray: np.ndarray, boxes: List[Box]) -> List[Track]:
+        """Match detections to tracks by IoU; returns the tracks started by this detection"""
+        pairs = sorted(((box_iou(track.box, box), t, d) for t, track in enumerate(self.tracks)
+                        for d, box in enumerate(boxes)), reverse=True)
+        matched_tracks, matched_boxes = set(), set()
+        for overlap, t, d in pairs:
+            if overlap < self.min_iou:
+                break
+            if t in matched_tracks or d in matched_boxes:
+                continue
+            matched_tracks.add(t)
+            matched_boxes.add(d)
+            track = self.tracks[t]
+            track.box = boxes[d]
+            track.misses = 0
+            track.rounds_since_encode += 1
+            self._seed_points(gray, track)
+
+        survivors = []
+        for t, track in enumerate(self.tracks):
+            if t not in matched_tracks:
+                track.misses += 1
+                if track.misses > self.max_misses:
+                    continue
+            survivors.append(track)
+        self.tracks = survivors
+
+        new_tracks = []
+        for d, box in enumerate(boxes):
+            if d in matched_boxes:
+                continue
+            track = Track(self._next_track_id, box)
+            self._next_track_id += 1
+            self._seed_points(gray, track)
+            self.tracks.append(track)
+            new_tracks.append(track)
+        return new_tracks
+
+    def _identify(self, rgb: np.ndarray, tracks: List[Track]):
+        start = time.perf_counter()
+        encodings = encode_faces(rgb, [track.box for track in tracks])
+        if len(encodings) == len(tracks) and len(encodings) > 0:
+            for track, (face_id, name, confidence) in zip(tracks, self.identify(np.vstack(encodings))):
+                track.face_id, track.name, track.confidence = face_id, name, confidence
+                track.identified = True
+                track.rounds_since_encode = 0
+        self.metrics.encodes += len(tracks)
+        self.metrics.stage('encode', time.perf_counter() - start)
+
+    def process(self, frame: np.ndarray) -> FrameResult:
+        """Advance the pipeline by one BGR frame"""
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        detected = self._index % self.detect_every == 0
+        new_tracks = []
+
+        start = time.perf_counter()
+        self._follow(gray)
+        self.metrics.stage('track', time.perf_counter() - start)
+
+        if detected:
+            rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            start = time.perf_counter()
+            boxes = detect_faces(rgb, self.detection_max_side)
+            self.metrics.stage('detect', time.perf_counter() - start)
+            self.metrics.detections += 1
+
+            new_tracks = self._associate(gray, boxes)
+            retry = [track for track in self.tracks
+                     if track.identified and track.face_id is None and track not in new_tracks
+                     and track.rounds_since_encode >= self.unknown_retry]
+            if new_tracks or retry:
+                self._identify(rgb, new_tracks + retry)
+
+        for track in self.tracks:
+            track.frames += 1
+        self._prev_gray = gray
+        self._index += 1
+        self.metrics.frame_done()
+        return FrameResult(self._index - 1, list(self.tracks), detected, new_tracks)
+
+    def run(self, capture: cv2.VideoCapture, max_frames: Optional[int] = None) -> Iterator[Tuple[np.ndarray, FrameResult]]:
+        """Yield (frame, result) until the source ends or ``max_frames`` frames were read"""
+        while max_frames is None or self._index < max_frames:
+            ok, frame = capture.read()
+            if not ok:
+                return
+            yield frame, self.process(frame)
+
+
+def draw_tracks(frame: np.ndarray, tracks: List[Track]) -> np.ndarray:
+    """Copy of a BGR frame with a labelled box per track"""
+    annotated = frame.copy()
+    for track in tracks:
+        top, right, bottom, left = track.box
+        known = track.face_id is not None
+        color = (0, 200, 0) if known else (0, 0, 220)
+        label = f"{track.name} ({track.confidence:.0f}%)" if known else ("Unknown" if track.identified else "...")
+        cv2.rectangle(annotated, (left, top), (right, bottom), color, 2)
+        cv2.putText(annotated, label, (left, max(12, top - 6)), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 1, cv2.LINE_AA)
+    return annotated